@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Offline microbenchmarks for the engine.  Run from the repo root:
+#   python -m bench --output baseline.json
+#   python -m bench --compare baseline.json
+import argparse
+import logging
+import sys
+
+from . import engine, reddit, world  # Just so the benchmarks get registered
+from .runner import all_benchmarks, compare, load, parse_size, run, save
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument("-o", "--output",
+                      default=None,
+                      help="Write results as JSON to this file")
+    argp.add_argument("-c", "--compare",
+                      default=None,
+                      help="Baseline JSON to compare results against")
+    argp.add_argument("-t", "--threshold",
+                      type=float,
+                      default=1.25,
+                      help="Slowdown ratio that counts as a regression")
+    argp.add_argument("-s", "--sizes",
+                      default="11x5,21x11,41x21",
+                      help="Board sizes, as comma-separated COLUMNSxROWS")
+    argp.add_argument("-r", "--repeat",
+                      type=int,
+                      default=5,
+                      help="Repetitions per benchmark")
+    argp.add_argument("names",
+                      nargs="*",
+                      help="Only run these benchmarks, out of: %s" %
+                           ", ".join(sorted(all_benchmarks.keys())))
+    args = argp.parse_args()
+    unknown = set(args.names) - set(all_benchmarks.keys())
+    if unknown:
+        argp.error("Unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    logging.basicConfig(level=logging.WARN)
+
+    def progress(key, stats):
+        print("%-28s median %9.3fms  min %9.3fms" % (
+            key, stats['median'] * 1000, stats['min'] * 1000))
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')
+             if size.strip()]
+    current = run(args.names, sizes, args.repeat, progress)
+    if args.output:
+        save(current, args.output)
+
+    if args.compare:
+        regressions = compare(current, load(args.compare), args.threshold)
+        if regressions:
+            print("\nRegressions (more than %.2fx the baseline):" %
+                  args.threshold)
+            for key, old, new, ratio in regressions:
+                print("%-28s %9.3fms -> %9.3fms (%.2fx)" % (
+                    key, old * 1000, new * 1000, ratio))
+            sys.exit(1)
+        print("\nNo regressions against %s" % args.compare)
+
+
+if __name__ == '__main__':
+    main()
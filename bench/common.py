@@ -0,0 +1,171 @@
+# Stand-ins for running the engine offline, in the same spirit as the
+# MockConf/TestOutsider pair in test/common.py: an in-memory SQLite DB and
+# an Outsider that never talks to anybody.
+from configparser import ConfigParser
+
+from chromabot2.battle import Battle, Troop
+from chromabot2.config import Snapshot
+from chromabot2.models import User
+from chromabot2.outsiders import NullOutsider
+
+try:
+    from chromabot2.reddit import RedditOutsider
+except ImportError:  # No praw, no reddit benchmarks
+    RedditOutsider = None
+
+
+class BenchConf(object):
+
+    def __init__(self, columns=11, rows=5, troop_delay=0):
+        self.data = ConfigParser()
+        self.data.read_dict({
+            'bot': {
+                'dbstring': "sqlite://",
+                'metrics_summary': "0",
+            },
+            'battle': {
+                'delay': "0",
+                'time': "7200",
+                'columns': str(columns),
+                'rows': str(rows),
+                # By default, every troop moves on every update
+                'troop_delay': str(troop_delay),
+                'goal_score': "2",
+                'kill_score': "1",
+            },
+            'reddit': {
+                'useragent': "chroma benchmarks",
+                'client_id': "bench",
+                'client_secret': "bench",
+                'redirect_uri': "http://localhost/",
+                'refresh_token': "bench",
+                'username': "chromabot",
+                'headquarters': "chromanauts",
+                'disputed_zone': "fieldofkarmicglory",
+                'assignment': "uid",
+                'pm_only': "true",
+            },
+            'icons_0': {'infantry': "I", 'cavalry': "C", 'ranged': "R",
+                        'unknown': "?"},
+            'icons_1': {'infantry': "i", 'cavalry': "c", 'ranged': "r",
+                        'unknown': "?"},
+        })
+        self.snapshot = None
+        self.refresh()
+
+    def refresh(self):
+        self.snapshot = Snapshot.from_parser(self.data)
+
+    def __contains__(self, item):
+        return item in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __getattr__(self, key):
+        return self.data[key]
+
+
+class BenchOutsider(NullOutsider):
+
+    def __init__(self, config, clock=None):
+        super().__init__(config, clock)
+        self.provided_messages = []
+
+    def get_messages(self):
+        result = self.provided_messages
+        self.provided_messages = []
+        return result
+
+
+if RedditOutsider:
+    class BenchRedditOutsider(RedditOutsider):
+        """The real reddit outsider, minus the connection to reddit, for
+        the parts that only need the DB (rendering, comment conversion)"""
+
+        def __init__(self, config):
+            NullOutsider.__init__(self, config)
+            self.setup_remote(config.reddit)
+            self.reddit = None
+
+        def populate_battle_data(self, battle, data):
+            data['reddit'] = {
+                'fullname': 't3_bench%d' % battle.id,
+                'id36': 'bench%d' % battle.id,
+            }
+
+        # Nothing to post to offline
+        def update_battle(self, battle):
+            pass
+
+        def report_battle_end(self, battle):
+            pass
+else:
+    BenchRedditOutsider = None
+
+
+class World:
+    """A fresh in-memory DB with enough players to fill a board"""
+
+    def __init__(self, columns=11, rows=5, outsider_class=BenchOutsider):
+        self.columns = columns
+        self.rows = rows
+        self.config = BenchConf(columns, rows)
+        self.outside = outsider_class(self.config)
+        self.db = self.outside.db
+        self.db.create_all()
+        self.users = [[], []]
+
+    def add_players(self, count, team):
+        with self.db.session() as s:
+            start = len(self.users[team])
+            for index in range(start, start + count):
+                user = User(name="player%d_%d" % (team, index), team=team,
+                            leader=False, defectable=True, recruited=0)
+                s.add(user)
+                for troop_type in ("infantry", "cavalry", "ranged"):
+                    s.add(Troop(owner=user, hp=1, type=troop_type, row=0,
+                                col=0, visible=False, opposed=False,
+                                last_move=0))
+                self.users[team].append(user)
+
+    def battle(self, active=True):
+        battle = Battle.create(self.outside)
+        if active:
+            battle.start()
+        return battle
+
+    def plan(self, density=0.5):
+        """Picks troops and squares to cover `density` of each team's half
+        of the board, recruiting players as needed.  Returns a list of
+        (troop, row, col)."""
+        half = self.columns // 2
+        cells = [[], []]
+        for row in range(self.rows):
+            for col in range(half):
+                cells[0].append((row, col))
+            for col in range(half + 1, self.columns):
+                cells[1].append((row, col))
+
+        planned = []
+        for team in (0, 1):
+            wanted = int(len(cells[team]) * density)
+            needed = (wanted + 2) // 3 - len(self.users[team])
+            if needed > 0:
+                self.add_players(needed, team)
+            troops = [troop for user in self.users[team]
+                      for troop in user.troops if troop.is_deployable()]
+            # Spread them out so both teams end up in every row
+            stride = max(1, len(cells[team]) // max(wanted, 1))
+            spots = cells[team][::stride][:wanted]
+            planned.extend((troop, row, col)
+                           for (row, col), troop in zip(spots, troops))
+        return planned
+
+    def fill(self, battle, density=0.5):
+        """Deploys troops per plan(); returns the deployed troops"""
+        placed = []
+        for troop, row, col in self.plan(density):
+            battle.place_troop(troop, col=col, row=row, outside=self.outside)
+            placed.append(troop)
+        return placed
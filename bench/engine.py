@@ -0,0 +1,139 @@
+# Benchmarks for the engine's hot paths
+import random
+
+from chromabot2.battle import Battle
+from chromabot2.parser import parse, parse_recipe
+
+from .common import BenchRedditOutsider, World
+from .runner import benchmark
+
+COMMANDS = [
+    "attack at c4 with infantry",
+    "oppose #3 at h,2 with cavalry",
+    "support at a1 with ranged",
+    "status",
+    "defect",
+    "attack at q12 with a rubber chicken",
+    "attack#7 at a1 with infantry",
+]
+
+# Every benchmark gets its own generator with the same seed, so each run
+# times exactly the same work and comparisons against a baseline hold
+SEED = 1234
+
+
+@benchmark("battle_create")
+def battle_create(columns, rows):
+    world = World(columns, rows)
+    return lambda: Battle.create(world.outside)
+
+
+@benchmark("place_troop")
+def place_troop(columns, rows):
+    world = World(columns, rows)
+    battle = world.battle()
+    planned = world.plan()
+
+    def run():
+        for troop, row, col in planned:
+            battle.place_troop(troop, col=col, row=row, outside=world.outside)
+    return run
+
+
+@benchmark("move_troop")
+def move_troop(columns, rows):
+    world = World(columns, rows)
+    battle = world.battle()
+    troops = world.fill(battle)
+
+    def run():
+        for troop in troops:
+            if troop.is_alive() and troop.battle:
+                battle.move_troop(troop, world.outside)
+    return run
+
+
+@benchmark("battle_update")
+def battle_update(columns, rows):
+    world = World(columns, rows)
+    battle = world.battle()
+    world.fill(battle)
+    return lambda: battle.update(world.outside)
+
+
+@benchmark("realize_board")
+def realize_board(columns, rows):
+    world = World(columns, rows)
+    battle = world.battle()
+    world.fill(battle)
+    return battle.realize_board
+
+
+@benchmark("visual_state")
+def visual_state(columns, rows):
+    if not BenchRedditOutsider:
+        return None
+    world = World(columns, rows, outsider_class=BenchRedditOutsider)
+    battle = world.battle()
+    world.fill(battle)
+    return lambda: world.outside.visual_state(battle)
+
+
+@benchmark("parse_cold", sized=False)
+def parse_cold():
+    parse_recipe.cache_clear()
+    rng = random.Random(SEED)
+    commands = [rng.choice(COMMANDS) for _ in range(1000)]
+    # Every command distinct, so nothing comes out of the cache
+    commands = ["%s%s" % (cmd, " " * index)
+                for index, cmd in enumerate(commands)]
+    return lambda: [parse(cmd) for cmd in commands]
+
+
+@benchmark("parse_warm", sized=False)
+def parse_warm():
+    rng = random.Random(SEED)
+    commands = [rng.choice(COMMANDS) for _ in range(1000)]
+    for cmd in COMMANDS:
+        parse(cmd)
+    return lambda: [parse(cmd) for cmd in commands]
+
+
+class FakeAuthor:
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeComment:
+
+    def __init__(self, name, author, body):
+        self.name = name
+        self.author = FakeAuthor(author)
+        self.body = body
+        self.was_comment = True
+        self.permalink = "https://reddit.com/%s" % name
+
+    def mark_as_read(self):
+        pass
+
+    def reply(self, text):
+        pass
+
+
+@benchmark("convert_comments", sized=False)
+def convert_comments():
+    if not BenchRedditOutsider:
+        return None
+    world = World(outsider_class=BenchRedditOutsider)
+    world.add_players(50, 0)
+    world.add_players(50, 1)
+    battle = world.battle()
+    names = [user.name for team in world.users for user in team]
+    rng = random.Random(SEED)
+    comments = [
+        FakeComment("t1_%d" % index, rng.choice(names),
+                    ">%s" % rng.choice(COMMANDS))
+        for index in range(1000)
+    ]
+    return lambda: world.outside.convert_comments(comments, battle=battle)
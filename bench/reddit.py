@@ -0,0 +1,74 @@
+# Benchmarks for the whole reddit outsider, talking to the offline fake in
+# chromabot2.fakereddit instead of reddit
+import random
+
+from chromabot2.commands import Result
+
+from .common import World
+from .engine import COMMANDS, SEED
+from .runner import benchmark
+
+try:
+    from chromabot2.fakereddit import FakeRedditOutsider
+except ImportError:  # No praw, no reddit benchmarks
+    FakeRedditOutsider = None
+
+THREAD_COMMENTS = 10000
+PLAYERS = 100
+
+
+def fake_world():
+    world = World(outsider_class=FakeRedditOutsider)
+    world.add_players(PLAYERS // 2, 0)
+    world.add_players(PLAYERS // 2, 1)
+    names = [user.name for team in world.users for user in team]
+    return world, world.outside.reddit, names
+
+
+@benchmark("reddit_get_messages", sized=False)
+def reddit_get_messages():
+    if not FakeRedditOutsider:
+        return None
+    world, reddit, names = fake_world()
+    rng = random.Random(SEED)
+    world.battle()
+    post = reddit.posts[-1]
+    for _ in range(THREAD_COMMENTS):
+        reddit.comment(post, rng.choice(names),
+                       ">%s" % rng.choice(COMMANDS))
+    for _ in range(100):
+        reddit.message(rng.choice(names), rng.choice(COMMANDS))
+    return world.outside.get_messages
+
+
+@benchmark("reddit_recruits", sized=False)
+def reddit_recruits():
+    if not FakeRedditOutsider:
+        return None
+    world, reddit, names = fake_world()
+    hq = reddit.post("chromanauts", "[Recruitment] Sign up here")
+    for index in range(1000):
+        reddit.comment(hq, "recruit%d" % index, "Me!")
+    # Plus people who've already signed up
+    for name in names:
+        reddit.comment(hq, name, "Me again")
+    return world.outside.handle_recruits
+
+
+@benchmark("reddit_report_results", sized=False)
+def reddit_report_results():
+    if not FakeRedditOutsider:
+        return None
+    world, reddit, names = fake_world()
+    rng = random.Random(SEED)
+    world.battle()
+    post = reddit.posts[-1]
+    # Five commands a comment
+    for _ in range(THREAD_COMMENTS // 5):
+        reddit.comment(post, rng.choice(names),
+                       "\n".join(">%s" % rng.choice(COMMANDS)
+                                 for _ in range(5)))
+    messages = world.outside.get_messages()
+    results = [Result("Done: %s" % message.raw_text, message)
+               for message in messages]
+    return lambda: world.outside.report_results(results)
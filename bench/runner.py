@@ -0,0 +1,88 @@
+import json
+import platform
+import statistics
+import time
+
+all_benchmarks = {}
+
+
+def benchmark(name, sized=True):
+    """Registers a benchmark.
+
+    The decorated function does any setup it needs and returns a
+    zero-argument callable; only that callable is timed.  It's called again
+    for every repetition, so benchmarks that change the world get a fresh
+    one each time.  Sized benchmarks get called with (columns, rows).
+    """
+    def wrap(func):
+        all_benchmarks[name] = (func, sized)
+        return func
+    return wrap
+
+
+def parse_size(text):
+    columns, _, rows = text.lower().partition('x')
+    return int(columns), int(rows)
+
+
+def run(names=None, sizes=((11, 5),), repeat=5, progress=None):
+    """Returns {"meta": ..., "results": {key: stats}}, where keys look like
+    `battle_update[21x11]`"""
+    results = {}
+    for name, (func, sized) in sorted(all_benchmarks.items()):
+        if names and name not in names:
+            continue
+        for size in (sizes if sized else [None]):
+            key = name
+            if size:
+                key = "%s[%dx%d]" % (name, size[0], size[1])
+            timings = []
+            for _ in range(repeat):
+                call = func(*size) if size else func()
+                if call is None:  # Benchmark can't run here
+                    break
+                start = time.perf_counter()
+                call()
+                timings.append(time.perf_counter() - start)
+            if not timings:
+                continue
+            results[key] = {
+                'min': min(timings),
+                'median': statistics.median(timings),
+                'mean': statistics.mean(timings),
+                'repeat': len(timings),
+            }
+            if progress:
+                progress(key, results[key])
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.time(),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=1.25):
+    """Returns a list of (key, baseline median, current median, ratio) for
+    every benchmark that got slower than `threshold` times the baseline"""
+    regressions = []
+    for key, stats in sorted(current['results'].items()):
+        old = baseline['results'].get(key)
+        if not old or not old['median']:
+            continue
+        ratio = stats['median'] / old['median']
+        if ratio > threshold:
+            regressions.append((key, old['median'], stats['median'], ratio))
+    return regressions
+
+
+def save(data, path):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
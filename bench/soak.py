@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# Soak test: drives Chromabot.loop_once with scripted command traffic and
+# reports whether one bot instance keeps up.  Run from the repo root:
+#   python -m bench.soak --players 500 --rate 1200 --frames 200
+#
+# Traffic and the game both run on a virtual clock (the outsider's
+# FixedClock), so troop delays and battle lengths play out in virtual time
+# too.  Each frame, the clock moves forward by
+# the bot's frame interval or by however long the frame really took,
+# whichever is longer, and every command that "arrived" in that time lands
+# in the inbox.  A bot that can't keep up takes longer than the interval,
+# so more traffic piles in and the backlog grows.
+#
+# With --reddit, the traffic is comments on the battle's post instead, read
+# by the real reddit outsider from the fake reddit in chromabot2.fakereddit.
+import argparse
+import json
+import logging
+import random
+import resource
+import statistics
+import time
+import tracemalloc
+from collections import deque
+
+from chromabot2.battle import Battle
+from chromabot2.bot import Chromabot
+from chromabot2.metrics import Metrics
+from chromabot2.models import User
+from chromabot2.outsiders import Message
+from chromabot2.utils import FixedClock, col_to_letter
+from chromabot2.worldgen import TROOP_TYPES, generate_world
+
+from .common import BenchConf, BenchOutsider
+
+try:
+    from chromabot2.fakereddit import FakeRedditOutsider
+except ImportError:  # No praw
+    FakeRedditOutsider = None
+
+DEFAULT_MIX = {'attack': 0.8, 'status': 0.15, 'defect': 0.05}
+
+
+class Traffic:
+    """Generates a mix of commands from many players at a given rate, and
+    hands each to deliver()"""
+
+    def setup_traffic(self, rate=600, mix=None, max_batch=1000, seed=0):
+        self.rate = rate / 60.0  # Per virtual second
+        self.mix = mix or DEFAULT_MIX
+        self.max_batch = max_batch
+        self.rng = random.Random(seed)
+        self.players = []
+        self.started = self.clock.now()
+        self.next_arrival = self.started
+        self.delivered = 0
+        self.results = 0
+
+    def load_players(self):
+        with self.db.session() as s:
+            self.players = s.query(User).all()
+
+    def command_for(self, player):
+        kinds = list(self.mix.keys())
+        kind = self.rng.choices(kinds, [self.mix[k] for k in kinds])[0]
+        if kind != 'attack':
+            return kind
+        settings = self.config.snapshot.battle
+        half = settings.columns // 2
+        if player.team == 0:
+            col = self.rng.randrange(0, half)
+        else:
+            col = self.rng.randrange(half + 1, settings.columns)
+        return "attack at %s%d with %s" % (
+            col_to_letter(col).lower(),
+            self.rng.randint(1, settings.rows),
+            self.rng.choice(TROOP_TYPES))
+
+    @property
+    def elapsed(self):
+        return self.clock.now() - self.started
+
+    def advance(self, seconds):
+        """Moves the virtual clock on, queueing whatever arrived"""
+        self.clock.advance(seconds)
+        if not self.rate:
+            return
+        while self.next_arrival <= self.clock.now():
+            player = self.rng.choice(self.players)
+            self.deliver(player, self.command_for(player))
+            self.next_arrival += self.rng.expovariate(self.rate)
+
+    def report_results(self, results):
+        self.results += len(results)
+
+
+class ScriptedOutsider(Traffic, BenchOutsider):
+
+    def __init__(self, config, **kwargs):
+        super().__init__(config, clock=FixedClock())
+        self.inbox = deque()
+        self.setup_traffic(**kwargs)
+
+    def deliver(self, player, command):
+        self.inbox.append(Message(command, player, self))
+
+    def backlog(self):
+        return len(self.inbox)
+
+    def get_messages(self):
+        count = min(len(self.inbox), self.max_batch)
+        result = [self.inbox.popleft() for _ in range(count)]
+        self.delivered += count
+        return result
+
+
+if FakeRedditOutsider:
+    class ScriptedRedditOutsider(Traffic, FakeRedditOutsider):
+        """Commands arrive as comments on the battle's post.  The reddit
+        outsider reads the whole thread every frame, so max_batch doesn't
+        apply."""
+
+        def __init__(self, config, **kwargs):
+            super().__init__(config)
+            self.clock = FixedClock()
+            self.setup_traffic(**kwargs)
+            self.posted = 0
+            self.names = {}
+
+        def load_players(self):
+            super().load_players()
+            self.names = {player.id: player.name for player in self.players}
+            # generate_world's battles don't have posts yet
+            with self.db.session() as s:
+                for battle in s.query(Battle):
+                    if 'reddit' not in battle.outside_data:
+                        self.populate_battle_data(battle, battle.outside_data)
+
+        def deliver(self, player, command):
+            post = self.reddit.posts[-1]
+            self.reddit.comment(post, self.names[player.id], ">" + command)
+            self.posted += 1
+
+        def backlog(self):
+            return self.posted - self.delivered
+
+        def get_messages(self):
+            result = super().get_messages()
+            self.delivered += len(result)
+            return result
+
+        def report_results(self, results):
+            # Still send them, to see what that costs
+            super().report_results(results)
+            Traffic.report_results(self, results)
+else:
+    ScriptedRedditOutsider = None
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[min(len(ordered) - 1, index)]
+
+
+def slope(values):
+    """Least-squares growth per frame"""
+    if len(values) < 2:
+        return 0.0
+    xs = range(len(values))
+    mean_x = statistics.mean(xs)
+    mean_y = statistics.mean(values)
+    num = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, values))
+    den = sum((x - mean_x) ** 2 for x in xs)
+    return num / den
+
+
+def soak(players=200, rate=600, interval=60, frames=100, max_batch=1000,
+         mix=None, seed=0, columns=11, rows=5, troop_delay=180,
+         trace_memory=False, progress=None, reddit=False):
+    """Runs the soak and returns a report dict"""
+    config = BenchConf(columns, rows, troop_delay)
+    outsider_class = ScriptedRedditOutsider if reddit else ScriptedOutsider
+    outside = outsider_class(config, rate=rate, mix=mix,
+                             max_batch=max_batch, seed=seed)
+    outside.db.create_all()
+    generate_world(outside.db, config.snapshot.battle, users=players,
+                   battles=1, fill=0, seed=seed, now=outside.clock.now())
+    outside.load_players()
+    bot = Chromabot(outside, metrics=Metrics())
+
+    if trace_memory:
+        tracemalloc.start()
+
+    latencies = []
+    backlog = []
+    processed = []
+    memory = []
+    elapsed = 0.0
+    for number in range(frames):
+        outside.advance(max(interval, elapsed))
+        before = outside.delivered
+        start = time.perf_counter()
+        bot.loop_once()
+        elapsed = time.perf_counter() - start
+
+        latencies.append(elapsed)
+        processed.append(outside.delivered - before)
+        backlog.append(outside.backlog())
+        if trace_memory:
+            memory.append(tracemalloc.get_traced_memory()[0])
+        else:
+            # Linux reports this in KiB
+            memory.append(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                          * 1024)
+        if progress:
+            progress(number, elapsed, processed[-1], backlog[-1])
+
+    if trace_memory:
+        tracemalloc.stop()
+
+    # Only judge the second half; the first frames are warming up
+    tail = backlog[len(backlog) // 2:]
+    growth = slope(tail)
+    p90 = percentile(latencies, 90)
+    keeping_up = growth <= max(1.0, 0.01 * max_batch) and p90 <= interval
+
+    return {
+        'frames': frames,
+        'offered_per_minute': rate,
+        'processed_per_minute': sum(processed) / outside.elapsed * 60,
+        'virtual_seconds': outside.elapsed,
+        'latency': {
+            'p50': percentile(latencies, 50),
+            'p90': p90,
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+        },
+        'backlog': {
+            'final': backlog[-1],
+            'max': max(backlog),
+            'growth_per_frame': growth,
+        },
+        'memory': {
+            'source': 'tracemalloc' if trace_memory else 'maxrss',
+            'start': memory[0],
+            'end': memory[-1],
+            'peak': max(memory),
+        },
+        'results': outside.results,
+        'keeping_up': keeping_up,
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument("-p", "--players", type=int, default=200)
+    argp.add_argument("-r", "--rate", type=float, default=600,
+                      help="Offered commands per (virtual) minute")
+    argp.add_argument("-i", "--interval", type=float, default=60,
+                      help="Virtual seconds between frames, i.e. the bot's "
+                           "sleep")
+    argp.add_argument("-f", "--frames", type=int, default=100)
+    argp.add_argument("-b", "--max-batch", type=int, default=1000,
+                      help="Most messages get_messages hands over per frame")
+    argp.add_argument("-m", "--mix", type=parse_mix, default=None,
+                      help="Command mix, e.g. attack=0.8,status=0.15,"
+                           "defect=0.05")
+    argp.add_argument("-s", "--seed", type=int, default=0)
+    argp.add_argument("--columns", type=int, default=11)
+    argp.add_argument("--rows", type=int, default=5)
+    argp.add_argument("--troop-delay", type=int, default=180,
+                      help="Virtual seconds between troop moves")
+    argp.add_argument("--trace-memory", action="store_true",
+                      help="Track Python heap with tracemalloc (slower) "
+                           "instead of max RSS")
+    argp.add_argument("--reddit", action="store_true",
+                      help="Run the reddit outsider against a fake reddit")
+    argp.add_argument("-o", "--output", default=None,
+                      help="Write the report as JSON to this file")
+    args = argp.parse_args()
+    if args.reddit and not ScriptedRedditOutsider:
+        argp.error("--reddit needs praw installed")
+
+    logging.basicConfig(level=logging.WARN)
+
+    def progress(number, elapsed, processed, backlog):
+        print("frame %5d  %8.3fs  processed %6d  backlog %6d" % (
+            number, elapsed, processed, backlog))
+
+    report = soak(players=args.players, rate=args.rate,
+                  interval=args.interval, frames=args.frames,
+                  max_batch=args.max_batch, mix=args.mix, seed=args.seed,
+                  columns=args.columns, rows=args.rows,
+                  troop_delay=args.troop_delay,
+                  trace_memory=args.trace_memory, progress=progress,
+                  reddit=args.reddit)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if not report['keeping_up']:
+        print("\nWARNING: the bot is not keeping up with this load")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Benchmarks against large synthetic worlds, to see how the per-frame work
+# scales with the number of rows rather than the size of one board.
+from chromabot2.battle import Battle
+from chromabot2.bot import Chromabot
+from chromabot2.metrics import Metrics
+from chromabot2.models import User
+from chromabot2.worldgen import generate_world
+
+from .common import BenchRedditOutsider, World
+from .runner import benchmark
+
+WORLD_USERS = 10000
+WORLD_BATTLES = 4
+
+
+def synthetic(outsider_class=None):
+    world = World(21, 11, outsider_class=outsider_class or
+                  BenchRedditOutsider)
+    generate_world(world.db, world.config.snapshot.battle,
+                   users=WORLD_USERS, battles=WORLD_BATTLES, fill=0.5)
+    return world
+
+
+@benchmark("world_frame", sized=False)
+def world_frame():
+    if not BenchRedditOutsider:
+        return None
+    world = synthetic()
+    bot = Chromabot(world.outside, metrics=Metrics())
+    bot.metrics.begin_frame()
+    return bot.frame
+
+
+@benchmark("world_status_for", sized=False)
+def world_status_for():
+    if not BenchRedditOutsider:
+        return None
+    world = synthetic()
+    with world.db.session() as s:
+        users = s.query(User).limit(200).all()
+    return lambda: [world.outside.status_for(user) for user in users]
+
+
+@benchmark("world_render", sized=False)
+def world_render():
+    if not BenchRedditOutsider:
+        return None
+    world = synthetic()
+    with world.db.session() as s:
+        battles = s.query(Battle).all()
+    return lambda: [world.outside.visual_state(battle) for battle in battles]
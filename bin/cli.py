@@ -8,6 +8,7 @@ import sys
 sys.path.append(".")
 sys.path.append("./chromabot2")
 
+from chromabot2.bot import Chromabot
 from chromabot2.config import Config
 from chromabot2.reddit import RedditOutsider
 
@@ -57,7 +58,14 @@ def end_battle(battle):
     # TODO:  call the reddit outsider to update stuff
 
 
-# TODO: Re-create fast_battle
+def fast_battle(battle=None, factor=1000):
+    """Runs the bot with time sped up until `battle` (by default the first
+    one underway) is over"""
+    if battle is None:
+        battle = first(Battle, relevant=True)
+    bot = Chromabot(outsider)
+    return bot.fast_forward(battle, factor=factor)
+
 
 def timestr(secs=None):
     if secs is None:
@@ -72,7 +80,7 @@ def commit():
 
 
 def main():
-    global db
+    global db, outsider
 
     argp = argparse.ArgumentParser()
     argp.add_argument("-c", "--conf",
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import time
+
+from chromabot2.config import Config
+from chromabot2.db import DB
+from chromabot2.worldgen import generate_world
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description="Fill the configured DB with a synthetic world")
+    argp.add_argument("-c", "--conf",
+                      default=None,
+                      help="Configuration file location")
+    argp.add_argument("-u", "--users", type=int, default=10000)
+    argp.add_argument("-t", "--troops", type=int, default=3,
+                      help="Troops per user")
+    argp.add_argument("-b", "--battles", type=int, default=1)
+    argp.add_argument("-f", "--fill", type=float, default=0.3,
+                      help="Fraction of each team's half of each board to "
+                           "occupy")
+    argp.add_argument("-s", "--seed", type=int, default=0)
+    argp.add_argument("--drop", action="store_true",
+                      help="Drop and recreate all tables first")
+    args = argp.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    c = Config(args.conf)
+    dbconn = DB(c)
+    if args.drop:
+        dbconn.drop_all()
+    dbconn.create_all()
+
+    start = time.perf_counter()
+    summary = generate_world(dbconn, c.snapshot.battle,
+                             users=args.users,
+                             troops_per_user=args.troops,
+                             battles=args.battles,
+                             fill=args.fill,
+                             seed=args.seed)
+    logging.info("Generated %s in %.1fs", summary,
+                 time.perf_counter() - start)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# Adds whatever tables and columns an existing DB is missing.  The bot does
+# this itself on startup; this is for doing it ahead of time.
+from chromabot2.config import Config
+from chromabot2.db import DB
+from chromabot2 import archive, leases, models  # Just so they get registered
+
+
+def main():
+    c = Config()
+
+    dbconn = DB(c)
+    added = dbconn.upgrade()
+    for name in added:
+        print("Added %s" % name)
+    if not added:
+        print("Nothing to do")
+
+if __name__ == '__main__':
+    main()
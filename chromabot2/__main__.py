@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 import argparse
+import asyncio
 import logging
 
-from .bot import Chromabot
+from .asyncbot import AsyncChromabot
+from .bot import ROLES, Chromabot
 from .config import Config
+from .fakereddit import FakeRedditOutsider  # Just so it gets registered
 from .reddit import RedditOutsider  # Just so it gets registered
 from .outsiders import all_outsiders
+from .profiling import FrameProfiler
 
 
 def main():
@@ -17,6 +21,32 @@ def main():
     argp.add_argument("-c", "--conf",
                       default=None,
                       help="Configuration file location")
+    argp.add_argument("--role",
+                      default="all",
+                      choices=ROLES,
+                      help="ingest only reads and queues commands, simulate "
+                           "only runs the queue and the battles")
+    argp.add_argument("--async",
+                      dest="use_async",
+                      action="store_true",
+                      help="Run the asyncio bot, which overlaps outsider "
+                           "I/O (use with -o reddit-async)")
+    argp.add_argument("--profile",
+                      action="store_true",
+                      help="Profile every frame")
+    argp.add_argument("--profile-every",
+                      type=int,
+                      default=None,
+                      metavar="N",
+                      help="Profile every Nth frame (implies --profile)")
+    argp.add_argument("--profile-mode",
+                      default="cprofile",
+                      choices=FrameProfiler.MODES,
+                      help="cprofile writes .pstats and .collapsed files, "
+                           "sample only writes .collapsed but is far cheaper")
+    argp.add_argument("--profile-dir",
+                      default="profiles",
+                      help="Where to write profiling output")
     group = argp.add_mutually_exclusive_group()
     group.add_argument("-d", "--debug",
                        action="store_true",
@@ -40,8 +70,19 @@ def main():
     conf = Config(args.conf)
 
     outsider = all_outsiders[args.outsider](conf)
-    bot = Chromabot(outsider)
-    bot.loop_forever()
+    # Columns added since the DB was made (battles.lease_owner, say)
+    outsider.db.upgrade()
+    profiler = None
+    if args.profile or args.profile_every:
+        profiler = FrameProfiler(args.profile_dir,
+                                 every=args.profile_every or 1,
+                                 mode=args.profile_mode)
+    if args.use_async:
+        bot = AsyncChromabot(outsider, profiler=profiler, role=args.role)
+        asyncio.run(bot.loop_forever())
+    else:
+        bot = Chromabot(outsider, profiler=profiler, role=args.role)
+        bot.loop_forever()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,99 @@
+# Finished battles don't need to stay in `battles`: their boards, scores and
+# outside_data (the reddit outsider's seen_comments list grows by one entry
+# per comment) just make the table, and every scan of it, bigger.  Once a
+# battle's been over for a while it's boiled down to an ArchivedBattle -
+# the final board, the scores, who won and a few numbers about it - and the
+# original is deleted, along with anything still pointing at it.
+import logging
+
+from sqlalchemy import Column, Integer, false
+
+from .battle import Battle, Troop
+from .db import Base
+from .jsoncolumn import JSONText
+from .models import QueuedCommand, User
+
+
+class ArchivedBattle(Base):
+    __tablename__ = "archived_battles"
+
+    id = Column(Integer, primary_key=True)
+    # What the battle's id was
+    battle_id = Column(Integer, index=True)
+    begins = Column(Integer)
+    ends = Column(Integer)
+    victor = Column(Integer)  # -1 if nobody won this
+    scores = Column(JSONText)
+    # The final board, with [team, type] for each troop left on it
+    board = Column(JSONText)
+    # Counts and such, see summarize()
+    stats = Column(JSONText)
+    # Whatever the outsider wanted kept, see NullOutsider.archive_data
+    outside_data = Column(JSONText)
+    archived = Column(Integer)
+
+    def __repr__(self):
+        return "<ArchivedBattle(battle_id=%d, victor=%d)>" % (
+            self.battle_id, self.victor)
+
+
+def summarize(board):
+    """Stats about a final board of [team, type] cells"""
+    left = [0, 0]
+    for row in board:
+        for cell in row:
+            if cell:
+                left[cell[0]] += 1
+    return {'troops_left': left}
+
+
+def archive_battles(outside, now, after, batch=50):
+    """Archives up to `batch` battles that had been over for `after`
+    seconds by `now`; returns how many it did"""
+    cutoff = now - after
+    with outside.db.session() as s:
+        battles = (s.query(Battle)
+                   .filter(Battle.relevant == false(), Battle.ends <= cutoff)
+                   .order_by(Battle.id).limit(batch).all())
+        if not battles:
+            return 0
+        ids = [battle.id for battle in battles]
+        boards = {battle.id: battle.board for battle in battles}
+
+        # Whoever's left on the boards, in one go
+        on_board = {cell for board in boards.values()
+                    for row in board for cell in row if cell}
+        troops = {}
+        if on_board:
+            troops = {troop_id: [team, troop_type] for troop_id, team,
+                      troop_type in s.query(Troop.id, User.team, Troop.type)
+                      .join(User, Troop.owner_id == User.id)
+                      .filter(Troop.id.in_(on_board))}
+
+        for battle in battles:
+            board = [[troops.get(cell) for cell in row]
+                     for row in boards[battle.id]]
+            stats = summarize(board)
+            stats['duration'] = battle.ends - battle.begins
+            data = {}
+            outside.archive_data(battle, data, stats)
+            s.add(ArchivedBattle(
+                battle_id=battle.id, begins=battle.begins, ends=battle.ends,
+                victor=battle.victor, scores=list(battle.scores),
+                board=board, stats=stats, outside_data=data, archived=now))
+
+        # Nothing may point at them once they're gone; troops that died in
+        # them were never let go
+        s.query(Troop).filter(Troop.battle_id.in_(ids)).update(
+            {Troop.battle_id: None}, synchronize_session=False)
+        queued = QueuedCommand.battle_id
+        s.query(QueuedCommand).filter(queued.in_(ids)).update(
+            {queued: None}, synchronize_session=False)
+        s.query(Battle).filter(Battle.id.in_(ids)).delete(
+            synchronize_session=False)
+        for battle in battles:
+            s.expunge(battle)
+    for battle_id in ids:
+        outside.battles.forget(battle_id)
+    logging.info("Archived battles %s", ids)
+    return len(ids)
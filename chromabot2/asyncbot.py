@@ -0,0 +1,115 @@
+# An asyncio flavour of Chromabot.  Outsider methods may be coroutines, in
+# which case they get awaited and the ones that don't depend on each other
+# run at the same time.  Everything that touches the DB - parsing,
+# executing, simulating - still happens on the event loop's thread, one
+# thing at a time; it's up to the outsider to push its network calls off
+# to other threads (see AsyncRedditOutsider).
+import asyncio
+import inspect
+import logging
+
+from .bot import Chromabot
+from .remote import RemoteError
+
+
+async def outside_call(func, *args):
+    """Calls an outsider method, awaiting it if it's a coroutine"""
+    result = func(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class AsyncChromabot(Chromabot):
+    """Chromabot, but loop_once is a coroutine.
+
+    Results and battle posts are published in the background: they go out
+    while the bot sleeps and reads the next frame's messages, and are only
+    waited on (by settle()) just before the next frame simulates.
+    """
+
+    def __init__(self, outside, **kwargs):
+        super().__init__(outside, **kwargs)
+        self.publishing = []
+
+    async def loop_forever(self):
+        logging.info("Bot started up")
+        if self.profiler:
+            logging.warning("The asyncio bot can't profile frames")
+        try:
+            while self.running:
+                await self.loop_once()
+            await self.settle()
+        finally:
+            self.close()
+
+    async def settle(self):
+        """Waits for everything still being published; raises the first
+        thing that went wrong, if anything did"""
+        pending, self.publishing = self.publishing, []
+        outcomes = await asyncio.gather(*pending, return_exceptions=True)
+        errors = [outcome for outcome in outcomes
+                  if isinstance(outcome, Exception)]
+        for error in errors[1:]:
+            logging.error("Also failed while publishing: %r", error)
+        if errors:
+            raise errors[0]
+
+    def publish(self, func, *args):
+        task = asyncio.ensure_future(outside_call(func, *args))
+        self.publishing.append(task)
+
+    async def loop_once(self):
+        results = []
+        outside = self.outside
+        self.begin_loop()
+        metrics = self.metrics.current
+
+        if not self.started:
+            try:
+                await outside_call(outside.startup)
+            except RemoteError as e:
+                logging.warning("Couldn't start up, trying again next "
+                                "frame: %s", e)
+                delay = self.end_loop([])
+                if delay:
+                    await outside.clock.pause(delay)
+                return []
+            self.started = True
+
+        messages = []
+        if "inbox" in self.chores:
+            # Recruits first, so somebody who signs up and sends a command
+            # in the same frame gets heard
+            logging.info("Checking for recruits")
+            with metrics.phase("recruits"):
+                await outside_call(outside.handle_recruits)
+
+            with metrics.phase("messages"):
+                messages = await outside_call(outside.get_messages)
+        if messages is None:
+            self.running = False
+        else:
+            results.extend(self.process(messages))
+            with metrics.phase("settle"):
+                await self.settle()
+            if self.role != "ingest":
+                for battle, active, battle_results in self.simulate():
+                    results.extend(battle_results)
+                    if active:
+                        if battle.relevant:
+                            self.publish(outside.update_battle, battle)
+                        else:
+                            self.publish(outside.report_battle_end, battle)
+                self.archive()
+            metrics.count("results", len(results))
+            self.publish(outside.report_results, results)
+            # Give everything just published a chance to read what it
+            # needs before this frame's over
+            await asyncio.sleep(0)
+
+        delay = self.end_loop(results)
+        if delay:
+            logging.info("Sleeping for %d seconds" % delay)
+            await outside.clock.pause(delay)
+        return results
@@ -1,26 +1,44 @@
 # All the battle related stuff that'd ordinarily go in commands or db
 # goes into this file instead, because otherwise everything here just
 # dwarfs everything else
-import json
 import logging
 import random
 import string
-from contextlib import contextmanager
-
-from sqlalchemy import Column, Integer, ForeignKey, String, Boolean, Text
-from sqlalchemy.orm import relationship
+import weakref
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    ForeignKey,
+    Integer,
+    String,
+    Text,
+    event,
+    inspect,
+    update,
+)
+from sqlalchemy.orm import Session, relationship
 
 from .commands import (
     CODE_BEGIN_BATTLE,
     CODE_END_BATTLE,
     CODE_INFO,
     CODE_NOK,
-    CODE_SCORE,
     Command,
     Result,
 )
+from .config import MATCHUPS
 from .db import Base, ChromaException
-from .utils import now, letter_to_col
+from .jsoncolumn import TrackedJSON
+from .simulation import (
+    TROOP_FIELDS,
+    BoardState,
+    Simulation,
+    TroopState,
+    fights,
+    tick,
+)
+from .utils import letter_to_col
 
 
 # EXCEPTIONS
@@ -59,27 +77,33 @@ class SkirmishCommand(Command):
             self.battle_id = int(tokens['battle'])
 
     def extract_battle(self, message):
-        with message.outside.db.session() as s:
-            if self.battle_id:
-                battle = s.query(Battle).get(self.battle_id)
-                if not battle:
-                    msg = "Battle %d does not exist!" % self.battle_id
-                    raise BattleExtractionException(msg)
-                return battle
-
-            battle = message.infer_battle()
-            if battle:
-                return battle
-
-            battles = s.query(Battle).filter_by(active=True).all()
-            if not battles:
-                raise BattleExtractionException(
-                    "There are no battles underway!")
-            if len(battles) > 1:
-                raise BattleExtractionException(
-                    "There is more than one battle underway; you must specify "
-                    "which one to participate in.")
-            return battles[0]
+        registry = message.outside.battles
+        if self.battle_id:
+            battle = registry.get(self.battle_id)
+            if not battle:
+                msg = "Battle %d does not exist!" % self.battle_id
+                raise BattleExtractionException(msg)
+            return battle
+
+        battle = message.infer_battle()
+        if battle:
+            return battle
+
+        battles = registry.active()
+        if not battles:
+            raise BattleExtractionException(
+                "There are no battles underway!")
+        if len(battles) > 1:
+            raise BattleExtractionException(
+                "There is more than one battle underway; you must specify "
+                "which one to participate in.")
+        return battles[0]
+
+    def target_battle(self, message):
+        try:
+            return self.extract_battle(message)
+        except BattleExtractionException:
+            return None
 
     def execute(self, message):
         try:
@@ -155,22 +179,11 @@ class Troop(Base):
 
     @property
     def team(self):
-        team = getattr(self, '_team', None)
-        if team is None:
-            self._team = self.owner.team
-            team = self._team
-        return team
+        return self.owner.team
 
-    def fights(self, other):
+    def fights(self, other, matchups=MATCHUPS):
         """Returns 1 if this troop wins, 0 for a tie, and -1 for a loss"""
-        if self.type == other.type:
-            return 0
-        ordering = ["ranged", "infantry", "cavalry"]
-        our_index = ordering.index(self.type)
-        win_against = ordering[our_index - 1]
-        if other.type == win_against:
-            return 1
-        return -1
+        return fights(self.type, other.type, matchups)
 
     def is_alive(self):
         return self.hp
@@ -178,12 +191,11 @@ class Troop(Base):
     def is_deployable(self):
         return self.hp and not self.battle
 
-    def icon_for_troop(self, config):
-        key = "icons_%d" % self.team
+    def icon_for_troop(self, settings):
         if self.visible:
-            icon = config[key][self.type]
+            icon = settings.icons[(self.team, self.type)]
         else:
-            icon = config[key]['unknown']
+            icon = settings.icons[(self.team, 'unknown')]
         # Directionality for team
         if self.team == 0:
             return "%s>" % icon
@@ -204,34 +216,39 @@ class Troop(Base):
 
 class Battle(Base):
     __tablename__ = "battles"
+    # SQLite would otherwise hand an archived battle's id out again
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = Column(Integer, primary_key=True)
     begins = Column(Integer, default=0)
     ends = Column(Integer, default=0)
     display_ends = Column(Integer, default=0)
-    outside_data = Column(Text)  # JSON
+    outside_data = Column(TrackedJSON)
     active = Column(Boolean)
     relevant = Column(Boolean)
 
-    state = Column(Text)  # JSON
+    state = Column(TrackedJSON)
 
     victor = Column(Integer)  # -1 if nobody won this
-    scores = Column(Text)  # JSON
+    scores = Column(TrackedJSON)
 
     # region_id = Column(Integer, ForeignKey('regions.id'))
     # region = relationship("Region", backref=backref("battle", uselist=False))
 
     troops = relationship("Troop", back_populates="battle")
 
+    # Which worker is simulating this battle, and until when; see leases.py
+    lease_owner = Column(String(255))
     lockout = Column(Integer, default=0)
 
     @classmethod
     def create(cls, outside):
-        begins = now() + outside.config["battle"].getint("delay")
-        display_ends = begins + outside.config["battle"].getint("time")
+        settings = outside.config.snapshot.battle
+        begins = outside.clock.now() + settings.delay
+        display_ends = begins + settings.time
 
         # Actual ending is within end_var of the end
-        chooserange = outside.config["battle"].getint("end_var", fallback=0)
+        chooserange = settings.end_var
         chosen = random.randint(0, chooserange)
         ends = display_ends - (chooserange / 2) + chosen
 
@@ -239,9 +256,9 @@ class Battle(Base):
         # NOTE: Unlike my other stuff this is ROW MAJOR.  That means I'll have
         #       to get used to board[y][x], but it just makes more sense this
         #       way (ops tend to happen in rows rather than columns)
-        for y in range(outside.config["battle"].getint("rows")):
+        for y in range(settings.rows):
             row = []
-            for x in range(outside.config["battle"].getint("columns")):
+            for x in range(settings.columns):
                 row.append(0)  # The number in the board is the troop ID.
             board.append(row)
 
@@ -254,191 +271,96 @@ class Battle(Base):
 
         with outside.db.session() as s:
             result = cls(begins=begins, ends=ends, display_ends=display_ends,
-                         outside_data=json.dumps(outside_data),
-                         state=json.dumps(state), victor=-1,
-                         scores=json.dumps(scores), active=False,
-                         relevant=True)
+                         outside_data=outside_data, state=state, victor=-1,
+                         scores=scores, active=False, relevant=True)
             s.add(result)
 
-        with outside.db.session():
-            with result.load_and_adopt_outside_data() as data:
-                    outside.populate_battle_data(result, data)
+        try:
+            with outside.db.session():
+                outside.populate_battle_data(result, result.outside_data)
+        except Exception:
+            # A battle the outsider can't show anyone is no use, and would
+            # trip up everything that expects its outside_data; get rid of
+            # it so the next try starts clean
+            with outside.db.session() as s:
+                s.delete(result)
+            raise
         return result
 
-    def place_troop(self, troop, *, col, row, outside, moving=False):
-        battle_report = ''
-        board = self.load_board()
-        if not moving:
-            if not self.active:
-                # Which end is it?
-                if now() >= self.ends:
-                    raise BattleEndedException("That battle is over!")
-                elif now() < self.begins:
-                    raise BattleNotStartedException(
-                        "That battle has not yet begun!")
-                else:
-                    raise BattleEndedException(
-                        "That battle has ended early!")
-            if row < 0 or row >= len(board):
-                raise OutOfBoundsException("That row is not on the board!")
-            if col < 0 or col >= len(board[0]):
-                    raise OutOfBoundsException(
-                        "That column is not on the board!")
-            if troop.team == 0 and col >= len(board[0]) // 2:
-                raise OutOfBoundsException(
-                    "You cannot place a troop in enemy territory")
-            elif troop.team == 1 and col <= len(board[0]) // 2:
+    def place_troop(self, troop, *, col, row, outside):
+        when = outside.clock.now()
+        board = self.board
+        if not self.active:
+            # Which end is it?
+            if when >= self.ends:
+                raise BattleEndedException("That battle is over!")
+            elif when < self.begins:
+                raise BattleNotStartedException(
+                    "That battle has not yet begun!")
+            else:
+                raise BattleEndedException(
+                    "That battle has ended early!")
+        if row < 0 or row >= len(board):
+            raise OutOfBoundsException("That row is not on the board!")
+        if col < 0 or col >= len(board[0]):
                 raise OutOfBoundsException(
-                    "You cannot place a troop in enemy territory")
-            if board[row][col]:
-                raise OccupiedException(
-                    "There is already a troop at that location")
-            with self.session():
-                troop.battle = self
-        else:
-            # Ephemeral
-            troop.moved = False
-            if col < 0 or col >= len(board[0]):
-                # SCORE!
-                self.kill_troop(troop, "is behind enemy lines")
-                with self.load_and_adopt_scores() as scores:
-                    amount = outside.config.battle.getint('goal_score')
-                    if not troop.opposed:
-                        amount *= 2
-                    scores[troop.team] = scores[troop.team] + amount
-                    result = Result(
-                        "Troop %d slipped behind enemy lines, awarding "
-                        "team %d %d points" % (troop.id, troop.team, amount),
-                        code=CODE_SCORE,
-                        extra={'team': troop.team, 'amount': amount})
-                    return result
-
-            if board[row][col]:
-                with self.session() as s:
-                    other = s.query(Troop).get(board[row][col])
-                if troop.team == other.team:
-                    return Result(
-                        "Troop %d halted to avoid friendly fire" % troop.id,
-                        code=CODE_INFO)
-                # Oh shit, FIGHT!
-                windex = troop.fights(other)
-                winner = [None, troop, other][windex]
-                loser = [None, other, troop][windex]
-                if winner:
-                    winner.opposed = True
-                    winner.visible = True
-                    self.kill_troop(loser, "has fallen in battle")
-                    with self.load_and_adopt_scores() as scores:
-                        amount = outside.config.battle.getint('kill_score')
-                        scores[winner.team] = scores[winner.team] + amount
-                    if winner == troop:
-                        battle_report = ": defeated %d" % loser.id
-                    else:
-                        battle_report = ": was defeated by %d" % winner.id
-                else:
-                    self.evict_troop(troop)
-                    self.evict_troop(other)
-                    battle_report = ": tied with %d" % other.id
-
-        if troop.battle:
-            with self.session():
-                troop.col = col
-                troop.row = row
-                troop.last_move = now()
-                with self.load_and_adopt_board() as board:
-                    board[row][col] = troop.id
-                troop.moved = True
-
-            verb = "placed at"
-            if moving:
-                verb = "moved to"
-            txt = "Troop %d %s row %d, col %d%s" % (troop.id, verb,
-                                                    troop.row, troop.col,
-                                                    battle_report)
-            return Result(txt, code=CODE_INFO)
-        return Result("Troop %d left the field%s" % (troop.id, battle_report),
-                      code=CODE_INFO)
+                    "That column is not on the board!")
+        if troop.team == 0 and col >= len(board[0]) // 2:
+            raise OutOfBoundsException(
+                "You cannot place a troop in enemy territory")
+        elif troop.team == 1 and col <= len(board[0]) // 2:
+            raise OutOfBoundsException(
+                "You cannot place a troop in enemy territory")
+        if board[row][col]:
+            raise OccupiedException(
+                "There is already a troop at that location")
 
-    def move_troop(self, troop, outside):
-        direction = [1, -1][troop.team]
-        # TODO: Check to see if there's anything in the way
-        row = troop.row
-        col = troop.col
-        newcol = col + direction
-        result = self.place_troop(troop, col=newcol, row=row, moving=True,
-                                  outside=outside)
-        if troop.moved:
-            with self.session():
-                with self.load_and_adopt_board() as board:
-                    board[row][col] = 0
+        with self.session():
+            troop.battle = self
+            troop.col = col
+            troop.row = row
+            troop.last_move = when
+            self.board[row][col] = troop.id
 
-        return result
+        txt = "Troop %d placed at row %d, col %d" % (troop.id, troop.row,
+                                                     troop.col)
+        return Result(txt, code=CODE_INFO)
+
+    def move_troop(self, troop, outside):
+        settings = outside.config.snapshot
+        sim = Simulation(self.snapshot(), outside.clock.now(),
+                         settings.battle, settings.matchups)
+        sim.move(sim.by_id[troop.id])
+        with self.session():
+            return self.apply(sim.outcome())[0]
 
     def kill_troop(self, troop, cause_of_death):
         with self.session():
             # troop.battle = None
             troop.cause_of_death = cause_of_death
             troop.hp = 0
-            with self.load_and_adopt_board() as board:
-                board[troop.row][troop.col] = 0
+            self.board[troop.row][troop.col] = 0
 
     def evict_troop(self, troop, clear_board=True):
         troop.rez()
         with self.session():
             troop.battle = None
             if clear_board:
-                with self.load_and_adopt_board() as board:
-                    board[troop.row][troop.col] = 0
-
-    def load_board(self):
-        state = json.loads(self.state)
-        board = state['board']
-        return board
-
-    def adopt_board(self, new_board):
-        state = json.loads(self.state)
-        state['board'] = new_board
-        self.state = json.dumps(state)
-
-    @contextmanager
-    def load_and_adopt_board(self):
-        board = self.load_board()
-        yield board
-        self.adopt_board(board)
-
-    def load_scores(self):
-        return json.loads(self.scores)
-
-    def adopt_scores(self, new_scores):
-        self.scores = json.dumps(new_scores)
-
-    @contextmanager
-    def load_and_adopt_scores(self, commit=True):
-        scores = self.load_scores()
-        yield scores
-        if commit:
-            with self.session():
-                self.adopt_scores(scores)
-        else:
-            self.adopt_scores(scores)
+                self.board[troop.row][troop.col] = 0
 
-    def load_outside_data(self):
-        return json.loads(self.outside_data)
-
-    def adopt_outside_data(self, data):
-        self.outside_data = json.dumps(data)
+    # state, scores and outside_data are decoded when the battle's loaded,
+    # and only written back if something in them changes; see jsoncolumn.py
+    @property
+    def board(self):
+        return self.state['board']
 
-    @contextmanager
-    def load_and_adopt_outside_data(self):
-        data = self.load_outside_data()
-        yield data
-        self.adopt_outside_data(data)
+    @board.setter
+    def board(self, new_board):
+        self.state['board'] = new_board
 
     def realize_board(self):
-        state = json.loads(self.state)
-        board = state['board']
         realized = []
-        for row in board:
+        for row in self.board:
             real_row = []
             for col in row:
                 if col == 0:
@@ -455,7 +377,7 @@ class Battle(Base):
             self.active = True
 
     def end(self):
-        scores = self.load_scores()
+        scores = self.scores
         victor = -1
         if scores[0] > scores[1]:
             victor = 0
@@ -471,33 +393,176 @@ class Battle(Base):
                 troop.battle = None
                 troop.rez()
 
-    def update(self, outside):
-        results = []
-        begin = now()
-        if not self.active:
-            if begin >= self.begins:
-                # Let's do this!
-                self.start()
-                res = Result("Battle %d has begun" % self.id,
-                             code=CODE_BEGIN_BATTLE, extra=self)
-                results.append(res)
-        else:
-            troop_delay = outside.config.battle.getint("troop_delay")
+    def snapshot(self):
+        """Plain-data copy of this battle for the simulation.  Its troops,
+        and their teams, come from one query."""
+        # models imports us, so User has to come from the relationship
+        owner = Troop.owner.property.mapper.class_
+        columns = [Troop.id, Troop.type, owner.team]
+        columns += [getattr(Troop, field) for field in TROOP_FIELDS]
+        query = (Session.object_session(self).query(*columns)
+                 .join(Troop.owner).filter(Troop.battle_id == self.id)
+                 .order_by(Troop.id))
+        troops = [TroopState(*row) for row in query]
+        return BoardState(id=self.id, active=self.active, begins=self.begins,
+                          ends=self.ends, board=self.board,
+                          scores=self.scores, troops=troops)
+
+    def apply(self, outcome):
+        """Writes a simulation Outcome back to this battle and its troops,
+        and returns its Results.  Doesn't commit; that's up to the caller.
+
+        Only what changed gets written, and the troops all go in a single
+        bulk UPDATE rather than being loaded one by one.
+        """
+        rows = []
+        for changes in outcome.troops:
+            row = dict(changes)
+            if not row.pop('in_battle', True):
+                row['battle_id'] = None
+            rows.append(row)
+        if rows:
+            Session.object_session(self).execute(update(Troop), rows)
+
+        self.active = outcome.active
+        self.relevant = outcome.relevant
+        self.victor = outcome.victor
+        # Comparing is a lot cheaper than writing them back for nothing
+        if self.board != outcome.board:
+            self.board = outcome.board
+        if self.scores != outcome.scores:
+            self.scores = outcome.scores
 
-            for troop in self.troops[:]:
-                if not troop.is_alive():
-                    continue
-                next_move = troop.last_move + troop_delay
-                if next_move <= begin:
-                    results.append(self.move_troop(troop, outside))
-
-            if begin >= self.ends:
-                msg = Result("Battle %d has completed" % self.id,
-                             code=CODE_END_BATTLE,
-                             extra=self)
-                self.end()
-                results.append(msg)
-                outside.report_battle_end(self)
-            else:
-                outside.update_battle(self)
+        results = []
+        for text, code, extra in outcome.results:
+            if code in (CODE_BEGIN_BATTLE, CODE_END_BATTLE):
+                extra = self
+            results.append(Result(text, code=code, extra=extra))
         return results
+
+    def update(self, outside, snapshot=None):
+        settings = outside.config.snapshot
+        if snapshot is None:
+            snapshot = self.snapshot()
+        outcome = tick(snapshot, outside.clock.now(), settings.battle,
+                       settings.matchups)
+        with self.session():
+            return self.apply(outcome)
+
+
+# Every BattleRegistry, so they can hear about battles being saved
+_registries = weakref.WeakSet()
+
+
+@event.listens_for(Battle, "after_insert")
+@event.listens_for(Battle, "after_update")
+def _battle_saved(mapper, connection, target):
+    for registry in list(_registries):
+        if registry.outside.db.engine is connection.engine:
+            registry.saw(target)
+
+
+@event.listens_for(Battle, "after_delete")
+def _battle_deleted(mapper, connection, target):
+    for registry in list(_registries):
+        if registry.outside.db.engine is connection.engine:
+            registry.forget(target.id)
+
+
+class BattleRegistry:
+    """The battles that matter this frame, so commands, the outsider and
+    the bot can find them without a query each.
+
+    All the relevant battles are loaded in one go at the start of the frame
+    (see Chromabot.begin_loop), along with whether they're underway and
+    what the outsider calls their post (see NullOutsider.post_key).  Battles
+    being created, started or ended are noticed as they're saved.  Only
+    what was already loaded is read when that happens, and the lookups by
+    id or post don't touch the battles either, since after a commit every
+    attribute - even the id - is another query.
+    """
+
+    def __init__(self, outside):
+        self.outside = outside
+        self.battles = None
+        # id -> (active, relevant)
+        self.flags = {}
+        # id -> post key, and back
+        self.keys = {}
+        self.posts = {}
+        _registries.add(self)
+
+    def load(self):
+        self.battles = {}
+        self.flags = {}
+        self.keys = {}
+        self.posts = {}
+        with self.outside.db.session() as s:
+            # Before the commit expires them all again
+            for battle in s.query(Battle).filter_by(relevant=True):
+                self.saw(battle)
+
+    def saw(self, battle):
+        if self.battles is None:
+            return
+        loaded = inspect(battle).dict
+        battle_id = loaded.get('id')
+        if battle_id is None:
+            return
+        self.battles[battle_id] = battle
+        active, relevant = self.flags.get(battle_id, (False, False))
+        self.flags[battle_id] = (loaded.get('active', active),
+                                 loaded.get('relevant', relevant))
+        # A battle's post doesn't move once it has one, so there's no need
+        # to decode its outside_data every time it's saved
+        if battle_id not in self.keys and 'outside_data' in loaded:
+            key = self.outside.post_key(battle)
+            if key:
+                self.keys[battle_id] = key
+                self.posts[key] = battle_id
+
+    def forget(self, battle_id):
+        if self.battles is not None:
+            self.battles.pop(battle_id, None)
+            self.flags.pop(battle_id, None)
+            self.posts.pop(self.keys.pop(battle_id, None), None)
+
+    def ids(self, active=False):
+        """Ids of the relevant (or just the active) battles, in order"""
+        if self.battles is None:
+            self.load()
+        which = 0 if active else 1
+        return sorted(battle_id for battle_id, flags in self.flags.items()
+                      if flags[which])
+
+    def relevant(self):
+        return [self.battles[battle_id] for battle_id in self.ids()]
+
+    def active(self):
+        return [self.battles[battle_id] for battle_id in self.ids(True)]
+
+    def get(self, battle_id):
+        """The battle with that id, or None.  Battles that are over are
+        still looked up, just not kept."""
+        if self.battles is None:
+            self.load()
+        battle = self.battles.get(battle_id)
+        if battle is None:
+            with self.outside.db.session() as s:
+                battle = s.get(Battle, battle_id)
+        return battle
+
+    def post_of(self, battle_id):
+        """What the outsider calls the battle's post, if it has one"""
+        if self.battles is None:
+            self.load()
+        return self.keys.get(battle_id)
+
+    def for_post(self, key):
+        """The relevant battle whose post that is, or None"""
+        if self.battles is None:
+            self.load()
+        battle_id = self.posts.get(key)
+        if battle_id is None or not self.flags[battle_id][1]:
+            return None
+        return self.battles[battle_id]
@@ -1,83 +1,455 @@
 import logging
-import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from pyparsing import ParseException
+from sqlalchemy import or_
 
-from .commands import Result
+from .archive import archive_battles
+from .commands import CODE_MOVE, Result
 from .db import ChromaException
+from .leases import LeaseManager
+from .metrics import Metrics
+from .models import QueuedCommand
 from .parser import parse
+from .prefetch import InboxPrefetcher
+from .remote import RemoteError
+from .simulation import tick
+from .utils import AcceleratedClock
 from .battle import Battle
 
 
+# "all" does everything in one loop.  Otherwise an ingest bot reads the
+# outside world and queues up commands, and a simulation bot runs the queue
+# and the battles.
+ROLES = ("all", "ingest", "simulate")
+
+# Which leases.py chores each role can take on
+ROLE_CHORES = {
+    "all": ("inbox", "world"),
+    "ingest": ("inbox",),
+    "simulate": ("world",),
+}
+
+
 class Chromabot:
 
-    def __init__(self, outside):
+    def __init__(self, outside, metrics=None, profiler=None, clock=None,
+                 role="all"):
         self.outside = outside
+        if clock:
+            outside.clock = clock
         self.running = True
         self.started = False
+        self.profiler = profiler
+        if metrics is None:
+            metrics = Metrics.from_settings(outside.config.snapshot.bot)
+        self.metrics = metrics
+        self._pool = None
+        self._workers = 0
+        self.role = role
+        # With leases on, how many bots are sharing the DB, which of the
+        # jobs only one of them should do are this one's, and which battles
+        # are held by this bot and which by others
+        self.leases = LeaseManager(outside.db,
+                                   owner=outside.config.snapshot.bot.worker_id)
+        self.peers = 1
+        self.chores = set(ROLE_CHORES[role])
+        self.held = []
+        self.foreign = None
+        self.prefetcher = None
+        # When finished battles were last archived, by the outsider's clock
+        self.archived_at = None
 
     def loop_forever(self):
         logging.info("Bot started up")
-        while self.running:
-            self.loop_once()
+        try:
+            while self.running:
+                if self.profiler:
+                    self.profiler.call(self.loop_once)
+                else:
+                    self.loop_once()
+        finally:
+            self.close()
+
+    def close(self):
+        self._shutdown_pool()
+        self._stop_prefetching()
+        if self.outside.config.snapshot.bot.lease_time:
+            self.leases.release()
+
+    def _stop_prefetching(self):
+        if self.prefetcher:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def inbox(self):
+        """This frame's messages; prefetched in the background if the
+        config asks for it and the outsider can do it"""
+        outside = self.outside
+        if not (outside.config.snapshot.bot.prefetch and
+                outside.can_prefetch):
+            self._stop_prefetching()
+            return outside.get_messages()
+        if not self.prefetcher:
+            self.prefetcher = InboxPrefetcher(outside)
+        messages = self.prefetcher.take()
+        # If the sleep can't hide the next fetch, start it now, so it at
+        # least overlaps handling and answering these
+        if outside.config.snapshot.bot.sleep <= self.prefetcher.lead():
+            self.prefetcher.request()
+        return messages
+
+    def _shutdown_pool(self):
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+            self._workers = 0
+
+    def pool(self):
+        """The process pool for battle updates, or None if there isn't one.
+        Follows the `workers` setting, which can change between frames."""
+        workers = self.outside.config.snapshot.bot.workers
+        if workers != self._workers:
+            self._shutdown_pool()
+            if workers > 0:
+                logging.info("Updating battles in %d processes", workers)
+                self._pool = ProcessPoolExecutor(max_workers=workers)
+            self._workers = workers
+        return self._pool
 
     def loop_once(self):
         results = []
         outside = self.outside
-
-        outside.config.refresh()
+        self.begin_loop()
 
         if not self.started:
+            try:
+                outside.startup()
+            except RemoteError as e:
+                return self.skip_frame(e)
             self.started = True
-            outside.startup()
 
-        logging.info("Checking for recruits")
-        outside.handle_recruits()
+        messages = []
+        if "inbox" in self.chores:
+            logging.info("Checking for recruits")
+            with self.metrics.current.phase("recruits"):
+                outside.handle_recruits()
 
-        messages = outside.get_messages()
+            with self.metrics.current.phase("messages"):
+                messages = self.inbox()
         if messages is None:
             self.running = False
         else:
-            logging.info("Handling messages")
+            results.extend(self.process(messages))
+            if self.role != "ingest":
+                results.extend(self.frame())
+                self.archive()
+            self.metrics.current.count("results", len(results))
+            with self.metrics.current.phase("report_results"):
+                outside.report_results(results)
+
+        delay = self.end_loop(results)
+        self.rest(delay)
+        return results
+
+    def skip_frame(self, error):
+        """Gives up on a frame the outsider couldn't start up for; it's
+        tried again next frame"""
+        logging.warning("Couldn't start up, trying again next frame: %s",
+                        error)
+        self.rest(self.end_loop([]))
+        return []
+
+    def rest(self, delay):
+        """Sleeps between frames.  A prefetched inbox that isn't already
+        being fetched gets fetched right at the end of the sleep, so it sees
+        what came in during it."""
+        clock = self.outside.clock
+        if delay:
+            logging.info("Sleeping for %d seconds" % delay)
+        if self.prefetcher and self.running:
+            lead = min(delay, self.prefetcher.lead())
+            if delay - lead > 0:
+                clock.sleep(delay - lead)
+            self.prefetcher.request()
+            delay = lead
+        if delay > 0:
+            clock.sleep(delay)
+
+    def begin_loop(self):
+        """Everything a frame does before talking to the outside world"""
+        outside = self.outside
+        metrics = self.metrics.begin_frame()
+        outside.db.begin_frame()
+        outside.clock.begin_frame()
+
+        with metrics.phase("config"):
+            outside.config.refresh()
+        outside.begin_frame()
+        with metrics.phase("battles"):
+            outside.battles.load()
+
+        lease_time = outside.config.snapshot.bot.lease_time
+        # Somebody else may be recruiting players, so not having seen a
+        # name before doesn't mean much
+        outside.roster.shared = bool(self.role != "all" or lease_time)
+        if lease_time:
+            with metrics.phase("leases"):
+                self.peers = self.leases.heartbeat(lease_time)
+                self.chores = {chore for chore in ROLE_CHORES[self.role]
+                               if self.leases.chore(chore, lease_time)}
+                if self.role != "ingest":
+                    self.claim(lease_time)
+
+    def claim(self, lease_time):
+        """Works out which relevant battles this bot holds for the frame,
+        and which are held by others"""
+        battles = self.outside.battles.relevant()
+        held = self.leases.claim(battles, lease_time, self.peers)
+        self.held = [battle.id for battle in held]
+        self.foreign = [battle.id for battle in battles
+                        if battle not in held]
+
+    def end_loop(self, results):
+        """Wraps up the frame's bookkeeping; returns how long to sleep"""
+        outside = self.outside
+        metrics = self.metrics.current
+        queries = outside.db.end_frame(troops=metrics.counters["troops"])
+        metrics.count("queries", queries.statements)
+        metrics.count("query_rows", queries.rows)
+        outside.end_frame(metrics)
+        self.metrics.end_frame()
+        outside.clock.end_frame()
+        logging.debug("Results: %s", results)
+        return outside.config.snapshot.bot.sleep
+
+    def process(self, messages):
+        """Does whatever this bot's role does with a batch of messages"""
+        logging.info("Handling messages")
+        self.metrics.current.count("messages", len(messages))
+        if self.role == "ingest":
+            return self.enqueue(messages)
+        results = self.handle(messages)
+        # Sharing the DB, anything for a battle someone else holds was
+        # queued up for them, and they do the same for us
+        if (self.role == "simulate" or
+                self.outside.config.snapshot.bot.lease_time):
+            results.extend(self.drain_queue())
+        return results
+
+    def handle(self, messages):
+        """Parses and executes messages, returning their Results"""
+        results = []
+        metrics = self.metrics.current
+        for message in messages:
+            logging.info("Handling: %s" % message)
+            command = None
+            try:
+                with metrics.phase("parse"):
+                    command = parse(message.raw_text)
+            except ParseException as pe:
+                result = Result.from_exception(pe, message)
+            if command:
+                battle = self.leased_elsewhere(command, message)
+                if battle:
+                    self.requeue(message, battle)
+                    continue
+                try:
+                    with metrics.phase("execute"):
+                        result = command.execute(message)
+                except ChromaException as e:
+                    result = Result.from_exception(e, message)
+            if result:
+                results.append(result)
+        return results
+
+    def leased_elsewhere(self, command, message):
+        """The battle `command` is for, if another bot holds its lease.
+        Running it here would have that bot's next update write over it."""
+        if not self.foreign:
+            return None
+        battle = command.target_battle(message)
+        if battle is not None and battle.id in self.foreign:
+            return battle
+        return None
+
+    def requeue(self, message, battle):
+        """Hands a message over to whoever holds `battle`"""
+        logging.info("Queueing %s for battle %d's holder", message, battle.id)
+        with self.outside.db.session() as s:
+            s.add(QueuedCommand.from_message(
+                message, self.outside.clock.now(), battle=battle))
+        self.metrics.current.count("queued")
 
+    def enqueue(self, messages):
+        """Queues up messages for a simulation bot to run.  Only the ones
+        that don't parse get a Result, straight away."""
+        results = []
+        metrics = self.metrics.current
+        received = self.outside.clock.now()
+        with self.outside.db.session() as s:
             for message in messages:
-                logging.info("Handling: %s" % message)
-                command = None
                 try:
-                    command = parse(message.raw_text)
+                    with metrics.phase("parse"):
+                        parse(message.raw_text)
                 except ParseException as pe:
-                    result = Result.from_exception(pe, message)
-                if command:
-                    try:
-                        result = command.execute(message)
-                    except ChromaException as e:
-                        result = Result.from_exception(e, message)
-                if result:
-                    results.append(result)
-
-            results.extend(self.frame())
-            outside.report_results(results)
-        delay = outside.config.bot.getint('sleep', fallback=0)
-        logging.debug("Results: %s", results)
-        if delay:
-            logging.info("Sleeping for %d seconds" % delay)
-            time.sleep(delay)
+                    results.append(Result.from_exception(pe, message))
+                    continue
+                s.add(QueuedCommand.from_message(message, received))
+        metrics.count("queued", len(messages) - len(results))
+        return results
+
+    def drain_queue(self):
+        """Runs a batch of queued commands, returning their Results"""
+        metrics = self.metrics.current
+        settings = self.outside.config.snapshot.bot
+        with metrics.phase("queue"):
+            with self.outside.db.session() as s:
+                query = s.query(QueuedCommand)
+                if settings.lease_time:
+                    query = query.filter(self.queue_filter())
+                entries = query.order_by(QueuedCommand.id).limit(
+                    settings.queue_batch).all()
+            messages = [self.outside.message_from_queue(entry)
+                        for entry in entries]
+        metrics.count("dequeued", len(messages))
+        results = self.handle(messages)
+
+        # Only forget them once they've been run; a crash in between means
+        # they get run again, which beats never running them at all.
+        if entries:
+            with self.outside.db.session() as s:
+                s.query(QueuedCommand).filter(
+                    QueuedCommand.id.in_([entry.id for entry in entries])
+                ).delete(synchronize_session=False)
+        return results
+
+    def queue_filter(self):
+        """Which queued commands are ours to run when sharing the DB: the
+        ones for battles we hold, plus, if we're doing the world chore,
+        everything not meant for a battle someone else holds."""
+        battle_id = QueuedCommand.battle_id
+        ours = battle_id.in_(self.held)
+        if "world" not in self.chores:
+            return ours
+        if self.foreign is None:
+            # Don't know who holds what until the first frame has run
+            return or_(ours, battle_id.is_(None))
+        return or_(battle_id.is_(None), ~battle_id.in_(self.foreign))
+
+    def fast_forward(self, battle, factor=1000, max_frames=None):
+        """Runs frames with time sped up by `factor` until `battle` is
+        over (or `max_frames` have gone by).  Returns all the results."""
+        results = []
+        old_clock = self.outside.clock
+        self.outside.clock = AcceleratedClock(factor, start=old_clock.now())
+        frames = 0
+        try:
+            while battle.relevant and self.running:
+                if max_frames is not None and frames >= max_frames:
+                    break
+                results.extend(self.loop_once())
+                frames += 1
+        finally:
+            self.outside.clock = old_clock
         return results
 
     def frame(self):
         results = []
+        metrics = self.metrics.current
+        for battle, active, battle_results in self.simulate():
+            results.extend(battle_results)
 
-        with self.outside.db.session() as s:
-            battles = s.query(Battle).filter_by(relevant=True).all()
+            # Only battles that were already underway get their outside
+            # representation refreshed
+            if active:
+                if battle.relevant:
+                    with metrics.phase("update_battle"):
+                        self.outside.update_battle(battle)
+                else:
+                    with metrics.phase("report_battle_end"):
+                        self.outside.report_battle_end(battle)
+
+        return results
+
+    def archive(self):
+        """Every so often, archives the battles that have been over for
+        long enough; returns how many it did"""
+        settings = self.outside.config.snapshot.bot
+        if not settings.archive_after or "world" not in self.chores:
+            return 0
+        now = self.outside.clock.now()
+        if (self.archived_at is not None and
+                now - self.archived_at < settings.archive_every):
+            return 0
+        self.archived_at = now
+        metrics = self.metrics.current
+        with metrics.phase("archive"):
+            archived = archive_battles(self.outside, now,
+                                       settings.archive_after,
+                                       settings.archive_batch)
+            self.outside.prune()
+        metrics.count("archived", archived)
+        return archived
+
+    def simulate(self):
+        """Updates every relevant battle this bot is responsible for.
+        Returns a list of (battle, was it active, its Results)."""
+        metrics = self.metrics.current
+
+        battles = self.outside.battles.relevant()
 
         logging.info("Checking to see if eternal battle needs to start")
-        if not battles:
-            eternal = Battle.create(self.outside)
-            logging.info("Eternal battle created, id %s !", eternal.id)
+        if not battles and "world" in self.chores:
+            try:
+                eternal = Battle.create(self.outside)
+            except RemoteError as e:
+                # Nothing's left of it, so it'll be tried again next frame
+                logging.warning("Couldn't create the eternal battle: %s", e)
+            else:
+                logging.info("Eternal battle created, id %s !", eternal.id)
+
+        if self.outside.config.snapshot.bot.lease_time:
+            # Claimed at the start of the frame
+            battles = [battle for battle in battles
+                       if battle.id in self.held]
 
         logging.info("Updating battles")
-        for battle in battles:
-            logging.info("Updating battle %d", battle.id)
-            results.extend(result for result in battle.update(self.outside))
+        metrics.count("battles", len(battles))
+        was_active = [battle.active for battle in battles]
+        with metrics.phase("update"):
+            snapshots = [battle.snapshot() for battle in battles]
+            updates = self.update_battles(battles, snapshots)
 
-        return results
+        for snapshot, battle_results in zip(snapshots, updates):
+            # Halts, scores and troops leaving the field aren't moves
+            metrics.count("troops_moved", sum(
+                1 for result in battle_results if result.code == CODE_MOVE))
+            # From the snapshot, so the troops themselves aren't loaded
+            metrics.count("troops", len(snapshot.troops))
+        return list(zip(battles, was_active, updates))
+
+    def update_battles(self, battles, snapshots):
+        """Updates every battle from its snapshot, returning a list of
+        Results per battle.
+
+        With a process pool, the ticks run in parallel; the outcomes come
+        back in battle order and get applied in a single transaction here.
+        """
+        pool = self.pool()
+        if not pool or len(battles) < 2:
+            results = []
+            for battle, snapshot in zip(battles, snapshots):
+                logging.info("Updating battle %d", battle.id)
+                results.append(battle.update(self.outside, snapshot))
+            return results
+
+        settings = self.outside.config.snapshot
+        work = partial(tick, now=self.outside.clock.now(),
+                       settings=settings.battle,
+                       matchups=dict(settings.matchups))
+        outcomes = list(pool.map(work, snapshots))
+        with self.outside.db.session():
+            return [battle.apply(outcome)
+                    for battle, outcome in zip(battles, outcomes)]
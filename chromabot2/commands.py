@@ -9,6 +9,10 @@ class Command:
     def execute(self, message):
         pass
 
+    def target_battle(self, message):
+        """The battle executing this would change, if any"""
+        return None
+
 
 # Hijacking result codes from HTTP for my own use
 
@@ -27,6 +31,8 @@ CODE_INFO = 600
 # the team in question in the 'team' field and how
 # many in the 'amount' field
 CODE_SCORE = 601
+# A troop moved to a new spot on the field.  Extra is the troop's id.
+CODE_MOVE = 602
 # The battle indicated in the 'extra' field has begun
 CODE_BEGIN_BATTLE = 698
 # The battle indicated in the 'extra' field has ended.
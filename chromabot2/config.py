@@ -1,6 +1,124 @@
 import logging
+import os
 import os.path
+from collections import namedtuple
 from configparser import ConfigParser
+from types import MappingProxyType
+
+
+# Rock-paper-scissors: each troop type beats the one before it in this list
+TROOP_ORDERING = ("ranged", "infantry", "cavalry")
+
+
+def build_matchups(ordering=TROOP_ORDERING):
+    """Returns a read-only {(ours, theirs): outcome} table, where outcome
+    is 1 if ours wins, 0 for a tie, and -1 for a loss"""
+    table = {}
+    for index, ours in enumerate(ordering):
+        win_against = ordering[index - 1]
+        for theirs in ordering:
+            if theirs == ours:
+                table[(ours, theirs)] = 0
+            elif theirs == win_against:
+                table[(ours, theirs)] = 1
+            else:
+                table[(ours, theirs)] = -1
+    return MappingProxyType(table)
+
+
+MATCHUPS = build_matchups()
+
+
+BotSettings = namedtuple("BotSettings", [
+    "dbstring",
+    "sleep",
+    "metrics_file",
+    "metrics_summary",
+    "query_budget",
+    "query_budget_per_troop",
+    "query_budget_strict",
+    "workers",
+    "lease_time",
+    "worker_id",
+    "queue_batch",
+    "prefetch",
+    "archive_after",
+    "archive_every",
+    "archive_batch",
+])
+
+BattleSettings = namedtuple("BattleSettings", [
+    "delay",
+    "time",
+    "end_var",
+    "columns",
+    "rows",
+    "troop_delay",
+    "goal_score",
+    "kill_score",
+])
+
+
+class Snapshot(namedtuple("Snapshot", ["bot", "battle", "icons", "matchups"])):
+    """An immutable, pre-parsed view of the config file.
+
+    Everything the engine reads on a hot path lives here as a plain
+    attribute, so nobody has to go through ConfigParser per troop.  `icons`
+    maps (team, troop type) to that troop's icon.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_parser(cls, parser):
+        # Everything in [bot] is optional, so a missing section just
+        # means all the fallbacks.
+        section = parser[parser.default_section]
+        if parser.has_section('bot'):
+            section = parser['bot']
+        bot = BotSettings(
+            dbstring=section.get('dbstring'),
+            sleep=section.getint('sleep', fallback=0),
+            metrics_file=section.get('metrics_file', fallback=None),
+            metrics_summary=section.getint('metrics_summary', fallback=10),
+            query_budget=section.getint('query_budget', fallback=0),
+            query_budget_per_troop=section.getint('query_budget_per_troop',
+                                                  fallback=0),
+            query_budget_strict=section.getboolean('query_budget_strict',
+                                                   fallback=False),
+            workers=section.getint('workers', fallback=0),
+            lease_time=section.getint('lease_time', fallback=0),
+            worker_id=section.get('worker_id', fallback=None),
+            queue_batch=section.getint('queue_batch', fallback=500),
+            prefetch=section.getboolean('prefetch', fallback=False),
+            archive_after=section.getint('archive_after', fallback=0),
+            archive_every=section.getint('archive_every', fallback=3600),
+            archive_batch=section.getint('archive_batch', fallback=50),
+        )
+
+        battle = None
+        if parser.has_section('battle'):
+            section = parser['battle']
+            battle = BattleSettings(
+                delay=section.getint('delay'),
+                time=section.getint('time'),
+                end_var=section.getint('end_var', fallback=0),
+                columns=section.getint('columns'),
+                rows=section.getint('rows'),
+                troop_delay=section.getint('troop_delay'),
+                goal_score=section.getint('goal_score'),
+                kill_score=section.getint('kill_score'),
+            )
+
+        icons = {}
+        for name in parser.sections():
+            prefix, _, team = name.partition('_')
+            if prefix != 'icons' or not team.isdigit():
+                continue
+            for troop_type, icon in parser[name].items():
+                icons[(int(team), troop_type)] = icon
+
+        return cls(bot=bot, battle=battle, icons=MappingProxyType(icons),
+                   matchups=MATCHUPS)
 
 
 class Config(object):
@@ -10,6 +128,8 @@ class Config(object):
 
         self.conffile = None
         self.data = {}
+        self.snapshot = None
+        self._stamp = None
 
         proposals = [conffile, os.environ.get("CHROMABOT_CONFIG"),
                      "../config/config.ini", "./config/config.ini",
@@ -40,8 +160,22 @@ class Config(object):
     def get(self, key, default=None):
         return self.data.get(key, default)
 
-    def refresh(self):
-        with open(self.conffile) as data_file:
-            self.data = ConfigParser()
-            self.data.read(self.conffile, encoding='utf8')
+    def refresh(self, force=False):
+        """Re-reads the config file, but only if it's changed on disk since
+        the last time.  Returns True if anything was reloaded."""
+        stat = os.stat(self.conffile)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp and not force:
+            return False
+
+        data = ConfigParser()
+        data.read(self.conffile, encoding='utf8')
+        snapshot = Snapshot.from_parser(data)
+
+        # Readers only ever see the old snapshot or the new one, never a
+        # half-parsed file.
+        self.data = data
+        self.snapshot = snapshot
+        self._stamp = stamp
         logging.info("Loaded config file from %s", self.conffile)
+        return True
@@ -1,7 +1,13 @@
+import logging
+import os.path
+import sys
+import time
 from contextlib import contextmanager
 
 from sqlalchemy import (
     create_engine,
+    event,
+    inspect,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -13,6 +19,12 @@ class ChromaException(Exception):
     pass
 
 
+# Deliberately not a ChromaException: this is a problem with the bot, not
+# something to report back to whoever issued a command.
+class QueryBudgetExceeded(Exception):
+    """A single frame issued more SQL statements than it's allowed"""
+
+
 # Base classes for DB stuff and the DB object itself:
 class Model(object):
 
@@ -30,15 +42,160 @@ class Model(object):
 Base = declarative_base(cls=Model)
 
 
+def call_site():
+    """Describes the innermost frame that isn't SQLAlchemy or plumbing"""
+    frame = sys._getframe(1)
+    while frame:
+        filename = frame.f_code.co_filename
+        if not (filename == __file__ or 'sqlalchemy' in filename or
+                filename.endswith('contextlib.py')):
+            return "%s:%d %s" % (os.path.basename(filename), frame.f_lineno,
+                                 frame.f_code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+
+class QueryStats:
+    """SQL statements issued since the last reset.
+
+    `rows` only counts what the driver reports as affected, which for most
+    drivers means SELECTs don't contribute.
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.seconds = 0.0
+        # call site -> [statements, seconds]
+        self.sites = {}
+
+    def record(self, site, rows, seconds):
+        self.statements += 1
+        self.rows += max(rows, 0)
+        self.seconds += seconds
+        entry = self.sites.setdefault(site, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def worst_sites(self, limit=5):
+        ranked = sorted(self.sites.items(), key=lambda item: -item[1][0])
+        return ranked[:limit]
+
+    def __repr__(self):
+        return "QueryStats(statements=%d, rows=%d, seconds=%.3f)" % (
+            self.statements, self.rows, self.seconds)
+
+
+class QueryBudget:
+    """How many statements a frame may issue: `base`, plus `per_troop` for
+    every troop in the battles it simulated.  A base of 0 means no limit.
+    """
+
+    def __init__(self, base=0, per_troop=0, strict=False):
+        self.base = base
+        self.per_troop = per_troop
+        self.strict = strict
+
+    @classmethod
+    def from_settings(cls, settings):
+        """The budget a [bot] config snapshot asks for"""
+        return cls(settings.query_budget, settings.query_budget_per_troop,
+                   settings.query_budget_strict)
+
+    def limit_for(self, troops):
+        return self.base + self.per_troop * troops
+
+    def check(self, stats, troops=0):
+        if not self.base:
+            return True
+        limit = self.limit_for(troops)
+        if stats.statements <= limit:
+            return True
+
+        sites = ", ".join("%s (%d)" % (site, count)
+                          for site, (count, _) in stats.worst_sites())
+        msg = ("Frame issued %d SQL statements, budget for %d troops is %d. "
+               "Top call sites: %s" % (stats.statements, troops, limit,
+                                       sites))
+        if self.strict:
+            raise QueryBudgetExceeded(msg)
+        logging.warning(msg)
+        return False
+
+
 class DB:
     def __init__(self, config):
         self.engine = create_engine(config.bot["dbstring"], echo=False)
         self.sessionfactory = sessionmaker(bind=self.engine)
         self._session = None
 
+        self.config = config
+        # A QueryBudget to use instead of whatever the config says
+        self.budget = None
+        self.queries = QueryStats()
+        event.listen(self.engine, "before_cursor_execute",
+                     self._before_execute)
+        event.listen(self.engine, "after_cursor_execute",
+                     self._after_execute)
+
+    # The start time rides along on the statement's execution context, so a
+    # statement that fails (and never gets to _after_execute) doesn't leave
+    # anything behind to throw off the timings of the ones after it.
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if context is not None:
+            context.chroma_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        started = getattr(context, 'chroma_started', None)
+        elapsed = 0.0
+        if started is not None:
+            elapsed = time.perf_counter() - started
+        self.queries.record(call_site(), cursor.rowcount, elapsed)
+
+    def begin_frame(self):
+        self.queries = QueryStats()
+
+    def end_frame(self, troops=0):
+        """Returns the frame's QueryStats, after holding them up against
+        the budget"""
+        stats = self.queries
+        budget = self.budget
+        if budget is None:
+            # Whatever the config says right now, reloads included
+            budget = QueryBudget.from_settings(self.config.snapshot.bot)
+        budget.check(stats, troops)
+        return stats
+
     def create_all(self):
         Base.metadata.create_all(self.engine)
 
+    def upgrade(self):
+        """Brings an existing DB up to date with the models: creates any
+        missing tables and adds any missing columns.  Only ever adds; safe
+        to run on every startup.  Returns the "table.column"s it added."""
+        existing = inspect(self.engine)
+        tables = set(existing.get_table_names())
+        added = []
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table.name not in tables:
+                    continue
+                have = {column['name']
+                        for column in existing.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in have:
+                        continue
+                    kind = column.type.compile(dialect=self.engine.dialect)
+                    conn.exec_driver_sql("ALTER TABLE %s ADD COLUMN %s %s" % (
+                        table.name, column.name, kind))
+                    added.append("%s.%s" % (table.name, column.name))
+        self.create_all()
+        for name in added:
+            logging.warning("Added missing column %s", name)
+        return added
+
     def drop_all(self):
         Base.metadata.drop_all(self.engine)
 
@@ -0,0 +1,369 @@
+# An offline stand-in for the parts of praw 3.5 the reddit outsider uses:
+# submissions with comment trees (MoreComments and all), the inbox, edits,
+# replies and PMs.  Latency, failures and reddit's rate limit can all be
+# injected, so the real RedditOutsider can be tested, benchmarked and
+# soaked without going anywhere near reddit.
+#
+# Everything lives in memory on the FakeReddit.  Build a scenario with
+# add_user(), post(), comment() and message(); anything the bot sends ends
+# up in `sent`, and `calls` counts the requests it made by kind.
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+import praw
+from requests import Response
+from requests.exceptions import ConnectionError
+
+from .outsiders import outsider
+from .reddit import RedditOutsider
+
+
+def base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        number, digit = divmod(number, 36)
+        result = digits[digit] + result
+        if not number:
+            return result
+
+
+class FakeRedditor:
+
+    def __init__(self, reddit, name, user_id, banned=False):
+        self.reddit = reddit
+        self.name = name
+        self._id = user_id
+        self.banned = banned
+
+    @property
+    def id(self):
+        # Like praw, this is a lookup on the user's page
+        self.reddit.request("user")
+        if self.banned:
+            raise praw.errors.NotFound(None, "404 Not Found")
+        return self._id
+
+    def __repr__(self):
+        return "FakeRedditor(%s)" % self.name
+
+
+class FakeThing:
+
+    prefix = ""
+
+    def __init__(self, reddit, author, body):
+        self.reddit = reddit
+        self.id = reddit.next_id()
+        self.name = "%s_%s" % (self.prefix, self.id)
+        self.author = author
+        self.body = body
+
+    def mark_as_read(self):
+        self.reddit.request("mark_as_read")
+        self.reddit.unread.pop(self.name, None)
+
+    def reply(self, text):
+        self.reddit.request("reply")
+        self.reddit.sent.append(("reply", self.name, text))
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, self.name)
+
+
+class FakeComment(FakeThing):
+
+    prefix = "t1"
+    was_comment = True
+
+    def __init__(self, reddit, author, body, submission):
+        super().__init__(reddit, author, body)
+        self.submission = submission
+        self.link_id = submission.name
+        self.replies = []
+        self.permalink = "https://fake.reddit/comments/%s/_/%s" % (
+            submission.id, self.id)
+
+    def reply(self, text):
+        super().reply(text)
+        self.replies.append(FakeComment(self.reddit, self.reddit.me, text,
+                                        self.submission))
+
+
+class FakeMessage(FakeThing):
+    """A PM to the bot"""
+
+    prefix = "t4"
+    was_comment = False
+
+    def __init__(self, reddit, author, body, subject=""):
+        super().__init__(reddit, author, body)
+        self.subject = subject
+        self.replies = []
+
+
+class FakeMoreComments:
+    """A 'load more comments' stub; `children` are what it's hiding"""
+
+    replies = None
+
+    def __init__(self, children):
+        self.children = children
+        self.count = len(children)
+
+    def __repr__(self):
+        return "FakeMoreComments(%d)" % self.count
+
+
+class FakePost:
+    """What reddit knows about a submission.  get_submission() hands out
+    FakeSubmissions, which are one look at it."""
+
+    def __init__(self, reddit, subreddit, title, text, author):
+        self.reddit = reddit
+        self.id = reddit.next_id()
+        self.name = "t3_%s" % self.id
+        self.subreddit = subreddit
+        self.title = title
+        self.selftext = text
+        self.author = author
+        self.comments = []
+
+
+class FakeSubmission:
+
+    def __init__(self, post):
+        self.post = post
+        self.reddit = post.reddit
+        self.id = post.id
+        self.name = post.name
+        self.title = post.title
+        self.selftext = post.selftext
+        self.author = post.author
+        # Like reddit, only the first page of top-level comments comes with
+        # the submission; the rest are behind MoreComments
+        first = self.reddit.page_size
+        rest = post.comments[first:]
+        self.comments = list(post.comments[:first])
+        chunk = self.reddit.more_size
+        self.comments.extend(FakeMoreComments(rest[i:i + chunk])
+                             for i in range(0, len(rest), chunk))
+
+    def edit(self, text):
+        self.reddit.request("edit")
+        self.post.selftext = self.selftext = text
+        self.reddit.sent.append(("edit", self.name, text))
+
+    def replace_more_comments(self, limit=32, threshold=1):
+        """Each MoreComments replaced is a request; returns the ones that
+        weren't"""
+        comments = []
+        skipped = []
+        for item in self.comments:
+            if not isinstance(item, FakeMoreComments):
+                comments.append(item)
+            elif ((limit is None or limit > 0) and
+                  item.count >= threshold):
+                self.reddit.request("morechildren")
+                comments.extend(item.children)
+                if limit is not None:
+                    limit -= 1
+            else:
+                skipped.append(item)
+        self.comments = comments
+        return skipped
+
+
+class FakeSubreddit:
+
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.display_name = name
+
+    def get_new(self, limit=25):
+        self.reddit.request("get_new")
+        posts = [post for post in reversed(self.reddit.posts)
+                 if post.subreddit == self.display_name]
+        return [FakeSubmission(post) for post in posts[:limit]]
+
+
+class FakeReddit:
+    """The praw.Reddit stand-in.
+
+    latency: seconds every request takes
+    error_rate: chance (0-1) of any request failing with a ConnectionError
+    rate_limit: requests allowed per `window` seconds; past that, requests
+        fail with a 429 until the window's up.  None means no limit.
+    observe: called with each request's rate limit headers, like the
+        AccountingHandler would be
+    """
+
+    def __init__(self, username="chromabot", latency=0.0, error_rate=0.0,
+                 rate_limit=None, window=600, seed=0, observe=None,
+                 timer=time.monotonic, sleep=time.sleep):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.window = window
+        self.observe = observe
+        self.timer = timer
+        self.sleep = sleep
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = 0
+        self.window_start = timer()
+        self.used = 0
+        self.calls = Counter()
+        self.page_size = 200
+        self.more_size = 100
+
+        self.users = {}
+        self.posts = []
+        self.things = {}
+        self.unread = {}
+        self.sent = []
+        self.me = self.add_user(username)
+
+    def next_id(self):
+        with self.lock:
+            self.ids += 1
+            return base36(self.ids)
+
+    def request(self, kind):
+        """One trip to 'reddit'"""
+        with self.lock:
+            self.calls[kind] += 1
+            now = self.timer()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.used = 0
+            self.used += 1
+            limited = self.rate_limit is not None
+            over = limited and self.used > self.rate_limit
+            failed = self.error_rate and self.rng.random() < self.error_rate
+            headers = {}
+            if limited:
+                headers = {
+                    "x-ratelimit-remaining": str(max(0, self.rate_limit -
+                                                     self.used)),
+                    "x-ratelimit-used": str(self.used),
+                    "x-ratelimit-reset": str(int(self.window_start +
+                                                 self.window - now)),
+                }
+        if self.latency:
+            self.sleep(self.latency)
+        if self.observe:
+            self.observe(headers)
+        if over:
+            # What praw raises for reddit's 429
+            response = Response()
+            response.status_code = 429
+            response.headers.update(headers)
+            raise praw.errors.HTTPException(response,
+                                            "429 Too Many Requests")
+        if failed:
+            raise ConnectionError("Injected failure (%s)" % kind)
+
+    # Setting the scene
+    def add_user(self, name, user_id=None, banned=False):
+        user = FakeRedditor(self, name, user_id or self.next_id(), banned)
+        self.users[name.lower()] = user
+        return user
+
+    def user(self, name):
+        return self.users.get(name.lower()) or self.add_user(name)
+
+    def post(self, subreddit, title, text="", author=None):
+        post = FakePost(self, subreddit, title, text,
+                        self.user(author) if author else self.me)
+        self.posts.append(post)
+        self.things[post.name] = post
+        return post
+
+    def comment(self, on, author, body):
+        """Comments on a post (or replies to a comment) as `author`.  If
+        that's something of the bot's, it lands in its inbox too."""
+        post = getattr(on, 'submission', on)
+        comment = FakeComment(self, self.user(author) if author else None,
+                              body, post)
+        if on is post:
+            post.comments.append(comment)
+        else:
+            on.replies.append(comment)
+        self.things[comment.name] = comment
+        if on.author is self.me:
+            self.unread[comment.name] = comment
+        return comment
+
+    def message(self, author, body, subject=""):
+        """PMs the bot as `author`"""
+        message = FakeMessage(self, self.user(author), body, subject)
+        self.things[message.name] = message
+        self.unread[message.name] = message
+        return message
+
+    # The praw.Reddit surface
+    def set_oauth_app_info(self, **kwargs):
+        pass
+
+    def refresh_access_information(self, refresh_token=None):
+        self.request("auth")
+        return {}
+
+    def get_me(self):
+        self.request("me")
+        return self.me
+
+    def get_unread(self, unset_has_mail=False, update_user=False,
+                   limit=None):
+        self.request("get_unread")
+        return list(self.unread.values())[:limit]
+
+    def get_submission(self, url=None, submission_id=None):
+        self.request("get_submission")
+        post = self.things.get("t3_%s" % submission_id)
+        if post is None:
+            raise praw.errors.NotFound(None, "404 Not Found")
+        return FakeSubmission(post)
+
+    def get_subreddit(self, name):
+        return FakeSubreddit(self, name)
+
+    def get_info(self, thing_id=None):
+        self.request("get_info")
+        thing = self.things.get(thing_id)
+        if isinstance(thing, FakePost):
+            return FakeSubmission(thing)
+        return thing
+
+    def submit(self, subreddit, title, text=None, url=None, **kwargs):
+        self.request("submit")
+        return FakeSubmission(self.post(subreddit, title, text or ""))
+
+    def send_message(self, recipient, subject, message, **kwargs):
+        self.request("send_message")
+        self.sent.append(("pm", str(recipient), message))
+
+
+@outsider("fakereddit")
+class FakeRedditOutsider(RedditOutsider):
+    """The reddit outsider, talking to a FakeReddit.  An optional
+    [fakereddit] section sets latency, error_rate, rate_limit and seed."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        settings = {}
+        if 'fakereddit' in config:
+            section = config['fakereddit']
+            settings = {
+                'latency': section.getfloat('latency', fallback=0.0),
+                'error_rate': section.getfloat('error_rate', fallback=0.0),
+                'rate_limit': section.getint('rate_limit', fallback=None),
+                'seed': section.getint('seed', fallback=0),
+            }
+        self.reddit = FakeReddit(self.config.reddit['username'],
+                                 observe=self.remote.observe, **settings)
+        logging.info("Using a fake reddit; nothing will be posted")
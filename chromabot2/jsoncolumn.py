@@ -0,0 +1,216 @@
+# JSON in a Text column, decoded once when a row's loaded and encoded only
+# when it's changed.
+#
+# TrackedJSON columns hand back TrackedDicts and TrackedLists: a dict or
+# list at the top, with every dict and list inside it tracked too, so that
+# changing anything, however deep (battle.state['board'][row][col] = 0,
+# say), marks the column dirty and it gets written at the next flush.
+# Columns that weren't touched aren't re-encoded at all.  Commits expire
+# everything, so don't hang on to one across a commit: it's not what the
+# battle holds any more, and changing it is an error.
+#
+# Encoding goes through a codec, which is orjson if it's installed and the
+# standard library's json if it isn't; use_codec() picks one by name.
+import json
+
+from sqlalchemy import Text
+from sqlalchemy.ext.mutable import Mutable
+from sqlalchemy.types import TypeDecorator
+
+
+class Codec:
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return "Codec(%s)" % self.name
+
+
+CODECS = {'json': Codec('json', json.dumps, json.loads)}
+
+try:
+    import orjson
+except ImportError:  # Plain json it is, then
+    orjson = None
+else:
+    CODECS['orjson'] = Codec('orjson',
+                             lambda value: orjson.dumps(value).decode(),
+                             orjson.loads)
+
+codec = CODECS['orjson' if orjson else 'json']
+
+
+def use_codec(name):
+    """Switches every JSON column to the named codec; returns the old one"""
+    global codec
+    old, codec = codec, CODECS[name]
+    return old
+
+
+class JSONText(TypeDecorator):
+    """Any JSON-able value, stored as text"""
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return codec.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return codec.loads(value)
+
+
+def track(value, root=None):
+    """A tracked copy of `value`: dicts and lists, all the way down, become
+    TrackedDicts and TrackedLists reporting changes to `root` (or to the
+    new top-level one, if there isn't a root)"""
+    if isinstance(value, dict):
+        tracked = TrackedDict()
+    elif isinstance(value, list):
+        tracked = TrackedList()
+    else:
+        return value
+    tracked.root = root
+    inner = root if root is not None else tracked
+    if isinstance(value, dict):
+        dict.update(tracked, ((key, track(item, inner))
+                              for key, item in value.items()))
+    else:
+        list.extend(tracked, (track(item, inner) for item in value))
+    return tracked
+
+
+class Tracked(Mutable):
+    """What TrackedDict and TrackedList have in common.  Only the top-level
+    one is what the column holds; the ones inside it have it as `root`."""
+
+    root = None
+
+    @classmethod
+    def coerce(cls, key, value):
+        if value is None:
+            return None
+        if isinstance(value, Tracked) and value.root is None:
+            return value
+        if isinstance(value, (dict, list)):
+            return track(value)
+        return Mutable.coerce(key, value)
+
+    def changed(self):
+        if self.root is not None:
+            self.root.changed()
+        else:
+            super().changed()
+
+    def wrap(self, value):
+        return track(value, self.root if self.root is not None else self)
+
+
+class TrackedDict(Tracked, dict):
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, self.wrap(value))
+        self.changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            dict.__setitem__(self, key, self.wrap(value))
+        self.changed()
+
+    def pop(self, *args):
+        result = dict.pop(self, *args)
+        self.changed()
+        return result
+
+    def popitem(self):
+        result = dict.popitem(self)
+        self.changed()
+        return result
+
+    def clear(self):
+        dict.clear(self)
+        self.changed()
+
+    def __reduce__(self):
+        # Copies and pickles (for the process pool, say) are plain dicts
+        return (dict, (dict(self),))
+
+
+class TrackedList(Tracked, list):
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [self.wrap(item) for item in value]
+        else:
+            value = self.wrap(value)
+        list.__setitem__(self, index, value)
+        self.changed()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self.changed()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, count):
+        list.__imul__(self, count)
+        self.changed()
+        return self
+
+    def append(self, value):
+        list.append(self, self.wrap(value))
+        self.changed()
+
+    def extend(self, values):
+        list.extend(self, (self.wrap(value) for value in values))
+        self.changed()
+
+    def insert(self, index, value):
+        list.insert(self, index, self.wrap(value))
+        self.changed()
+
+    def pop(self, *args):
+        result = list.pop(self, *args)
+        self.changed()
+        return result
+
+    def remove(self, value):
+        list.remove(self, value)
+        self.changed()
+
+    def clear(self):
+        list.clear(self)
+        self.changed()
+
+    def sort(self, **kwargs):
+        list.sort(self, **kwargs)
+        self.changed()
+
+    def reverse(self):
+        list.reverse(self)
+        self.changed()
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+# The column type to use
+TrackedJSON = Tracked.as_mutable(JSONText)
@@ -0,0 +1,152 @@
+# Leases let several bot processes share one DB without stepping on each
+# other.  A lease is an owner plus an expiry, taken with a conditional
+# UPDATE so only one worker can win it.  Battles carry their own lease
+# (Battle.lease_owner, with Battle.lockout as the expiry); everything else
+# a single worker should do - reading the inbox, recruiting, creating the
+# eternal battle - is a named chore in the `leases` table.  Workers also
+# keep a "worker:<id>" lease alive, which is how they know how many of
+# them are sharing the battles.
+import logging
+import math
+import os
+import socket
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    and_,
+    func,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+
+from .battle import Battle
+from .db import Base
+from .utils import now
+
+
+class Lease(Base):
+    __tablename__ = "leases"
+
+    name = Column(String(255), primary_key=True)
+    owner = Column(String(255))
+    expires = Column(Integer, default=0)
+
+
+def default_owner():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+class LeaseManager:
+    """Takes, renews and gives back leases for one worker.
+
+    Leases run on wall clock time rather than the outsider's clock, since
+    that's the only clock every worker agrees on.
+    """
+
+    WORKER_PREFIX = "worker:"
+
+    def __init__(self, db, owner=None, timer=now):
+        self.db = db
+        self.owner = owner or default_owner()
+        self.timer = timer
+
+    def _free_or_mine(self, owner_col, expires_col, when):
+        return or_(owner_col.is_(None), owner_col == self.owner,
+                   expires_col < when)
+
+    def chore(self, name, duration):
+        """Takes or renews the lease called `name`; returns True if it's
+        ours until the next frame"""
+        when = self.timer()
+        table = Lease.__table__
+        with self.db.session() as s:
+            taken = s.execute(
+                update(table)
+                .where(and_(table.c.name == name,
+                            self._free_or_mine(table.c.owner,
+                                               table.c.expires, when)))
+                .values(owner=self.owner, expires=when + duration)
+            ).rowcount
+        if taken:
+            return True
+        try:
+            with self.db.session() as s:
+                s.execute(table.insert(), {'name': name, 'owner': self.owner,
+                                           'expires': when + duration})
+        except IntegrityError:
+            # Somebody else holds it
+            return False
+        return True
+
+    def heartbeat(self, duration):
+        """Announces that this worker is alive; returns how many are"""
+        self.chore(self.WORKER_PREFIX + self.owner, duration)
+        table = Lease.__table__
+        with self.db.session() as s:
+            return s.execute(
+                select(func.count())
+                .where(and_(table.c.name.like(self.WORKER_PREFIX + "%"),
+                            table.c.expires >= self.timer()))
+            ).scalar()
+
+    def claim(self, battles, duration, workers=1):
+        """Renews the leases we hold on `battles` and takes free or expired
+        ones, up to a fair share of them; returns the battles we hold."""
+        if not battles:
+            return []
+        share = math.ceil(len(battles) / max(workers, 1))
+        when = self.timer()
+        table = Battle.__table__
+        ids = [battle.id for battle in battles]
+        owners = table.c.lease_owner
+
+        with self.db.session() as s:
+            mine = [row[0] for row in s.execute(
+                select(table.c.id).where(and_(
+                    table.c.id.in_(ids), owners == self.owner,
+                    table.c.lockout >= when)).order_by(table.c.id))]
+            wanted = set(mine[:share])
+            spare = share - len(wanted)
+            if spare > 0:
+                free = s.execute(
+                    select(table.c.id)
+                    .where(and_(table.c.id.in_(ids),
+                                or_(owners.is_(None), table.c.lockout < when)))
+                    .order_by(table.c.id)
+                    .limit(spare)).all()
+                wanted.update(row[0] for row in free)
+            # Too many since the last worker joined; let the extras go
+            extra = set(mine) - wanted
+            if extra:
+                logging.info("Releasing battles %s", sorted(extra))
+                s.execute(update(table).where(and_(table.c.id.in_(extra),
+                                                   owners == self.owner))
+                          .values(lease_owner=None, lockout=0))
+            if wanted:
+                s.execute(
+                    update(table)
+                    .where(and_(table.c.id.in_(wanted),
+                                self._free_or_mine(owners, table.c.lockout,
+                                                   when)))
+                    .values(lease_owner=self.owner, lockout=when + duration))
+            held = {row[0] for row in s.execute(
+                select(table.c.id).where(and_(table.c.id.in_(ids),
+                                              owners == self.owner,
+                                              table.c.lockout >= when)))}
+        return [battle for battle in battles if battle.id in held]
+
+    def release(self):
+        """Gives back everything this worker holds"""
+        with self.db.session() as s:
+            battles = Battle.__table__
+            s.execute(update(battles)
+                      .where(battles.c.lease_owner == self.owner)
+                      .values(lease_owner=None, lockout=0))
+            leases = Lease.__table__
+            s.execute(update(leases)
+                      .where(leases.c.owner == self.owner)
+                      .values(owner=None, expires=0))
@@ -0,0 +1,176 @@
+# Per-frame timing and counters for the bot loop.  The bot hands a
+# FrameMetrics to each phase of a frame; once the frame's done, every sink
+# gets a look at it.
+import logging
+import os
+import tempfile
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+class FrameMetrics:
+
+    def __init__(self, number):
+        self.number = number
+        self.started = time.time()
+        self.duration = 0.0
+        # Seconds spent per phase; phases that run more than once in a
+        # frame (parse, per-battle update...) accumulate.
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def __repr__(self):
+        return "FrameMetrics(number=%d, duration=%.3f)" % (self.number,
+                                                           self.duration)
+
+
+class Metrics:
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.frames = 0
+        self.current = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Builds the sinks asked for in the [bot] section"""
+        sinks = []
+        if settings.metrics_summary:
+            sinks.append(LogSummarySink(settings.metrics_summary))
+        if settings.metrics_file:
+            sinks.append(PrometheusTextfileSink(settings.metrics_file))
+        return cls(sinks)
+
+    def begin_frame(self):
+        self.frames += 1
+        self.current = FrameMetrics(self.frames)
+        return self.current
+
+    def end_frame(self):
+        frame = self.current
+        frame.finish()
+        for sink in self.sinks:
+            try:
+                sink.emit(frame)
+            except Exception:
+                # Metrics are never worth taking the bot down over
+                logging.exception("Metrics sink %r failed", sink)
+        return frame
+
+
+class NullSink:
+
+    def emit(self, frame):
+        pass
+
+
+class LogSummarySink(NullSink):
+    """Logs averages and maxima over the last `every` frames"""
+
+    def __init__(self, every=10):
+        self.every = every
+        self.window = deque(maxlen=every)
+
+    def emit(self, frame):
+        self.window.append(frame)
+        if frame.number % self.every:
+            return
+
+        frames = list(self.window)
+        durations = [f.duration for f in frames]
+        phases = sorted({name for f in frames for name in f.timings})
+        counters = sorted({name for f in frames for name in f.counters})
+
+        parts = ["frame avg %.3fs max %.3fs" % (
+            sum(durations) / len(durations), max(durations))]
+        for name in phases:
+            times = [f.timings.get(name, 0.0) for f in frames]
+            parts.append("%s avg %.3fs max %.3fs" % (
+                name, sum(times) / len(times), max(times)))
+        for name in counters:
+            parts.append("%s %d" % (
+                name, sum(f.counters.get(name, 0) for f in frames)))
+        logging.info("Last %d frames: %s", len(frames), "; ".join(parts))
+
+
+class PrometheusTextfileSink(NullSink):
+    """Writes the node_exporter textfile format to `path` after each frame.
+
+    Gauges describe the most recent frame, counters are totals since the
+    bot started.
+    """
+
+    def __init__(self, path, prefix="chromabot"):
+        self.path = path
+        self.prefix = prefix
+        self.frames = 0
+        self.phase_totals = defaultdict(float)
+        self.counter_totals = defaultdict(int)
+
+    def emit(self, frame):
+        self.frames += 1
+        for name, seconds in frame.timings.items():
+            self.phase_totals[name] += seconds
+        for name, amount in frame.counters.items():
+            self.counter_totals[name] += amount
+
+        self.write(self.render(frame))
+
+    def render(self, frame):
+        p = self.prefix
+        lines = [
+            "# HELP %s_frame_seconds Duration of the most recent frame" % p,
+            "# TYPE %s_frame_seconds gauge" % p,
+            "%s_frame_seconds %f" % (p, frame.duration),
+            "# HELP %s_phase_seconds Time per phase in the most recent "
+            "frame" % p,
+            "# TYPE %s_phase_seconds gauge" % p,
+        ]
+        lines.extend('%s_phase_seconds{phase="%s"} %f' % (p, name, seconds)
+                     for name, seconds in sorted(frame.timings.items()))
+        lines.extend([
+            "# HELP %s_phase_seconds_total Time per phase since startup" % p,
+            "# TYPE %s_phase_seconds_total counter" % p,
+        ])
+        lines.extend('%s_phase_seconds_total{phase="%s"} %f' % (p, name, secs)
+                     for name, secs in sorted(self.phase_totals.items()))
+        lines.extend([
+            "# HELP %s_events_total Things the bot has handled" % p,
+            "# TYPE %s_events_total counter" % p,
+        ])
+        lines.extend('%s_events_total{kind="%s"} %d' % (p, name, amount)
+                     for name, amount in sorted(self.counter_totals.items()))
+        lines.extend([
+            "# HELP %s_frames_total Frames run since startup" % p,
+            "# TYPE %s_frames_total counter" % p,
+            "%s_frames_total %d" % (p, self.frames),
+        ])
+        return "\n".join(lines) + "\n"
+
+    def write(self, text):
+        # Write-then-rename so the exporter never scrapes half a file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as f:
+                f.write(text)
+            os.replace(temp, self.path)
+        except:
+            os.unlink(temp)
+            raise
@@ -1,4 +1,15 @@
-from sqlalchemy import Boolean, Column, Integer, String, Text
+import time
+import weakref
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    ForeignKey,
+    Integer,
+    String,
+    Text,
+    event,
+)
 from sqlalchemy.orm import relationship
 
 from .battle import Troop
@@ -44,6 +55,114 @@ class User(Base):
             self.name, self.team)
 
 
+# Every live Roster, so the mapper events below can keep them up to date
+_rosters = weakref.WeakSet()
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+def _user_saved(mapper, connection, target):
+    for roster in list(_rosters):
+        if roster.db.engine is connection.engine:
+            roster.saw(target)
+
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, target):
+    for roster in list(_rosters):
+        if roster.db.engine is connection.engine:
+            roster.forget(target.name)
+
+
+class Roster:
+    """Finds players by name without a query per message.
+
+    Everybody's name -> id is loaded in one go the first time it's needed,
+    and kept up to date as users are created, changed (defecting, say) or
+    deleted.  Only names and ids are kept, not Users: holding on to
+    every User would keep them all in the session, and every commit would
+    have to expire the lot.  find() fetches the one it needs by id.
+
+    Names that turned out not to be players are remembered for
+    `stranger_ttl` seconds, so people who haven't signed up don't cost a
+    query every time they post.  When other bots share the DB (`shared`),
+    one of them may have recruited somebody since, so strangers are still
+    looked up; they're only remembered so they aren't told how to sign up
+    twice.  A name that isn't in here at all always gets looked up.
+    """
+
+    def __init__(self, db, stranger_ttl=600, timer=time.monotonic):
+        self.db = db
+        self.stranger_ttl = stranger_ttl
+        self.timer = timer
+        self.shared = False
+        self.ids = None
+        # id -> name, to notice renames
+        self.names = {}
+        self.strangers = {}
+        _rosters.add(self)
+
+    def load(self):
+        with self.db.session() as s:
+            self.names = {user_id: name.lower() for name, user_id
+                          in s.query(User.name, User.id) if name}
+            self.ids = {name: user_id for user_id, name
+                        in self.names.items()}
+
+    def saw(self, user):
+        if not user.name:
+            return
+        name = user.name.lower()
+        if self.ids is not None:
+            # Renamed, so the old name's nobody's
+            old = self.names.get(user.id)
+            if old != name and self.ids.get(old) == user.id:
+                del self.ids[old]
+            self.ids[name] = user.id
+            self.names[user.id] = name
+        self.strangers.pop(name, None)
+
+    def forget(self, name):
+        if self.ids is not None and name:
+            user_id = self.ids.pop(name.lower(), None)
+            self.names.pop(user_id, None)
+
+    def is_stranger(self, name):
+        """Whether `name` was recently found not to be a player"""
+        expires = self.strangers.get(name.lower())
+        if expires is None:
+            return False
+        if expires <= self.timer():
+            del self.strangers[name.lower()]
+            return False
+        return True
+
+    def find(self, name):
+        """The User called `name`, or None if there isn't one"""
+        name = name.lower()
+        if self.ids is None:
+            self.load()
+        user_id = self.ids.get(name)
+        with self.db.session() as s:
+            if user_id is not None:
+                # By primary key, so no hunting through names
+                user = s.get(User, user_id)
+                if user is not None:
+                    return user
+                self.ids.pop(name, None)
+                self.names.pop(user_id, None)
+            if self.is_stranger(name) and not self.shared:
+                return None
+            user = s.query(User).filter_by(name=name).first()
+        if user:
+            self.ids[name] = user.id
+            self.names[user.id] = name
+            self.strangers.pop(name, None)
+        else:
+            self.strangers[name] = self.timer() + self.stranger_ttl
+        return user
+
+
 # A generic key-value store for quick lookups.  Currently only used by the
 # reddit outsider
 class KeyValue(Base):
@@ -58,3 +177,33 @@ class KeyValue(Base):
 
     def __repr__(self):
         return "<KeyValue(namespace=%s, key=%s)>" % (self.namespace, self.key)
+
+
+# Commands that an ingest bot has read and parsed, waiting for a simulation
+# bot to run them.  See Chromabot's `role`.
+class QueuedCommand(Base):
+    __tablename__ = "command_queue"
+
+    id = Column(Integer, primary_key=True)
+    issuer_id = Column(Integer, ForeignKey('users.id'))
+    issuer = relationship("User")
+    raw_text = Column(Text)
+    # The battle the message came in through, if any
+    battle_id = Column(Integer, ForeignKey('battles.id'))
+    battle = relationship("Battle")
+    # Outsider-specific ID of what the command came from, e.g. a reddit
+    # fullname, so replies can find their way back
+    source = Column(String(255))
+    received = Column(Integer)
+
+    @classmethod
+    def from_message(cls, message, received, battle=None):
+        # `battle` is the one it's for, if that's known better than where
+        # it came in
+        return cls(issuer=message.issuer, raw_text=message.raw_text,
+                   battle=battle or message.battle, source=message.source,
+                   received=received)
+
+    def __repr__(self):
+        return "<QueuedCommand(id=%d, raw_text='%s')>" % (self.id,
+                                                          self.raw_text)
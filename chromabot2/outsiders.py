@@ -3,8 +3,9 @@ import readline
 import string
 
 from .db import DB
-from chromabot2.battle import Battle
-from chromabot2.models import User
+from .utils import Clock
+from chromabot2.battle import Battle, BattleRegistry
+from chromabot2.models import Roster, User
 
 all_outsiders = {}
 
@@ -17,12 +18,20 @@ def outsider(name):
 
 
 class Message:
+    # The battle this came in through, if the outsider knows
+    battle = None
 
     def __init__(self, raw_text, issuer, outside):
         self.raw_text = raw_text
         self.issuer = issuer
         self.outside = outside
 
+    @property
+    def source(self):
+        """Whatever the outsider needs to rebuild this message after a trip
+        through the command queue"""
+        return None
+
     def __repr__(self):
         return "Message(raw_text='%s', issuer='%s')" % (self.raw_text,
                                                         self.issuer.name)
@@ -33,9 +42,22 @@ class Message:
 
 class NullOutsider:
 
-    def __init__(self, config):
+    def __init__(self, config, clock=None):
         self.config = config
         self.db = DB(self.config)
+        # Anything that needs to know what time it is in the game asks this
+        self.clock = clock or Clock()
+        # Players by name
+        self.roster = Roster(self.db)
+        # This frame's battles
+        self.battles = BattleRegistry(self)
+
+    def begin_frame(self):
+        pass
+
+    def end_frame(self, metrics):
+        # Add anything worth keeping track of to this frame's FrameMetrics
+        pass
 
     def get_messages(self):
         return []
@@ -48,6 +70,36 @@ class NullOutsider:
         # But you can't get context except via an Outsider
         return None
 
+    def post_key(self, battle):
+        # What this outsider calls the place a battle is fought, if it
+        # needs to look battles up that way; see BattleRegistry.for_post
+        return None
+
+    # An outsider whose get_messages is mostly waiting on the network can
+    # split it up so the bot can fetch the next frame's messages in the
+    # background (see prefetch.py): inbox_targets() says what to fetch, and
+    # runs on the bot's thread; fetch_inbox(targets) only does network
+    # calls, on the prefetch thread; convert_inbox(batch) turns that into
+    # (messages, items to mark read) back on the bot's thread; and
+    # mark_inbox_read(items) is network again.
+    can_prefetch = False
+
+    def inbox_targets(self):
+        return None
+
+    def fetch_inbox(self, targets):
+        raise NotImplementedError
+
+    def convert_inbox(self, batch):
+        raise NotImplementedError
+
+    def mark_inbox_read(self, read):
+        pass
+
+    def message_from_queue(self, entry):
+        # Turns a QueuedCommand back into a Message that can be replied to
+        return Message(entry.raw_text, entry.issuer, self)
+
     def populate_battle_data(self, battle, data):
         # Update the `data` dict passed in and it'll be adopted by the battle
         # in the `outside_data` field.  Convention is that `data` is a dict
@@ -59,6 +111,18 @@ class NullOutsider:
     def report_battle_end(self, battle):
         pass
 
+    def archive_data(self, battle, data, stats):
+        # A battle that's been over a while is about to be archived (see
+        # archive.py).  Like populate_battle_data, put whatever's worth
+        # keeping from its outside_data into `data`, under this outsider's
+        # name; anything left out is gone.  Numbers can go in `stats`.
+        pass
+
+    def prune(self):
+        # Throw away any bookkeeping that's no longer needed; this runs
+        # along with the archiving
+        pass
+
     def report_results(self, results):
         pass
 
@@ -76,7 +140,7 @@ class NullOutsider:
 
     def icon_for_troop(self, troop):
         if troop:
-            return troop.icon_for_troop(self.config)
+            return troop.icon_for_troop(self.config.snapshot)
         else:
             return '. '
 
@@ -1,3 +1,6 @@
+import re
+from functools import lru_cache
+
 from pyparsing import *
 
 from .battle import SkirmishCommand
@@ -29,80 +32,149 @@ class Destination(object):
             self.destination_sector = int(tok.pop(0))
 
 
+# Anything up to the end of the line: every non-whitespace character in the
+# Basic Multilingual Plane, plus plain spaces.  This used to be built by
+# sweeping all 65536 code points through isspace(), see
 # http://stackoverflow.com/questions/2339386/python-pyparsing-unicode-characters
-unicodePrintables = ''.join(chr(c) for c in range(65536)
-                            if not chr(c).isspace())
-number = Word(nums)
-string = QuotedString('"', '\\')
-subreddit = Suppress("/r/") + Word(alphanums + "_-")
-location = string | subreddit | Word(alphanums + "_-")
-eolstring = Word(unicodePrintables + " ")
-
-attack = Keyword("attack")
-oppose = Keyword("oppose")
-support = Keyword("support")
-participate = attack | oppose | support
-
-
-target = Suppress("#") + number("target")
-skirmishcmd = (Suppress(participate("action")) +
-               Optional(Suppress('#') + Word(nums)("battle")) +
-               Suppress("at") + Word(alphas, exact=1)("col") +
-               Optional(",") + Word(nums)("row") +
-               Suppress("with") + eolstring("troop_type"))
-
-skirmishcmd.setParseAction(SkirmishCommand)
-
-# invade = Keyword("invade")
-# invadecmd = invade + location("where")
-# invadecmd.setParseAction(InvadeCommand)
-#
-# move = Keyword("lead")
-# sector ="#" + number
-# destination = location + sector | location | sector | Keyword("*")
-# destination.setParseAction(Destination)
-# movecmd = (move + Optional(number("amount") | Keyword("all")) +
-#            Suppress("to") + delimitedList(destination)("where"))
-# movecmd.setParseAction(MoveCommand)
-#
-# extractcmd = Keyword("extract")
-# extractcmd.setParseAction(ExtractCommand)
-#
-# stopcmd = Keyword("stop")
-# stopcmd.setParseAction(StopCommand)
-#
-defect = Keyword("defect")
-defect.setParseAction(DefectCommand)
-#
-# promote = (Keyword("promote") | Keyword("demote"))
-# promotecmd = promote("direction") + Word(alphanums + "_-")("who")
-# promotecmd.setParseAction(PromoteCommand)
-#
-# timecmd = Keyword("time")
-# timecmd.setParseAction(TimeCommand)
-#
-#
-# removecode = Keyword("remove")('remove') + (Keyword("all")('all')
-#                                             | string("code"))
-# assigncode = string("code") + Keyword("is") + (alltroops("troop_type")
-#                                                | string("troop_type"))
-# statuscode = Keyword("status")('status') + Optional(string("code"))
-# codewordcmd = Keyword("codeword") + (removecode | statuscode | assigncode)
-# codewordcmd.setParseAction(CodewordCommand)
-#
-statuscmd = Keyword("status")
-statuscmd.setParseAction(StatusCommand)
-#
-# root = (statuscmd | movecmd | invadecmd | skirmishcmd | defectcmd |
-#         promotecmd | timecmd | codewordcmd | extractcmd | stopcmd)
-
-root = (
-    defect |
-    skirmishcmd |
-    statuscmd
-)
+# but re's \s uses the same whitespace definition as str.isspace().
+EOL_PATTERN = r"(?:[^\s\U00010000-\U0010ffff]| )+"
+
+# Memoizing the alternation is a big win once the grammar grows more
+# commands that share prefixes.  This is a process-wide pyparsing setting
+# (and costs nothing until something parses), so it's made here, once,
+# rather than as a side effect of building the grammar.
+ParserElement.enablePackrat()
+
+# Built on first use by grammar(); nothing pays for pyparsing setup at import.
+_root = None
+
+# How many distinct command strings parse() remembers
+PARSE_CACHE_SIZE = 1024
+
+# Hand-written matchers for the shapes players actually type.  These are
+# deliberately stricter than the grammar (plain spaces only, no text after
+# the command) so anything they accept parses identically under pyparsing;
+# everything else falls through to the full grammar.
+FAST_SKIRMISH = re.compile(
+    r" *(?:attack|oppose|support)"
+    r"(?: +# *(?P<battle>[0-9]+))?"
+    r" +at +(?P<col>[a-z]) *,? *(?P<row>[0-9]+)"
+    r" +with +(?P<troop_type>%s)\Z" % EOL_PATTERN)
+FAST_KEYWORDS = re.compile(r" *(?P<keyword>defect|status) *\Z")
+
+
+def build_grammar():
+    number = Word(nums)
+    string = QuotedString('"', '\\')
+    subreddit = Suppress("/r/") + Word(alphanums + "_-")
+    location = string | subreddit | Word(alphanums + "_-")
+    eolstring = Regex(EOL_PATTERN)
+
+    attack = Keyword("attack")
+    oppose = Keyword("oppose")
+    support = Keyword("support")
+    participate = attack | oppose | support
+
+    target = Suppress("#") + number("target")
+    skirmishcmd = (Suppress(participate("action")) +
+                   Optional(Suppress('#') + Word(nums)("battle")) +
+                   Suppress("at") + Word(alphas, exact=1)("col") +
+                   Optional(",") + Word(nums)("row") +
+                   Suppress("with") + eolstring("troop_type"))
+
+    skirmishcmd.setParseAction(SkirmishCommand)
+
+    # invade = Keyword("invade")
+    # invadecmd = invade + location("where")
+    # invadecmd.setParseAction(InvadeCommand)
+    #
+    # move = Keyword("lead")
+    # sector ="#" + number
+    # destination = location + sector | location | sector | Keyword("*")
+    # destination.setParseAction(Destination)
+    # movecmd = (move + Optional(number("amount") | Keyword("all")) +
+    #            Suppress("to") + delimitedList(destination)("where"))
+    # movecmd.setParseAction(MoveCommand)
+    #
+    # extractcmd = Keyword("extract")
+    # extractcmd.setParseAction(ExtractCommand)
+    #
+    # stopcmd = Keyword("stop")
+    # stopcmd.setParseAction(StopCommand)
+    #
+    defect = Keyword("defect")
+    defect.setParseAction(DefectCommand)
+    #
+    # promote = (Keyword("promote") | Keyword("demote"))
+    # promotecmd = promote("direction") + Word(alphanums + "_-")("who")
+    # promotecmd.setParseAction(PromoteCommand)
+    #
+    # timecmd = Keyword("time")
+    # timecmd.setParseAction(TimeCommand)
+    #
+    #
+    # removecode = Keyword("remove")('remove') + (Keyword("all")('all')
+    #                                             | string("code"))
+    # assigncode = string("code") + Keyword("is") + (alltroops("troop_type")
+    #                                                | string("troop_type"))
+    # statuscode = Keyword("status")('status') + Optional(string("code"))
+    # codewordcmd = Keyword("codeword") + (removecode | statuscode |
+    #                                        assigncode)
+    # codewordcmd.setParseAction(CodewordCommand)
+    #
+    statuscmd = Keyword("status")
+    statuscmd.setParseAction(StatusCommand)
+    #
+    # root = (statuscmd | movecmd | invadecmd | skirmishcmd | defectcmd |
+    #         promotecmd | timecmd | codewordcmd | extractcmd | stopcmd)
+
+    root = (
+        defect |
+        skirmishcmd |
+        statuscmd
+    )
+
+    return root
+
+
+def grammar():
+    global _root
+    if _root is None:
+        _root = build_grammar()
+    return _root
+
+
+def fast_parse(text):
+    """Returns (command class, tokens) if `text` is one of the common
+    command shapes, or None if it needs the full grammar"""
+    match = FAST_SKIRMISH.match(text)
+    if match:
+        tokens = {key: value for key, value in match.groupdict().items()
+                  if value is not None}
+        return SkirmishCommand, tokens
+    match = FAST_KEYWORDS.match(text)
+    if match:
+        keyword = match.group('keyword')
+        if keyword == 'defect':
+            return DefectCommand, [keyword]
+        return StatusCommand, [keyword]
+    return None
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_recipe(text):
+    """Returns the (command class, tokens) needed to build the command for
+    already-normalized `text`.  Parse errors are raised, not cached."""
+    recipe = fast_parse(text)
+    if recipe:
+        return recipe
+    command = grammar().parseString(text)[0]
+    return type(command), command.tokens
 
 
 def parse(s):
-    result = root.parseString(s.lower())
-    return result[0]
+    # Commands carry per-message state, so the cache only remembers how to
+    # build one; every call gets a brand new object, with its own copy of
+    # the tokens so nothing done to one command's leaks into the next.
+    command_class, tokens = parse_recipe(s.lower())
+    return command_class(tokens.copy())
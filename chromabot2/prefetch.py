@@ -0,0 +1,99 @@
+# Double-buffered inbox reading.  A background thread marks frame N's
+# messages read and then fetches frame N+1's, so by the time the bot wants
+# its next messages they're (usually) already here.
+#
+# When that fetch starts is a trade-off.  Started as soon as frame N has its
+# messages, it overlaps handling and answering them, but anything that
+# arrives after it starts waits until frame N+2.  So if the bot sleeps
+# between frames for longer than a fetch takes, it's set going as late in
+# the sleep as it can be and still be done when the sleep is, going by how
+# long the last one took; then it only overlaps the sleep.  Otherwise (no
+# sleep, or a fetch slower than the sleep) it starts straight away.
+#
+# Nothing gets processed twice because of the order things happen in:
+# frame N's messages are converted, and recorded as seen in the DB, on the
+# bot's thread before the fetch for N+1 is even asked for; and the prefetch
+# thread marks them read on reddit before it starts that fetch.
+#
+# The outsider's fetch_inbox and mark_inbox_read run on the prefetch thread
+# while the bot's own thread carries on using the same outsider - for
+# RedditOutsider, the same praw Reddit object and Remote - so those have
+# to be safe to share between threads.
+import logging
+import queue
+import threading
+import time
+
+
+class PrefetchFailed(Exception):
+    """Wraps whatever went wrong on the prefetch thread"""
+
+
+class InboxPrefetcher:
+
+    def __init__(self, outside, timeout=None):
+        self.outside = outside
+        self.timeout = timeout
+        # Only ever one request and one batch in flight: that's the double
+        # buffer.
+        self.requests = queue.Queue(maxsize=1)
+        self.batches = queue.Queue(maxsize=1)
+        self.pending = False
+        # What the last batch needs marked read, sent with the next request
+        self.read = []
+        # How long the last fetch took, in seconds
+        self.fetch_seconds = 0.0
+        self.thread = threading.Thread(target=self.run, name="prefetch",
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.requests.get()
+            if job is None:
+                return
+            targets, read = job
+            started = time.perf_counter()
+            try:
+                self.outside.mark_inbox_read(read)
+                batch = self.outside.fetch_inbox(targets)
+            except Exception as e:
+                logging.exception("Prefetching the inbox failed")
+                batch = PrefetchFailed(e)
+            self.fetch_seconds = time.perf_counter() - started
+            self.batches.put(batch)
+
+    def request(self):
+        """Sets the next frame's fetch going, if it isn't already"""
+        if self.pending:
+            return
+        read, self.read = self.read, []
+        self.requests.put((self.outside.inbox_targets(), read))
+        self.pending = True
+
+    def lead(self):
+        """How long before the bot wants its messages to call request()"""
+        return self.fetch_seconds
+
+    def take(self):
+        """Returns this frame's messages, fetching them now if nobody's
+        asked for them yet"""
+        self.request()
+        batch = self.batches.get(timeout=self.timeout)
+        self.pending = False
+        if isinstance(batch, PrefetchFailed):
+            raise batch
+        messages, self.read = self.outside.convert_inbox(batch)
+        return messages
+
+    def close(self):
+        if self.read and not self.pending:
+            # Nothing's going to fetch again, so mark them read here
+            self.outside.mark_inbox_read(self.read)
+            self.read = []
+        if self.pending:
+            # Don't leave the thread stuck trying to hand over a batch
+            self.batches.get(timeout=self.timeout)
+            self.pending = False
+        self.requests.put(None)
+        self.thread.join(self.timeout)
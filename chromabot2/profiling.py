@@ -0,0 +1,94 @@
+# Optional profiling of bot frames, for finding out why a frame on the
+# production box took 30 seconds without patching the code there.
+import cProfile
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+
+
+class StackSampler(threading.Thread):
+    """Periodically records the stack of another thread.
+
+    Much cheaper than cProfile, and the result is in the collapsed-stack
+    format flamegraph.pl / speedscope understand: one `outer;...;inner N`
+    line per distinct stack.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        super().__init__(name="chromabot-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("%s %d\n" % (stack, count))
+
+
+class FrameProfiler:
+    """Profiles every `every`th call made through `call`.
+
+    In "cprofile" mode each profiled frame gets a .pstats file (for
+    pstats/snakeviz) and a .collapsed file (for flame graphs).  "sample"
+    mode only runs the sampler, and so only writes the .collapsed file,
+    but costs next to nothing.
+    """
+
+    MODES = ("cprofile", "sample")
+
+    def __init__(self, directory, every=1, mode="cprofile", interval=0.005):
+        if mode not in self.MODES:
+            raise ValueError("Unknown profiling mode %s" % mode)
+        self.directory = directory
+        self.every = max(1, every)
+        self.mode = mode
+        self.interval = interval
+        self.calls = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def call(self, func, *args, **kwargs):
+        self.calls += 1
+        if self.calls % self.every:
+            return func(*args, **kwargs)
+
+        base = os.path.join(self.directory, "frame-%06d" % self.calls)
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        profile = None
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+
+        sampler.start()
+        if profile:
+            profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profile:
+                profile.disable()
+                profile.dump_stats(base + ".pstats")
+            sampler.stop()
+            sampler.write_collapsed(base + ".collapsed")
+            logging.info("Wrote profile for frame %d to %s.*", self.calls,
+                         base)
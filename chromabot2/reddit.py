@@ -1,18 +1,29 @@
+import asyncio
 import logging
 import random
 import re
 import socket
 import string
+import threading
 import time
+from collections import namedtuple
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote_plus
 
 import praw
-from retrying import retry
 from requests.exceptions import ConnectionError, HTTPError, Timeout
 
-from .battle import Battle
 from .models import KeyValue, User
 from .outsiders import Message, NullOutsider, outsider
+from .remote import (
+    BudgetPlanner,
+    Deferred,
+    Rejected,
+    Remote,
+    RemoteError,
+    RetryPolicy,
+)
 from .utils import col_to_letter
 
 
@@ -32,6 +43,31 @@ def is_reddit_exception(ex):
         socket.error,
     ))
 
+
+def is_throttled(ex):
+    """Reddit said we're doing that too much: a RATELIMIT API error, or an
+    HTTP 429 for going over the rate limit"""
+    if isinstance(ex, praw.errors.HTTPException):
+        return getattr(ex._raw, 'status_code', None) == 429
+    return (isinstance(ex, praw.errors.APIException) and
+            ex.error_type == 'RATELIMIT')
+
+
+def is_permanent(ex):
+    """Won't work however often it's tried: a 404 or 403 (e.g. a banned
+    user's page), or an API error about the thing itself, like
+    DELETED_COMMENT or USER_BLOCKED"""
+    return (isinstance(ex, (praw.errors.NotFound, praw.errors.Forbidden)) or
+            (isinstance(ex, praw.errors.APIException) and
+             not is_throttled(ex)))
+
+
+def is_transient(ex):
+    """Worth retrying, and a mark against the endpoint's circuit breaker"""
+    if is_permanent(ex) or is_throttled(ex):
+        return False
+    return is_reddit_exception(ex)
+
 FAIL_NOT_PLAYER = """
 Hello!  I'm a bot, in charge of running the 'Chroma' reddit game.
 Unfortunately, you don't seem to actually be playing the game I run!
@@ -67,14 +103,6 @@ END_OF_BATTLE = """
 {board}
 """
 
-EXP_MULTIPLIER = 1000
-EXP_MAX = 54000
-
-retryable = retry(retry_on_exception=is_reddit_exception,
-                  wait_exponential_multiplier=EXP_MULTIPLIER,
-                  wait_exponential_max=EXP_MAX)
-
-
 def timestr(secs=None):
     if secs is None:
         secs = time.mktime(time.localtime())
@@ -95,8 +123,61 @@ def extract_command(text, use_full=False):
     return result
 
 
+# Reddit won't take a comment or PM longer than 10000 characters; leave
+# some room for the header on PMed replies to comments
+REPLY_LIMIT = 9500
+REPLY_SEPARATOR = "\n\n----\n\n"
+
+
+def coalesce_replies(results, limit=REPLY_LIMIT):
+    """Groups results by who they're for and which comment or PM they're
+    answering, in the order they came in, and returns (message, replies)
+    for each, with the text of every reply that needs sending.  A group is
+    only split across several replies if it'd go over `limit`, and only
+    between results unless one on its own is too long."""
+    groups = {}
+    for result in results:
+        if result.is_internal():
+            continue
+        message = result.message
+        source = message.source
+        # Messages that don't know where they came from can't be grouped
+        key = (message.issuer_name, source) if source else id(message)
+        if key not in groups:
+            groups[key] = (message, [])
+        groups[key][1].append(result.text)
+
+    coalesced = []
+    for message, texts in groups.values():
+        replies = []
+        current = ""
+        for text in texts:
+            while len(text) > limit:
+                if current:
+                    replies.append(current)
+                    current = ""
+                replies.append(text[:limit])
+                text = text[limit:]
+            if not current:
+                current = text
+            elif len(current) + len(REPLY_SEPARATOR) + len(text) <= limit:
+                current += REPLY_SEPARATOR + text
+            else:
+                replies.append(current)
+                current = text
+        if current:
+            replies.append(current)
+        coalesced.append((message, replies))
+    return coalesced
+
+
 def reddit_data(battle):
-    return battle.load_outside_data()['reddit']
+    return battle.outside_data['reddit']
+
+
+# Where a battle's post is, which is all most of the outsider needs from its
+# outside_data
+PostInfo = namedtuple("PostInfo", ["id36", "fullname"])
 
 
 class RedditMessage(Message):
@@ -105,13 +186,17 @@ class RedditMessage(Message):
         self.actual = actual
         self.was_comment = getattr(actual, 'was_comment', None)
         self.battle = battle
+        # The fullname of the post a comment's on
+        self.post = getattr(actual, 'link_id', None)
+        # Kept as plain text so replies don't need the DB
+        self.issuer_name = issuer.name
 
-    @retryable
     def reply(self, text):
+        remote = self.outside.remote
         if self.actual:
             pm_only = self.outside.config.reddit.getboolean("pm_only")
             if not (self.was_comment or pm_only):
-                self.actual.reply(text)
+                remote.call("reply", self.actual.reply, text)
             else:
                 header = ""
                 if self.was_comment:
@@ -119,14 +204,62 @@ class RedditMessage(Message):
                               self.actual.permalink)
                 full_reply = "%s\n\n%s" % (header, text)
                 logging.info("PMing: %s" % full_reply)
-                reddit = self.outside.reddit
-                reddit.send_message(
-                    self.issuer.name,
-                    "Chroma game reply",
-                    full_reply)
+                remote.call("send_message", self.outside.reddit.send_message,
+                            self.issuer_name, "Chroma game reply",
+                            full_reply)
         else:
             logging.warning("Could not reply to message because no actual")
 
+    @property
+    def source(self):
+        return getattr(self.actual, 'name', None)
+
+
+class QueuedRedditMessage(RedditMessage):
+    """A RedditMessage rebuilt from the command queue.  The comment or PM it
+    came from is only fetched if replying needs it."""
+
+    def __init__(self, entry, outside):
+        self._actual = None
+        super().__init__(entry.raw_text, entry.issuer, outside,
+                         battle=entry.battle)
+        self.fullname = entry.source
+        self.was_comment = bool(entry.source and
+                                entry.source.startswith('t1_'))
+        # So infer_battle() still knows which battle it was meant for
+        if entry.battle_id is not None:
+            self.post = outside.battles.post_of(entry.battle_id)
+
+    @property
+    def actual(self):
+        if self._actual is None and self.fullname:
+            self._actual = self.outside.remote.call(
+                "inbox", self.outside.reddit.get_info, thing_id=self.fullname)
+        return self._actual
+
+    @actual.setter
+    def actual(self, value):
+        self._actual = value
+
+    @property
+    def source(self):
+        return self.fullname
+
+
+class AccountingHandler(praw.handlers.DefaultHandler):
+    """Shows every response reddit sends to the Remote, so it can count
+    requests and keep track of the rate limit"""
+
+    def __init__(self, remote):
+        super().__init__()
+        self.remote = remote
+
+    def request(self, request, proxies, timeout, verify, **kwargs):
+        response = super().request(request, proxies, timeout, verify,
+                                   **kwargs)
+        self.remote.observe(response.headers)
+        return response
+
 
 @outsider("reddit")
 class RedditOutsider(NullOutsider):
@@ -141,10 +274,96 @@ class RedditOutsider(NullOutsider):
         logging.debug("Using ua '%s' and site '%s'", ua, site)
         cid = config.reddit['client_id']
         csec = config.reddit['client_secret']
+        self.setup_remote(config.reddit)
         self.reddit = praw.Reddit(user_agent=ua, site_name=site,
-                                  client_id=cid, client_secret=csec)
+                                  client_id=cid, client_secret=csec,
+                                  handler=AccountingHandler(self.remote))
+
+    def setup_remote(self, settings):
+        """Everything that goes with calling reddit, short of actually
+        connecting to it"""
+        # Every call to reddit goes through here, under one of the
+        # endpoints "auth", "inbox", "comments", "recruits", "submission",
+        # "submit", "edit", "reply", "send_message" and "user"
+        policy = RetryPolicy(
+            attempts=settings.getint('retry_attempts', fallback=4),
+            base=settings.getfloat('retry_base', fallback=1.0),
+            cap=settings.getfloat('retry_cap', fallback=30.0),
+            transient=is_transient, permanent=is_permanent,
+            throttled=is_throttled)
+        self.remote = Remote(
+            policy,
+            threshold=settings.getint('breaker_threshold', fallback=5),
+            cooldown=settings.getfloat('breaker_cooldown', fallback=60.0))
+        priorities = settings.get(
+            'budget_priority',
+            fallback="reply, send_message, inbox, comments, recruits, edit")
+        self.planner = BudgetPlanner(
+            [name.strip() for name in priorities.split(',') if name.strip()],
+            reserve=settings.getint('budget_reserve', fallback=10))
+        self.usage = None
+        # (send, texts, label) for replies the rate limit budget held back,
+        # sent before anything else next frame; see send_replies()
+        self.unsent = []
+        # (battle id, id36, text) for the final edits of finished battles
+        # that didn't go through; see edit_end()
+        self.unfinished = []
+        self.roster.stranger_ttl = settings.getint('stranger_ttl',
+                                                   fallback=600)
+        # id36 -> submission, which only lasts the frame
+        self.posts = {}
+        self.posts_lock = threading.Lock()
+
+    def begin_frame(self):
+        with self.posts_lock:
+            self.posts.clear()
+        if self.usage:
+            self.remote.plan = self.planner.plan(self.remote.quota,
+                                                 self.usage)
+
+    def end_frame(self, metrics):
+        self.usage = usage = self.remote.take_usage()
+        for endpoint in usage.endpoints():
+            metrics.count("reddit_calls_" + endpoint,
+                          usage.calls.get(endpoint, 0))
+            metrics.count("reddit_requests_" + endpoint,
+                          usage.requests.get(endpoint, 0))
+            metrics.count("reddit_failures_" + endpoint,
+                          usage.failures.get(endpoint, 0))
+            metrics.count("reddit_deferred_" + endpoint,
+                          usage.deferred.get(endpoint, 0))
+            metrics.timings["reddit_" + endpoint] += usage.seconds.get(
+                endpoint, 0.0)
+        quota = self.remote.quota
+        if quota.remaining is not None:
+            logging.debug("Reddit rate limit: %d used, %d remaining",
+                          quota.used, quota.remaining)
+
+    def info_for(self, battle):
+        """The battle's PostInfo"""
+        data = reddit_data(battle)
+        return PostInfo(data['id36'], data['fullname'])
+
+    def invalidate(self, battle):
+        """Forgets the battle's post, if it was fetched this frame"""
+        data = battle.outside_data.get('reddit')
+        if data:
+            with self.posts_lock:
+                self.posts.pop(data['id36'], None)
+
+    def post_key(self, battle):
+        data = battle.outside_data.get('reddit')
+        return data['fullname'] if data else None
+
+    def infer_battle(self, message):
+        # A comment on a battle's post is about that battle, as long as it's
+        # underway
+        battles = self.battles
+        battle = battles.for_post(getattr(message, 'post', None))
+        if battle is not None and battle in battles.active():
+            return battle
+        return None
 
-    @retryable
     def startup(self):
         config = self.config.reddit
         logging.info("Attempting to log in via oauth")
@@ -154,70 +373,83 @@ class RedditOutsider(NullOutsider):
             redirect_uri=config['redirect_uri'],
         )
 
-        self.reddit.refresh_access_information(config['refresh_token'])
-        authenticated_user = self.reddit.get_me()
+        self.remote.call("auth", self.reddit.refresh_access_information,
+                         config['refresh_token'])
+        authenticated_user = self.remote.call("auth", self.reddit.get_me)
         logging.info("Logged in as %s", authenticated_user.name)
 
-    @retryable
     def handle_recruits(self):
-        hq = self.reddit.get_subreddit(self.config.reddit['headquarters'])
-        submissions = hq.get_new()
-        for submission in submissions:
-            if "[recruitment]" in submission.title.lower():
-                self.recruit_from_post(submission)
-                break  # Only recruit from the first one
-
-    @retryable
-    def recruit_from_post(self, post):
-        post.replace_more_comments(threshold=0)
-        flat_comments = praw.helpers.flatten_tree(post.comments)
-        for comment in flat_comments:
+        try:
+            comments = self.fetch_recruits()
+        except RemoteError as e:
+            logging.warning("Skipping recruitment this frame: %s", e)
+            return
+        for comment in comments:
             self.recruit_from_comment(comment)
 
-    @retryable
     def recruit_from_comment(self, comment):
+        name = self.recruit_candidate(comment)
+        if name is None:
+            return
+        author_id = self.look_up_recruit(comment, name)
+        if author_id is not None:
+            self.reply_to(comment, self.enlist(name, author_id))
+
+    # recruit_from_comment in pieces, so the async outsider can do the
+    # reddit calls on its thread pool and the DB work on its own thread
+    def recruit_candidate(self, comment):
+        """The name of the comment's author if they want recruiting, or
+        None if not"""
         if not comment.author:  # Deleted comments don't have an author
             logging.debug("- Ignoring deleted comment")
-            return
+            return None
         name = comment.author.name.lower()
         if name == self.config.reddit['username'].lower():
-            return
+            return None
 
         # Is this author already one of us?
-        with self.db.session() as s:
-            found = s.query(User).filter_by(name=name).first()
-        if not found:
-            # Getting the author ID triggers a lookup on the userpage.  In the
-            # case of banned users, this will 404.  Normally that would be
-            # retried by @retryable, but since that comment's not going
-            # anywhere, we'd get stuck in a loop:
-            try:
-                author_id = comment.author.id
-            except praw.errors.NotFound:
-                logging.warning("Ignored banned user %s" % name)
-                return
-
-            assignment = self.config.reddit['assignment']
-            if assignment == 'uid':
-                base10_id = base36decode(author_id)
-                team = base10_id % 2
-            elif assignment == "random":
-                team = random.randint(0, 1)
-            else:
-                logging.critical("Don't understand how to assign via %s",
-                                 assignment)
-                team = 0
-            newbie = User.create(
-                db=self.db,
-                name=name,
-                team=team,
-                leader=True,
-            )
-            logging.info("Recruited %s to team %s", newbie, team)
-            reply = "You've been recruited!  Welcome to team %d." % team
-            comment.reply(reply)
-        else:
+        found = self.roster.find(name)
+        if found:
             logging.debug("Ignoring preexisting player %s", found)
+            return None
+        return name
+
+    def look_up_recruit(self, comment, name):
+        """The author's reddit ID, or None if they can't be recruited (yet).
+        Only calls reddit."""
+        # Getting the author ID triggers a lookup on the userpage.  In the
+        # case of banned users, this will 404, which isn't retried and
+        # comes back Rejected.  If reddit's just having trouble, try again
+        # next frame.
+        try:
+            return self.fetch_author_id(comment)
+        except Rejected:
+            logging.warning("Ignored banned user %s" % name)
+        except RemoteError as e:
+            logging.warning("Couldn't look up %s: %s", name, e)
+        return None
+
+    def enlist(self, name, author_id):
+        """Signs them up; returns what to tell them"""
+        team = self.assign_team(author_id)
+        newbie = User.create(
+            db=self.db,
+            name=name,
+            team=team,
+            leader=True,
+        )
+        logging.info("Recruited %s to team %s", newbie, team)
+        return "You've been recruited!  Welcome to team %d." % team
+
+    def assign_team(self, author_id):
+        assignment = self.config.reddit['assignment']
+        if assignment == 'uid':
+            base10_id = base36decode(author_id)
+            return base10_id % 2
+        elif assignment == "random":
+            return random.randint(0, 1)
+        logging.critical("Don't understand how to assign via %s", assignment)
+        return 0
 
     def status_for(self, user):
         report = [
@@ -252,133 +484,344 @@ class RedditOutsider(NullOutsider):
         result.append(battle)
         return " ".join(result)
 
-    def convert_comments(self, comments, *, battle=None, use_full=False):
+    def convert_comments(self, comments, *, battle=None, use_full=False,
+                         read=None):
+        """Turns comments into RedditMessages.  Comments get marked as read
+        as they go, unless `read` is a list, in which case they're added to
+        it for the caller to mark."""
         result = []
         if battle:
-            reddata = reddit_data(battle)
-            if 'seen_comments' not in reddata:
-                with battle.load_and_adopt_outside_data() as data:
-                    data['reddit']['seen_comments'] = []
+            seen_comments = set(reddit_data(battle).get('seen_comments', ()))
+            newly_seen = []
 
-        for comment in comments:
-            with self.db.session() as s:
+        try:
+            for comment in comments:
                 if battle:
-                    seen = comment.name in reddit_data(battle)['seen_comments']
+                    seen = comment.name in seen_comments
                 else:
-                    seen = s.query(KeyValue).filter_by(
-                        namespace='reddit', key=comment.name).count()
-            if seen:
-                continue
-
-            if not comment.author:  # Deleted comments don't have an author
-                continue
-            username = self.config.reddit['username'].lower()
-            if comment.author.name.lower() == username:
-                continue
-            logging.info("Received message %s" % comment.body)
-            player = self.find_player(comment)
-            if player:
-                cmds = extract_command(comment.body, use_full=use_full)
-                result.extend(
-                    RedditMessage(cmd, player, self, comment, battle)
-                    for cmd in cmds
-                )
-            else:
-                name = comment.author.name.lower()
-                logging.info("(The player %s is not registered)" % name)
-            comment.mark_as_read()
-            if battle:
-                with battle.load_and_adopt_outside_data() as data:
-                    data['reddit']['seen_comments'].append(comment.name)
-            else:
-                with self.db.session() as s:
-                    s.add(KeyValue(namespace='reddit', key=comment.name,
-                                   value='{}'))
+                    with self.db.session() as s:
+                        seen = s.query(KeyValue).filter_by(
+                            namespace='reddit', key=comment.name).count()
+                if seen:
+                    continue
+
+                if not comment.author:  # Deleted comments have no author
+                    continue
+                username = self.config.reddit['username'].lower()
+                if comment.author.name.lower() == username:
+                    continue
+                logging.info("Received message %s" % comment.body)
+                player = self.find_player(comment)
+                if player:
+                    cmds = extract_command(comment.body, use_full=use_full)
+                    result.extend(
+                        RedditMessage(cmd, player, self, comment, battle)
+                        for cmd in cmds
+                    )
+                else:
+                    name = comment.author.name.lower()
+                    logging.info("(The player %s is not registered)" % name)
+                if read is None:
+                    self.mark_read(comment)
+                else:
+                    read.append(comment)
+                if battle:
+                    seen_comments.add(comment.name)
+                    newly_seen.append(comment.name)
+                else:
+                    with self.db.session() as s:
+                        s.add(KeyValue(namespace='reddit', key=comment.name,
+                                       value='{}'))
+        finally:
+            # The battle's seen comments are added in one go, not per
+            # comment
+            if battle and newly_seen:
+                reddit_data(battle).setdefault('seen_comments', []).extend(
+                    newly_seen)
         return result
 
-    @retryable
     def find_player(self, comment):
         if comment.author:  # Some messages (mod invites) don't have authors
-            with self.db.session() as session:
-                player = session.query(User).filter_by(
-                    name=comment.author.name.lower()).first()
-            if not player and getattr(comment, 'was_comment', None):
-                comment.reply(FAIL_NOT_PLAYER %
-                              self.config.headquarters)
+            name = comment.author.name
+            # Somebody we've only just told how to sign up doesn't need
+            # telling again
+            told = self.roster.is_stranger(name)
+            player = self.roster.find(name)
+            if not (player or told) and getattr(comment, 'was_comment', None):
+                self.reply_to(comment, FAIL_NOT_PLAYER %
+                              self.config.reddit['headquarters'])
             return player
         return None
 
-    @retryable
     def get_messages(self):
-        unread = self.reddit.get_unread(True, True)
+        # Anything that can't be fetched this frame gets picked up next
+        # frame instead
         result = []
+        try:
+            unread = self.fetch_unread()
+        except RemoteError as e:
+            logging.warning("Skipping the inbox this frame: %s", e)
+            unread = []
         # Handle just the PMs first:
         filtered = (comment for comment in unread
                     if not comment.was_comment)
         result.extend(self.convert_comments(filtered, use_full=True))
 
         # And now the battle comments
-        with self.db.session() as s:
-            battles = s.query(Battle).filter_by(relevant=True)
-
-        for battle in battles:
-            post = self.get_post_for_battle(battle)
-            replaced = post.replace_more_comments(limit=None, threshold=0)
-            if replaced:
-                logging.warning("Comments that went un-replaced: %s" % replaced)
-            flat_comments = praw.helpers.flatten_tree(
-                post.comments)
+        for battle_id, id36 in self.inbox_targets():
+            try:
+                flat_comments = self.fetch_comments(id36)
+            except RemoteError as e:
+                logging.warning("Skipping battle %d's comments this frame: "
+                                "%s", battle_id, e)
+                continue
 
-            result.extend(self.convert_comments(flat_comments,
-                                                battle=battle,
-                                                use_full=False))
+            result.extend(self.convert_comments(
+                flat_comments, battle=self.battles.get(battle_id),
+                use_full=False))
         return result
 
-    @retryable
+    def message_from_queue(self, entry):
+        return QueuedRedditMessage(entry, self)
+
     def populate_battle_data(self, battle, data):
         text = INVASION.format(time=timestr(battle.begins))
-        post = self.reddit.submit(self.config.reddit['disputed_zone'],
-                                  title='The Eternal Battle Continues',
-                                  text=text)
+        post = self.remote.call("submit", self.reddit.submit,
+                                self.config.reddit['disputed_zone'],
+                                title='The Eternal Battle Continues',
+                                text=text)
         _, _, id36 = post.name.partition('_')
         data['reddit'] = {
             'fullname': post.name,
             'id36': id36,
         }
+        self.invalidate(battle)
 
-    @retryable
     def report_results(self, results):
-        for result in results:
-            if not result.is_internal():
-                result.message.reply(result.text)
+        self.send_unsent()
+        for message, replies in coalesce_replies(results):
+            self.reply_with(message, replies)
 
-    @retryable
-    def update_battle(self, battle):
+    def reply_with(self, message, replies):
+        self.send_replies(message.reply, replies, message.issuer_name)
+
+    def send_replies(self, send, texts, label):
+        """Calls send(text) for each of `texts`, in order.  If the budget
+        says not now, that one and the rest are kept for next frame."""
+        for index, text in enumerate(texts):
+            try:
+                send(text)
+            except Deferred as e:
+                logging.info("Holding replies to %s till next frame: %s",
+                             label, e)
+                self.unsent.append((send, texts[index:], label))
+                return
+            except RemoteError as e:
+                logging.warning("Couldn't reply to %s: %s", label, e)
+
+    def send_unsent(self):
+        """Sends whatever earlier frames had to hold back"""
+        unsent, self.unsent = self.unsent, []
+        for send, texts, label in unsent:
+            self.send_replies(send, texts, label)
+        unfinished, self.unfinished = self.unfinished, []
+        for battle_id, id36, text in unfinished:
+            self.edit_end(battle_id, id36, text)
+
+    def battle_text(self, battle):
         board = self.visual_state(battle)
-        team0, team1, *_ = battle.load_scores()
+        team0, team1, *_ = battle.scores
         end = timestr(battle.display_ends)
-        text = BATTLE.format(id=battle.id, team0=team0, team1=team1,
+        return BATTLE.format(id=battle.id, team0=team0, team1=team1,
                              board=board, end=end)
-        post = self.get_post_for_battle(battle)
-        post.edit(text)
 
-    @retryable
-    def report_battle_end(self, battle):
+    def end_text(self, battle):
         board = self.visual_state(battle)
-        team0, team1, *_ = battle.load_scores()
+        team0, team1, *_ = battle.scores
         winner = "Team %s" % battle.victor
-        text = END_OF_BATTLE.format(id=battle.id, team0=team0, team1=team1,
+        return END_OF_BATTLE.format(id=battle.id, team0=team0, team1=team1,
                                     board=board, winner=winner)
-        post = self.get_post_for_battle(battle)
-        post.edit(text)
 
-    @retryable
+    def update_battle(self, battle):
+        # If this doesn't go through, the next frame's update will
+        self.try_edit(battle.id, self.info_for(battle).id36,
+                      self.battle_text(battle))
+
+    def report_battle_end(self, battle):
+        self.edit_end(battle.id, self.info_for(battle).id36,
+                      self.end_text(battle))
+        # That's the last we'll hear of it
+        self.invalidate(battle)
+
+    def archive_data(self, battle, data, stats):
+        # Where the post was is worth keeping; which comments were read
+        # isn't
+        reddit = battle.outside_data.get('reddit')
+        if not reddit:
+            return
+        stats['comments'] = len(reddit.get('seen_comments', ()))
+        data['reddit'] = {
+            'fullname': reddit['fullname'],
+            'id36': reddit['id36'],
+        }
+        self.invalidate(battle)
+
+    def prune(self):
+        # PMs are only remembered so a hiccup marking them read doesn't get
+        # them run twice; long after they were read, that can't happen.
+        keep = self.config.reddit.getint('keep_seen', fallback=10000)
+        with self.db.session() as s:
+            oldest = (s.query(KeyValue.id).filter_by(namespace='reddit')
+                      .order_by(KeyValue.id.desc()).offset(keep)
+                      .limit(1).scalar())
+            if oldest is not None:
+                pruned = s.query(KeyValue).filter(
+                    KeyValue.namespace == 'reddit',
+                    KeyValue.id <= oldest).delete(synchronize_session=False)
+                logging.info("Forgot %d old PMs", pruned)
+
+    def try_edit(self, battle_id, id36, text):
+        try:
+            self.edit_post(id36, text)
+        except RemoteError as e:
+            logging.warning("Couldn't edit battle %d's post: %s", battle_id,
+                            e)
+
+    def edit_end(self, battle_id, id36, text):
+        """Puts the result on a finished battle's post.  Nothing else is
+        going to edit it, so if that doesn't go through it's tried again
+        next frame."""
+        try:
+            self.edit_post(id36, text)
+        except Rejected as e:
+            logging.warning("Battle %d's post can't be edited: %s",
+                            battle_id, e)
+        except RemoteError as e:
+            logging.info("Holding battle %d's result till next frame: %s",
+                         battle_id, e)
+            self.unfinished.append((battle_id, id36, text))
+
     def get_post_for_battle(self, battle):
-        post = self.reddit.get_submission(
-            submission_id=reddit_data(battle)['id36'],
-        )
+        return self.fetch_post(self.info_for(battle).id36)
+
+    # Just the reddit calls, for running on other threads (see the async
+    # outsider below, and the inbox methods).  They must not touch the DB
+    # or the ORM objects.  They raise RemoteError if reddit's not having
+    # it, except for mark_read and reply_to, whose failures aren't worth
+    # stopping for (though replies the budget held back are still sent
+    # next frame).
+    def fetch_unread(self):
+        return self.remote.call(
+            "inbox", lambda: list(self.reddit.get_unread(True, True)))
+
+    def submission(self, id36, fresh=False):
+        """The post, fetched at most once a frame unless `fresh` is set.
+        Call this from inside a remote call."""
+        with self.posts_lock:
+            post = None if fresh else self.posts.get(id36)
+        if post is None:
+            post = self.reddit.get_submission(submission_id=id36)
+            with self.posts_lock:
+                self.posts[id36] = post
         return post
 
+    def fetch_post(self, id36):
+        return self.remote.call("submission", self.submission, id36)
+
+    def fetch_comments(self, id36):
+        def fetch():
+            # Always fresh: the prefetch thread fetches these before the
+            # next frame begins, and last frame's copy (from an edit, say)
+            # wouldn't have anything posted since
+            post = self.submission(id36, fresh=True)
+            replaced = post.replace_more_comments(limit=None, threshold=0)
+            if replaced:
+                logging.warning("Comments that went un-replaced: %s" %
+                                replaced)
+            return praw.helpers.flatten_tree(post.comments)
+        return self.remote.call("comments", fetch)
+
+    def fetch_recruits(self):
+        def fetch():
+            hq = self.reddit.get_subreddit(
+                self.config.reddit['headquarters'])
+            for submission in hq.get_new():
+                if "[recruitment]" in submission.title.lower():
+                    # Only recruit from the first one
+                    submission.replace_more_comments(threshold=0)
+                    return praw.helpers.flatten_tree(submission.comments)
+            return []
+        return self.remote.call("recruits", fetch)
+
+    def fetch_author_id(self, comment):
+        return self.remote.call("user", lambda: comment.author.id)
+
+    def edit_post(self, id36, text):
+        def edit():
+            self.submission(id36).edit(text)
+        self.remote.call("edit", edit)
+
+    def mark_read(self, comment):
+        try:
+            self.remote.call("inbox", comment.mark_as_read)
+        except RemoteError as e:
+            # It's been recorded as seen, so it won't be handled twice
+            logging.warning("Couldn't mark %s read: %s", comment.name, e)
+
+    def reply_to(self, comment, text):
+        self.send_replies(partial(self.remote.call, "reply", comment.reply),
+                          [text], comment.name)
+
+    # Inbox prefetching; see prefetch.py.  fetch_inbox and mark_inbox_read
+    # use self.reddit from the prefetch thread while the bot's thread is
+    # replying and editing posts with it.  praw's DefaultHandler locks
+    # around its rate limiting and cache, and Remote locks its own
+    # bookkeeping, which is what makes that safe.
+    can_prefetch = True
+
+    def inbox_targets(self):
+        battles = self.battles
+        targets = []
+        for battle_id in battles.ids():
+            fullname = battles.post_of(battle_id)
+            if fullname:
+                _, _, id36 = fullname.partition('_')
+                targets.append((battle_id, id36))
+        return targets
+
+    def fetch_inbox(self, targets):
+        try:
+            unread = [comment for comment in self.fetch_unread()
+                      if not comment.was_comment]
+        except RemoteError as e:
+            logging.warning("Skipping the inbox this frame: %s", e)
+            unread = []
+        threads = []
+        for battle_id, id36 in targets:
+            try:
+                threads.append((battle_id, self.fetch_comments(id36)))
+            except RemoteError as e:
+                logging.warning("Skipping battle %d's comments this frame: "
+                                "%s", battle_id, e)
+        return unread, threads
+
+    def convert_inbox(self, batch):
+        unread, threads = batch
+        read = []
+        result = self.convert_comments(unread, use_full=True, read=read)
+        relevant = set(self.battles.ids())
+        for battle_id, comments in threads:
+            # It may have ended while we were fetching
+            if battle_id in relevant:
+                result.extend(self.convert_comments(
+                    comments, battle=self.battles.get(battle_id),
+                    use_full=False, read=read))
+        return result, read
+
+    def mark_inbox_read(self, read):
+        for comment in read:
+            self.mark_read(comment)
+
     def visual_state(self, battle):
         board = battle.realize_board()
         num_cols = len(board[0])
@@ -391,3 +834,91 @@ class RedditOutsider(NullOutsider):
             cols.extend(self.icon_for_troop(troop) for troop in row)
             lines.append("|%s|" % "|".join(cols))
         return "\n".join(lines)
+
+
+@outsider("reddit-async")
+class AsyncRedditOutsider(RedditOutsider):
+    """The reddit outsider for AsyncChromabot.
+
+    Its methods are coroutines.  Anything touching the DB happens on the
+    event loop's thread; only the reddit calls themselves go to a thread
+    pool, [reddit] concurrency of them at a time.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        concurrency = config.reddit.getint('concurrency', fallback=4)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def offload(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def try_offload(self, what, func, *args):
+        """offload, logging instead of raising if reddit won't cooperate;
+        returns None if so"""
+        try:
+            return await self.offload(func, *args)
+        except RemoteError as e:
+            logging.warning("Skipping %s this frame: %s", what, e)
+
+    async def startup(self):
+        await self.offload(super().startup)
+
+    async def handle_recruits(self):
+        comments = await self.try_offload("recruitment",
+                                          self.fetch_recruits) or []
+        # The same as recruit_from_comment, with the reddit calls offloaded
+        for comment in comments:
+            name = self.recruit_candidate(comment)
+            if name is None:
+                continue
+            author_id = await self.offload(self.look_up_recruit, comment,
+                                           name)
+            if author_id is not None:
+                await self.offload(self.reply_to, comment,
+                                   self.enlist(name, author_id))
+
+    async def get_messages(self):
+        targets = self.inbox_targets()
+        # All the fetching happens at once; anything that fails is left
+        # for next frame...
+        unread, *threads = await asyncio.gather(
+            self.try_offload("the inbox", self.fetch_unread),
+            *(self.try_offload("battle %d's comments" % battle_id,
+                               self.fetch_comments, id36)
+              for battle_id, id36 in targets))
+
+        # ...then the DB work, in order...
+        read = []
+        result = self.convert_comments(
+            (comment for comment in unread or [] if not comment.was_comment),
+            use_full=True, read=read)
+        for (battle_id, _), comments in zip(targets, threads):
+            if comments is not None:
+                result.extend(self.convert_comments(
+                    comments, battle=self.battles.get(battle_id),
+                    use_full=False, read=read))
+
+        # ...and marking them all read at once again.
+        await asyncio.gather(*(self.offload(self.mark_read, comment)
+                               for comment in read))
+        return result
+
+    async def report_results(self, results):
+        await self.offload(self.send_unsent)
+        # Different players' replies go at once, but each one's in order
+        await asyncio.gather(*(self.offload(self.reply_with, message, replies)
+                               for message, replies in
+                               coalesce_replies(results)))
+
+    async def update_battle(self, battle):
+        text = self.battle_text(battle)
+        await self.offload(self.try_edit, battle.id,
+                           self.info_for(battle).id36, text)
+
+    async def report_battle_end(self, battle):
+        text = self.end_text(battle)
+        await self.offload(self.edit_end, battle.id,
+                           self.info_for(battle).id36, text)
+        self.invalidate(battle)
@@ -0,0 +1,378 @@
+# Calling out to flaky remote services.  Each call is retried on its own,
+# with jittered exponential backoff, so one bad request doesn't throw away
+# everything around it.  Calls are grouped into endpoints ("inbox", "edit",
+# ...), each with a circuit breaker: after enough failures in a row the
+# breaker opens and calls to that endpoint fail straight away for a while,
+# rather than holding up the whole frame.
+#
+# Remote also keeps count of what each endpoint used every frame, and of
+# what the service says is left of its rate limit, so a BudgetPlanner can
+# share out each frame's requests by priority.
+import functools
+import logging
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+
+
+class RemoteError(Exception):
+    """A remote call failed for good; `cause` is the last thing it raised
+    (or None if it never got tried)"""
+
+    def __init__(self, endpoint, cause=None):
+        super().__init__(endpoint, cause)
+        self.endpoint = endpoint
+        self.cause = cause
+
+    def __str__(self):
+        return "%s: %r" % (self.endpoint, self.cause)
+
+
+class CircuitOpen(RemoteError):
+    """The endpoint has been failing, so we didn't even try"""
+
+    def __str__(self):
+        return "%s: circuit open" % self.endpoint
+
+
+class Rejected(RemoteError):
+    """The service turned the call down for good (something that's been
+    deleted, say), so there's no point trying it again"""
+
+
+class Deferred(RemoteError):
+    """Skipped to stay inside the rate limit; it'll keep till next frame"""
+
+    def __str__(self):
+        return "%s: deferred" % self.endpoint
+
+
+class RateLimited(Deferred):
+    """The service said to slow down.  Like Deferred, it'll keep till next
+    frame; retrying now would only make it worse."""
+
+    def __str__(self):
+        return "%s: rate limited (%r)" % (self.endpoint, self.cause)
+
+
+class RetryPolicy:
+    """Retries calls that raise something `transient` approves of, up to
+    `attempts` tries in all.  The wait before retry n is uniformly random
+    between 0 and min(cap, base * 2**n) ("full jitter").
+
+    Of what isn't transient, Remote turns what `permanent` approves of into
+    Rejected and what `throttled` approves of into RateLimited; anything
+    else is a bug, not the service, and is raised as it is.
+    """
+
+    def __init__(self, attempts=4, base=1.0, cap=30.0,
+                 transient=lambda e: True, sleep=time.sleep, rng=None,
+                 permanent=lambda e: False, throttled=lambda e: False):
+        self.attempts = max(1, attempts)
+        self.base = base
+        self.cap = cap
+        self.transient = transient
+        self.permanent = permanent
+        self.throttled = throttled
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt):
+        return self.rng.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        for attempt in range(self.attempts):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not self.transient(e) or attempt + 1 >= self.attempts:
+                    raise
+                wait = self.delay(attempt)
+                logging.info("Retrying %s in %.1fs after %r",
+                             getattr(func, '__name__', func), wait, e)
+                self.sleep(wait)
+
+
+class CircuitBreaker:
+    """Closed until `threshold` failures in a row, then open for `cooldown`
+    seconds, after which one trial call is let through (half open).  If
+    that works it closes again; if not it stays open for another cooldown.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, threshold=5, cooldown=60.0,
+                 timer=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.timer = timer
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return self.CLOSED
+        if self.timer() - self.opened >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def succeeded(self):
+        with self.lock:
+            if self.opened is not None:
+                logging.info("Circuit %s closed again", self.name)
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                if self.opened is None or self.trial:
+                    logging.warning("Circuit %s opened after %d failures",
+                                    self.name, self.failures)
+                self.opened = self.timer()
+                self.trial = False
+
+
+class Usage:
+    """Per-endpoint tallies for one frame.  A call is one try at a remote
+    function (so retries count again), which might make several requests.
+    """
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.requests = defaultdict(int)
+        self.failures = defaultdict(int)
+        self.deferred = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def cost(self, endpoint):
+        """Requests per call, going by this frame"""
+        calls = self.calls.get(endpoint, 0)
+        if not calls:
+            return 1
+        return max(1, self.requests.get(endpoint, 0) / calls)
+
+    def endpoints(self):
+        return sorted(set(self.calls) | set(self.requests) |
+                      set(self.deferred))
+
+
+class Quota:
+    """What the service's rate limit headers last said"""
+
+    def __init__(self, timer=time.monotonic):
+        self.timer = timer
+        self.remaining = None
+        self.used = None
+        self.resets = None
+
+    def observe(self, headers):
+        try:
+            remaining = float(headers["x-ratelimit-remaining"])
+            used = int(headers.get("x-ratelimit-used", 0))
+            reset = float(headers["x-ratelimit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.remaining = remaining
+        self.used = used
+        self.resets = self.timer() + reset
+
+    def left(self):
+        """(requests remaining, seconds until they're topped up), or None
+        if we don't know"""
+        if self.resets is None:
+            return None
+        until = self.resets - self.timer()
+        if until <= 0:
+            return None
+        return self.remaining, until
+
+
+class Plan:
+    """One frame's share of the rate limit.  Each endpoint in the
+    planner's priorities is granted some requests; once those are gone it
+    can dip into whatever nobody was granted, and after that its calls are
+    deferred.  Endpoints the planner wasn't told about are never deferred.
+    """
+
+    def __init__(self, budget, grants, costs, spare):
+        self.budget = budget
+        self.grants = grants
+        self.costs = costs
+        self.spare = spare
+        self.lock = threading.Lock()
+
+    def spend(self, endpoint):
+        if endpoint not in self.grants:
+            return True
+        cost = self.costs[endpoint]
+        with self.lock:
+            if self.grants[endpoint] >= cost:
+                self.grants[endpoint] -= cost
+                return True
+            if self.spare >= cost:
+                self.spare -= cost
+                return True
+        return False
+
+
+class BudgetPlanner:
+    """Spreads what's left of the rate limit evenly over the frames until
+    it resets, keeping `reserve` requests back, and shares each frame's
+    budget out among `priorities` (most important first).  What each
+    endpoint needs is guessed from what it used (or wanted) last frame.
+    """
+
+    def __init__(self, priorities, reserve=10, timer=time.monotonic):
+        self.priorities = list(priorities)
+        self.reserve = reserve
+        self.timer = timer
+        self.last = None
+
+    def plan(self, quota, usage):
+        """Returns the Plan for a frame starting now, or None if there's
+        nothing to go on yet"""
+        now = self.timer()
+        interval, self.last = (None if self.last is None
+                               else now - self.last), now
+        left = quota.left()
+        if left is None or interval is None:
+            return None
+        remaining, until = left
+        frames = max(1, math.ceil(until / max(interval, 1)))
+        budget = max(0.0, remaining - self.reserve) / frames
+
+        spare = budget
+        # Whatever isn't up for deferring comes off the top
+        for endpoint in usage.endpoints():
+            if endpoint not in self.priorities:
+                spare -= usage.requests[endpoint]
+        grants = {}
+        costs = {}
+        short = []
+        for endpoint in self.priorities:
+            cost = costs[endpoint] = usage.cost(endpoint)
+            need = max(cost, usage.requests.get(endpoint, 0) +
+                       usage.deferred.get(endpoint, 0) * cost)
+            grants[endpoint] = max(0.0, min(need, spare))
+            spare -= grants[endpoint]
+            if grants[endpoint] < need:
+                short.append(endpoint)
+        if short:
+            logging.info("Reddit budget is %.1f requests this frame (%d "
+                         "left for %ds); may defer %s", budget, remaining,
+                         until, ", ".join(short))
+        return Plan(budget, grants, costs, max(0.0, spare))
+
+
+class Remote:
+    """The one place remote calls go through.  call("edit", post.edit,
+    text) runs post.edit(text) under the "edit" endpoint's breaker and the
+    retry policy, raising RemoteError if it can't be done.
+
+    Whatever's making the requests should hand their headers to observe(),
+    from inside the call, so they're counted against the right endpoint.
+    """
+
+    def __init__(self, policy=None, threshold=5, cooldown=60.0,
+                 timer=time.monotonic):
+        self.policy = policy or RetryPolicy()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.timer = timer
+        self.breakers = {}
+        self.lock = threading.Lock()
+        self.usage = Usage()
+        self.quota = Quota(timer)
+        self.plan = None
+        # Which endpoint the current thread is calling, if any
+        self.local = threading.local()
+
+    def breaker(self, endpoint):
+        with self.lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(
+                    endpoint, self.threshold, self.cooldown, self.timer)
+            return self.breakers[endpoint]
+
+    def observe(self, headers):
+        endpoint = getattr(self.local, "endpoint", None) or "other"
+        with self.lock:
+            self.usage.requests[endpoint] += 1
+            self.quota.observe(headers)
+
+    def take_usage(self):
+        """This frame's Usage, starting a fresh one for the next"""
+        with self.lock:
+            usage, self.usage = self.usage, Usage()
+        return usage
+
+    def counted(self, endpoint, func):
+        """func, but counted against endpoint in this frame's usage"""
+        @functools.wraps(func)
+        def attempt(*args, **kwargs):
+            self.local.endpoint = endpoint
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                with self.lock:
+                    self.usage.failures[endpoint] += 1
+                raise
+            finally:
+                self.local.endpoint = None
+                with self.lock:
+                    self.usage.calls[endpoint] += 1
+                    self.usage.seconds[endpoint] += (time.perf_counter() -
+                                                     start)
+        return attempt
+
+    def call(self, endpoint, func, *args, **kwargs):
+        plan = self.plan
+        if plan and not plan.spend(endpoint):
+            with self.lock:
+                self.usage.deferred[endpoint] += 1
+            raise Deferred(endpoint)
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpen(endpoint)
+        try:
+            result = self.policy.call(self.counted(endpoint, func), *args,
+                                      **kwargs)
+        except Exception as e:
+            policy = self.policy
+            if policy.transient(e):
+                breaker.failed()
+                raise RemoteError(endpoint, e) from e
+            # Not the service being flaky (a 404, say, or being told to slow
+            # down), so the breaker doesn't care
+            breaker.succeeded()
+            if policy.throttled(e):
+                with self.lock:
+                    self.usage.deferred[endpoint] += 1
+                raise RateLimited(endpoint, e) from e
+            if policy.permanent(e):
+                raise Rejected(endpoint, e) from e
+            raise
+        breaker.succeeded()
+        return result
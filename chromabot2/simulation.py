@@ -0,0 +1,254 @@
+# Battle ticks as pure functions over plain data.  Nothing in here touches
+# the DB or the outsider, so a tick can run anywhere - including a worker
+# process in a pool.  Battle.snapshot() loads the input, tick() works out
+# what happens, and Battle.apply() writes the Outcome back.
+from collections import namedtuple
+
+from .commands import (
+    CODE_BEGIN_BATTLE,
+    CODE_END_BATTLE,
+    CODE_INFO,
+    CODE_MOVE,
+    CODE_SCORE,
+)
+
+# The troop columns a tick can change
+TROOP_FIELDS = ("hp", "cause_of_death", "row", "col", "visible", "opposed",
+                "last_move")
+
+
+class TroopState:
+    """Just what a tick needs to know about one troop"""
+
+    __slots__ = ("id", "type", "team") + TROOP_FIELDS + ("in_battle",)
+
+    def __init__(self, id, type, team, hp, cause_of_death, row, col,
+                 visible, opposed, last_move, in_battle=True):
+        self.id = id
+        self.type = type
+        self.team = team
+        self.hp = hp
+        self.cause_of_death = cause_of_death
+        self.row = row
+        self.col = col
+        self.visible = visible
+        self.opposed = opposed
+        self.last_move = last_move
+        # False once it's been let go of
+        self.in_battle = in_battle
+
+    def copy(self):
+        return TroopState(*(getattr(self, name) for name in self.__slots__))
+
+    def diff(self, original):
+        """{field: value} for everything changed since `original`"""
+        return {field: getattr(self, field)
+                for field in TROOP_FIELDS + ("in_battle",)
+                if getattr(self, field) != getattr(original, field)}
+
+    def __eq__(self, other):
+        return (isinstance(other, TroopState) and
+                all(getattr(self, name) == getattr(other, name)
+                    for name in self.__slots__))
+
+    def __repr__(self):
+        return "<TroopState(id=%d, team=%d, hp=%d)>" % (self.id, self.team,
+                                                        self.hp)
+
+
+class BoardState:
+    """Just what a tick needs to know about one battle; see
+    Battle.snapshot()"""
+
+    __slots__ = ("id", "active", "begins", "ends", "board", "scores",
+                 "troops")
+
+    def __init__(self, id, active, begins, ends, board, scores, troops):
+        self.id = id
+        self.active = active
+        self.begins = begins
+        self.ends = ends
+        self.board = board
+        self.scores = scores
+        # TroopStates, in troop id order
+        self.troops = troops
+
+    def __repr__(self):
+        return "<BoardState(id=%d, troops=%d)>" % (self.id, len(self.troops))
+
+
+Outcome = namedtuple("Outcome", [
+    "battle_id",
+    "active",
+    "relevant",
+    "victor",
+    "board",
+    "scores",
+    # {'id': troop id, field: value...} for each troop that changed, with
+    # just the fields that did (see TroopState.diff)
+    "troops",
+    # (text, code, extra) for each Result, in order
+    "results",
+])
+
+
+def fights(ours, theirs, matchups):
+    """Returns 1 if ours wins, 0 for a tie, and -1 for a loss"""
+    if ours == theirs:
+        return 0
+    return matchups[(ours, theirs)]
+
+
+class Simulation:
+    """One battle's worth of mutable state, for the length of one tick"""
+
+    def __init__(self, snapshot, now, settings, matchups):
+        self.snapshot = snapshot
+        self.now = now
+        self.settings = settings
+        self.matchups = matchups
+        self.active = snapshot.active
+        self.relevant = True
+        self.victor = -1
+        self.board = [list(row) for row in snapshot.board]
+        self.scores = list(snapshot.scores)
+        self.troops = [troop.copy() for troop in snapshot.troops]
+        self.by_id = {troop.id: troop for troop in self.troops}
+        self.results = []
+
+    def result(self, text, code=CODE_INFO, extra=None):
+        result = (text, code, extra)
+        self.results.append(result)
+        return result
+
+    def run(self):
+        if not self.active:
+            if self.now >= self.snapshot.begins:
+                self.active = True
+                self.result("Battle %d has begun" % self.snapshot.id,
+                            CODE_BEGIN_BATTLE)
+        else:
+            troop_delay = self.settings.troop_delay
+            for troop in self.troops:
+                if not troop.hp:
+                    continue
+                if troop.last_move + troop_delay <= self.now:
+                    self.move(troop)
+
+            if self.now >= self.snapshot.ends:
+                self.result("Battle %d has completed" % self.snapshot.id,
+                            CODE_END_BATTLE)
+                self.end()
+        return self.outcome()
+
+    def outcome(self):
+        return Outcome(
+            battle_id=self.snapshot.id,
+            active=self.active,
+            relevant=self.relevant,
+            victor=self.victor,
+            board=self.board,
+            scores=self.scores,
+            troops=self.changes(),
+            results=self.results,
+        )
+
+    def changes(self):
+        changes = []
+        for troop, original in zip(self.troops, self.snapshot.troops):
+            changed = troop.diff(original)
+            if changed:
+                changed['id'] = troop.id
+                changes.append(changed)
+        return changes
+
+    def move(self, troop):
+        direction = [1, -1][troop.team]
+        row = troop.row
+        col = troop.col
+        newcol = col + direction
+        battle_report = ''
+
+        if newcol < 0 or newcol >= len(self.board[0]):
+            # SCORE!
+            self.kill(troop, "is behind enemy lines")
+            team = troop.team
+            amount = self.settings.goal_score
+            if not troop.opposed:
+                amount *= 2
+            self.scores[team] += amount
+            return self.result(
+                "Troop %d slipped behind enemy lines, awarding "
+                "team %d %d points" % (troop.id, team, amount),
+                CODE_SCORE, {'team': team, 'amount': amount})
+
+        if self.board[row][newcol]:
+            other = self.by_id[self.board[row][newcol]]
+            if troop.team == other.team:
+                return self.result(
+                    "Troop %d halted to avoid friendly fire" % troop.id)
+            # Oh shit, FIGHT!
+            windex = fights(troop.type, other.type, self.matchups)
+            winner = [None, troop, other][windex]
+            loser = [None, other, troop][windex]
+            if winner:
+                winner.opposed = True
+                winner.visible = True
+                self.kill(loser, "has fallen in battle")
+                self.scores[winner.team] += self.settings.kill_score
+                if winner is troop:
+                    battle_report = ": defeated %d" % loser.id
+                else:
+                    battle_report = ": was defeated by %d" % winner.id
+            else:
+                self.evict(troop)
+                self.evict(other)
+                battle_report = ": tied with %d" % other.id
+
+        # A troop that loses its fight still ends up here: it's dead, but
+        # hasn't left the battle.
+        if troop.in_battle:
+            troop.col = newcol
+            troop.last_move = self.now
+            self.board[row][newcol] = troop.id
+            self.board[row][col] = 0
+            return self.result("Troop %d moved to row %d, col %d%s" % (
+                troop.id, row, newcol, battle_report), CODE_MOVE, troop.id)
+        return self.result("Troop %d left the field%s" % (troop.id,
+                                                          battle_report))
+
+    def kill(self, troop, cause_of_death):
+        troop.cause_of_death = cause_of_death
+        troop.hp = 0
+        self.board[troop.row][troop.col] = 0
+
+    def rez(self, troop):
+        troop.hp = 1
+        troop.cause_of_death = ''
+        troop.visible = False
+        troop.opposed = False
+        troop.in_battle = False
+
+    def evict(self, troop):
+        self.rez(troop)
+        self.board[troop.row][troop.col] = 0
+
+    def end(self):
+        if self.scores[0] > self.scores[1]:
+            self.victor = 0
+        elif self.scores[1] > self.scores[0]:
+            self.victor = 1
+        self.active = False
+        self.relevant = False
+        for troop in self.troops:
+            if troop.in_battle:
+                self.rez(troop)
+
+
+def tick(snapshot, now, settings, matchups):
+    """Works out one update of a battle; returns an Outcome.
+
+    `settings` is the [battle] part of a config snapshot.  Everything in and
+    out is plain, picklable data.
+    """
+    return Simulation(snapshot, now, settings, matchups).run()
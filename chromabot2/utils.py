@@ -1,3 +1,4 @@
+import asyncio
 import string
 import time
 
@@ -12,3 +13,84 @@ def col_to_letter(col):
 
 def letter_to_col(letter):
     return string.ascii_lowercase.index(letter)
+
+
+# CLOCKS
+# The engine asks its outsider's clock what time it is rather than calling
+# now() directly, so tests, benchmarks and admins can control time.
+class Clock:
+    """The real wall clock.
+
+    Between begin_frame() and end_frame() the time stands still at the
+    instant the frame started, so everything in one frame agrees on when
+    "now" is.
+    """
+
+    def __init__(self):
+        self.frozen = None
+
+    def current(self):
+        return now()
+
+    def now(self):
+        if self.frozen is not None:
+            return self.frozen
+        return self.current()
+
+    def begin_frame(self):
+        self.frozen = self.current()
+        return self.frozen
+
+    def end_frame(self):
+        self.frozen = None
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def pause(self, seconds):
+        """sleep(), for asyncio code"""
+        await asyncio.sleep(seconds)
+
+
+class FixedClock(Clock):
+    """Only moves when told to, or when something sleeps on it"""
+
+    def __init__(self, when=None):
+        super().__init__()
+        if when is None:
+            when = now()
+        self.when = when
+
+    def current(self):
+        return self.when
+
+    def advance(self, seconds):
+        self.when += seconds
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    async def pause(self, seconds):
+        self.advance(seconds)
+
+
+class AcceleratedClock(Clock):
+    """Runs `factor` times faster than real time, starting from `start`"""
+
+    def __init__(self, factor, start=None):
+        super().__init__()
+        if start is None:
+            start = now()
+        self.factor = factor
+        self.start = start
+        self.origin = time.monotonic()
+
+    def current(self):
+        elapsed = time.monotonic() - self.origin
+        return int(self.start + elapsed * self.factor)
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.factor)
+
+    async def pause(self, seconds):
+        await asyncio.sleep(seconds / self.factor)
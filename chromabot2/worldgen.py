@@ -0,0 +1,149 @@
+# Builds large synthetic worlds straight into the DB, for scale testing.
+# Everything goes in through bulk inserts with explicitly assigned IDs, so
+# a million rows takes seconds rather than the hours User.create would.
+import random
+from collections import namedtuple
+
+from sqlalchemy import func
+
+from .battle import Battle, Troop
+from .models import User
+from .utils import now as wallclock
+
+TROOP_TYPES = ("infantry", "cavalry", "ranged")
+
+WorldSummary = namedtuple("WorldSummary", [
+    "users",
+    "troops",
+    "battles",
+    "deployed",
+])
+
+
+def next_id(session, model):
+    return (session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def insert_batches(session, table, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        session.execute(table.insert(), batch)
+
+
+def generate_world(db, settings, *, users=1000, troops_per_user=3,
+                   battles=1, fill=0.3, seed=0, now=None, move_spread=None,
+                   batch_size=5000):
+    """Fills `db` with a reproducible synthetic world.
+
+    `settings` is the [battle] part of a config snapshot, and decides board
+    size and timings.  Users are split randomly between the two teams and
+    get `troops_per_user` troops each, cycling through the troop types.
+    Each of the `battles` active battles has `fill` of each team's half of
+    the board occupied, with troops' last_move spread over the last
+    `move_spread` seconds (two troop delays by default) so only some of
+    them are due to move on any given frame.
+    """
+    rng = random.Random(seed)
+    if now is None:
+        now = wallclock()
+    if move_spread is None:
+        move_spread = 2 * settings.troop_delay
+
+    with db.session() as s:
+        first_user = next_id(s, User)
+        first_troop = next_id(s, Troop)
+        first_battle = next_id(s, Battle)
+
+    teams = [rng.randint(0, 1) for _ in range(users)]
+
+    def troop_id(user_index, slot):
+        return first_troop + user_index * troops_per_user + slot
+
+    # Work out who's fighting where before writing any troops, so troop
+    # rows can be written in one streaming pass.
+    pools = [[], []]
+    for index, team in enumerate(teams):
+        pools[team].extend(troop_id(index, slot)
+                           for slot in range(troops_per_user))
+    for pool in pools:
+        rng.shuffle(pool)
+
+    columns, rows = settings.columns, settings.rows
+    half = columns // 2
+    deployments = {}
+    battle_rows = []
+    for number in range(battles):
+        battle_id = first_battle + number
+        board = [[0] * columns for _ in range(rows)]
+        sides = [
+            [(row, col) for row in range(rows) for col in range(half)],
+            [(row, col) for row in range(rows)
+             for col in range(half + 1, columns)],
+        ]
+        for team, cells in enumerate(sides):
+            wanted = min(int(len(cells) * fill), len(pools[team]))
+            for row, col in rng.sample(cells, wanted):
+                deployed = pools[team].pop()
+                board[row][col] = deployed
+                last_move = now - rng.randint(0, move_spread)
+                deployments[deployed] = (battle_id, row, col, last_move)
+
+        begins = now - rng.randint(0, settings.time // 2)
+        ends = begins + settings.time
+        battle_rows.append({
+            'id': battle_id,
+            'begins': begins,
+            'ends': ends,
+            'display_ends': ends,
+            'outside_data': {},
+            'active': True,
+            'relevant': True,
+            'state': {'board': board},
+            'victor': -1,
+            'scores': [0, 0],
+            'lockout': 0,
+        })
+
+    def user_rows():
+        for index, team in enumerate(teams):
+            yield {
+                'id': first_user + index,
+                'name': "synth%d" % (first_user + index),
+                'team': team,
+                'leader': 0,
+                'defectable': True,
+                'recruited': now,
+            }
+
+    def troop_rows():
+        for index in range(users):
+            for slot in range(troops_per_user):
+                tid = troop_id(index, slot)
+                battle_id, row, col, last_move = deployments.get(
+                    tid, (None, 0, 0, 0))
+                yield {
+                    'id': tid,
+                    'battle_id': battle_id,
+                    'owner_id': first_user + index,
+                    'hp': 1,
+                    'type': TROOP_TYPES[slot % len(TROOP_TYPES)],
+                    'cause_of_death': '',
+                    'row': row,
+                    'col': col,
+                    'visible': False,
+                    'opposed': False,
+                    'last_move': last_move,
+                }
+
+    with db.session() as s:
+        insert_batches(s, Battle.__table__, battle_rows, batch_size)
+        insert_batches(s, User.__table__, user_rows(), batch_size)
+        insert_batches(s, Troop.__table__, troop_rows(), batch_size)
+
+    return WorldSummary(users=users, troops=users * troops_per_user,
+                        battles=battles, deployed=len(deployments))
@@ -18,7 +18,6 @@ setup(
     install_requires=[
         "praw == 3.5.0",
         "pyparsing >=2.1.1",
-        "retrying >= 1.3.3",
-        "sqlalchemy >= 1.0.12",
+        "sqlalchemy >= 2.0",
     ],
 )
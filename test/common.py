@@ -5,6 +5,7 @@ from configparser import ConfigParser
 from chromabot2 import commands
 from chromabot2.bot import Chromabot
 from chromabot2.battle import Battle
+from chromabot2.config import Snapshot
 from chromabot2.models import User
 from chromabot2.outsiders import NullOutsider, Message
 from chromabot2.utils import now
@@ -18,6 +19,11 @@ class MockConf(object):
         # Some sane defaults
         self['bot'] = dict()
         self.bot['dbstring'] = "sqlite://"
+        # Fail loudly if something starts lazy loading in a loop; nothing a
+        # frame does should cost a query per troop
+        self.bot['query_budget'] = "100"
+        self.bot['query_budget_per_troop'] = "0"
+        self.bot['query_budget_strict'] = "true"
 
         self['battle'] = dict()
         self.battle['delay'] = "600"
@@ -30,8 +36,16 @@ class MockConf(object):
         self.battle['goal_score'] = "2"
         self.battle['kill_score'] = "1"
 
+        self.snapshot = None
+        self.refresh()
+
     def refresh(self):
-        pass
+        # Tests poke values straight into the parser, so there's no mtime to
+        # go by; just rebuild the snapshot every time.
+        self.snapshot = Snapshot.from_parser(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
 
     def __getitem__(self, key):
         return self.data[key]
@@ -0,0 +1,73 @@
+from chromabot2.archive import ArchivedBattle, archive_battles
+from chromabot2.battle import Battle, Troop
+from chromabot2.models import QueuedCommand
+from chromabot2.utils import now
+from test.common import ChromaTest
+
+
+class TestArchive(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.execute("attack #1 at C4 with infantry")
+        self.execute("attack #1 at I4 with cavalry", as_who=self.bob)
+        self.end_battle()
+        self.assertFalse(self.battle.relevant)
+        self.battle_id = self.battle.id
+
+    def archived(self):
+        with self.db.session() as s:
+            return s.query(ArchivedBattle).all()
+
+    def test_archive(self):
+        # Somebody who died in it and was never let go
+        troop = self.alice.troops[1]
+        with self.db.session() as s:
+            troop.hp = 0
+            troop.battle_id = self.battle_id
+            s.add(QueuedCommand(raw_text="status", issuer=self.alice,
+                                battle_id=self.battle_id))
+
+        self.assertEqual(archive_battles(self.outside, now() + 100, 50), 1)
+        archived, = self.archived()
+        self.assertEqual(archived.battle_id, self.battle_id)
+        self.assertEqual(archived.victor, -1)
+        self.assertEqual(archived.scores, [0, 0])
+        board = archived.board
+        self.assertEqual(board[3][2], [0, "infantry"])
+        self.assertEqual(board[3][8], [1, "cavalry"])
+        self.assertEqual(archived.stats['troops_left'], [1, 1])
+
+        with self.db.session() as s:
+            self.assertIsNone(s.get(Battle, self.battle_id))
+            linked = s.query(Troop).filter(Troop.battle_id.isnot(None))
+            self.assertEqual(linked.count(), 0)
+            entry, = s.query(QueuedCommand)
+            self.assertIsNone(entry.battle_id)
+        self.assertIsNone(self.outside.battles.get(self.battle_id))
+
+    def test_retention(self):
+        Battle.create(self.outside)
+        self.assertEqual(archive_battles(self.outside, now(), 3600), 0)
+        # Battles still going are never archived
+        self.assertEqual(archive_battles(self.outside, now() + 7200, 0), 1)
+        self.assertEqual(len(self.archived()), 1)
+        with self.db.session() as s:
+            self.assertEqual(s.query(Battle).count(), 1)
+
+    def test_bot_archives_every_so_often(self):
+        self.assertEqual(self.bot.archive(), 0)
+
+        self.config.bot['archive_after'] = "1"
+        self.config.refresh()
+        self.bot.archived_at = None
+        self.battle.ends = now() - 10
+        self.assertEqual(self.bot.archive(), 1)
+
+        # Not again until archive_every has gone by
+        self.battle = Battle.create(self.outside)
+        self.battle.end()
+        self.battle.ends = now() - 10
+        self.assertEqual(self.bot.archive(), 0)
+        self.bot.archived_at -= 3600
+        self.assertEqual(self.bot.archive(), 1)
@@ -0,0 +1,91 @@
+import asyncio
+
+from chromabot2.asyncbot import AsyncChromabot
+from chromabot2.battle import Battle
+from test import common
+from test.common import ChromaTest
+
+
+class AsyncTestOutsider(common.TestOutsider):
+    """Pretends every outward call takes a while"""
+
+    def __init__(self):
+        super().__init__()
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.posted = []
+        self.reported = []
+
+    async def slow(self):
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+    async def get_messages(self):
+        await self.slow()
+        return super().get_messages()
+
+    async def update_battle(self, battle):
+        board = battle.board
+        await self.slow()
+        self.posted.append((battle.id, board))
+
+    async def report_results(self, results):
+        await self.slow()
+        self.reported.extend(results)
+
+
+class TestAsyncBot(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.bot = AsyncChromabot(self.outside)
+
+    def bot_loop(self):
+        async def run():
+            results = await self.bot.loop_once()
+            await self.bot.settle()
+            return results
+        return asyncio.run(run())
+
+    def test_same_as_sync(self):
+        self.execute("attack #1 at C4 with infantry")
+        board = self.battle.realize_board()
+        self.assertEqual(board[3][2].type, "infantry")
+
+
+class TestAsyncOutsider(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.outside = AsyncTestOutsider()
+        self.config = self.outside.config
+        self.db = self.outside.db
+        self.db.create_all()
+        self.bot = AsyncChromabot(self.outside)
+        for _ in range(2):
+            Battle.create(self.outside).start()
+
+    def test_publishing_overlaps(self):
+        async def run():
+            await self.bot.loop_once()
+            # Still going after the frame's done
+            self.assertTrue(self.bot.publishing)
+            await self.bot.settle()
+        asyncio.run(run())
+
+        # Both boards and the results went out at the same time
+        self.assertEqual(len(self.outside.posted), 2)
+        self.assertEqual(self.outside.most_in_flight, 3)
+
+    def test_publish_errors_surface(self):
+        async def broken(battle):
+            raise ValueError("Reddit is down")
+        self.outside.update_battle = broken
+
+        async def run():
+            await self.bot.loop_once()
+            with self.assertRaises(ValueError):
+                await self.bot.settle()
+        asyncio.run(run())
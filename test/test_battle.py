@@ -1,6 +1,6 @@
 
 from chromabot2 import commands
-from chromabot2.battle import Battle, Troop
+from chromabot2.battle import Battle, BattleRegistry, Troop
 from chromabot2.utils import now
 
 from test.common import ChromaTest
@@ -95,7 +95,7 @@ class TestBattle(ChromaTest):
         self.assertFalse(board[3][9])
 
     def test_troop_unopposed_score(self):
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
         self.config.battle['troop_delay'] = "0"
@@ -111,18 +111,18 @@ class TestBattle(ChromaTest):
             self.assertEqual(expected_col, troop.col)
 
         # Still no scoring
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
         # Until now!
         self.bot_loop()
 
         # Should be double the usual goal score
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [4, 0])
 
     def test_troop_opposed_score(self):
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
         self.config.battle['troop_delay'] = "0"
@@ -141,18 +141,18 @@ class TestBattle(ChromaTest):
             self.assertEqual(expected_col, troop.col)
 
         # Should have got 1 point on the way there
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [1, 0])
 
         # Cross over
         self.bot_loop()
 
         # Just the usual goal score
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [3, 0])
 
     def test_troop_combat_win(self):
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
         ranged, infantry, winner = self.troop_combat_helper(
@@ -163,7 +163,7 @@ class TestBattle(ChromaTest):
         self.assertIn(winner, self.battle.troops)
 
         # PW should have 1 point for that
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 1])
 
     def test_troop_combat_win_made_visible(self):
@@ -177,7 +177,7 @@ class TestBattle(ChromaTest):
         self.assertTrue(winner.visible)
 
     def test_troop_combat_lose(self):
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
         cavalry, ranged, winner = self.troop_combat_helper("cavalry", "ranged")
@@ -186,11 +186,11 @@ class TestBattle(ChromaTest):
         self.assertFalse(cavalry.is_deployable())
 
         # PW should have 1 point for that
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 1])
 
     def test_troop_combat_tie(self):
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
         self.config.battle['troop_delay'] = "0"
@@ -207,7 +207,7 @@ class TestBattle(ChromaTest):
             self.assertTrue(troop.is_deployable())
 
         # No scores for that
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
     # These are  copy of the `test_circ` run in `test_db.py`, because
@@ -253,7 +253,7 @@ class TestBattle(ChromaTest):
 
     # End of CIRC tests
     def test_no_such_thing_as_friendly_fire(self):
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
         self.config.battle['troop_delay'] = "0"
@@ -281,7 +281,7 @@ class TestBattle(ChromaTest):
     def test_fight_ends(self):
         self.assertTrue(self.battle.relevant)
         # Also seems like a good place to test the winner
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [0, 0])
 
         self.config.battle['troop_delay'] = "0"
@@ -296,7 +296,7 @@ class TestBattle(ChromaTest):
             self.bot_loop()
             self.assertEqual(expected_col, troop.col)
         self.bot_loop()
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [4, 0])
 
         results = self.end_battle()
@@ -309,7 +309,7 @@ class TestBattle(ChromaTest):
         self.assertFalse(self.battle.relevant)
         self.assertEqual(self.battle.victor, self.alice.team)
 
-        scores = self.battle.load_scores()
+        scores = self.battle.scores
         self.assertEqual(scores, [4, 0])
 
     def test_fight_starts(self):
@@ -356,3 +356,54 @@ class TestBattle(ChromaTest):
         for troop in self.alice.troops:
             self.assertFalse(troop.is_deployable())
             self.assertFalse(troop.battle)
+
+
+class TestBattleRegistry(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.registry = self.outside.battles
+        self.registry.load()
+
+    def test_loaded_once(self):
+        battle_id = self.battle.id
+        before = self.db.queries.statements
+        for _ in range(3):
+            self.assertEqual(self.registry.active(), [self.battle])
+            self.assertIs(self.registry.get(battle_id), self.battle)
+        self.assertEqual(self.registry.ids(), [battle_id])
+        self.assertEqual(self.db.queries.statements, before)
+
+    def test_notices_changes(self):
+        battle2 = Battle.create(self.outside)
+        self.assertEqual(self.registry.ids(), [self.battle.id, battle2.id])
+        self.assertEqual(self.registry.ids(active=True), [self.battle.id])
+
+        battle2.start()
+        self.assertEqual(self.registry.active(), [self.battle, battle2])
+
+        self.battle.end()
+        self.assertEqual(self.registry.ids(), [battle2.id])
+        # Still there if asked for by name
+        self.assertIs(self.registry.get(self.battle.id), self.battle)
+
+    def test_commands_dont_query_battles(self):
+        self.execute("attack at C4 with infantry")
+        self.execute("attack #1 at C5 with cavalry")
+        sites = self.db.queries.sites
+        self.assertFalse([site for site in sites if "extract_battle" in site])
+
+    def test_posts(self):
+        class PostOutsider(type(self.outside)):
+            def post_key(self, battle):
+                return "post%d" % battle.id
+
+        outside = PostOutsider(self.config)
+        outside.db = self.db
+        registry = BattleRegistry(outside)
+        self.assertIs(registry.for_post("post1"), self.battle)
+        self.assertIsNone(registry.for_post("post2"))
+        self.assertEqual(registry.post_of(self.battle.id), "post1")
+
+        self.battle.end()
+        self.assertIsNone(registry.for_post("post1"))
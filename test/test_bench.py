@@ -0,0 +1,57 @@
+import unittest
+
+from bench import engine  # Registers the benchmarks
+from bench.runner import compare, run
+from bench.soak import soak
+
+
+class TestBench(unittest.TestCase):
+
+    def test_smoke(self):
+        # Not a benchmark, just making sure the suite itself still runs
+        names = ["battle_update", "realize_board", "parse_warm",
+                 "convert_comments"]
+        result = run(names, sizes=[(5, 3)], repeat=1)
+        self.assertEqual(sorted(result['results'].keys()), [
+            "battle_update[5x3]", "convert_comments", "parse_warm",
+            "realize_board[5x3]"])
+        for stats in result['results'].values():
+            self.assertEqual(stats['repeat'], 1)
+            self.assertGreater(stats['median'], 0)
+
+    def test_compare(self):
+        baseline = {'results': {
+            'fast': {'median': 1.0},
+            'slow': {'median': 1.0},
+            'new_since': {'median': 1.0},
+        }}
+        current = {'results': {
+            'fast': {'median': 1.1},
+            'slow': {'median': 2.0},
+            'brand_new': {'median': 5.0},
+        }}
+        regressions = compare(current, baseline, threshold=1.25)
+        self.assertEqual(regressions, [('slow', 1.0, 2.0, 2.0)])
+
+
+class TestSoak(unittest.TestCase):
+
+    def test_keeps_up(self):
+        report = soak(players=20, rate=120, interval=60, frames=4)
+        self.assertTrue(report['keeping_up'])
+        self.assertEqual(report['backlog']['final'], 0)
+        self.assertTrue(report['results'])
+
+    def test_reddit(self):
+        # The same, but through the reddit outsider and a fake reddit
+        report = soak(players=20, rate=120, interval=60, frames=3,
+                      reddit=True)
+        self.assertTrue(report['keeping_up'])
+        self.assertTrue(report['results'])
+
+    def test_falls_behind(self):
+        # Far more traffic than a 10-message inbox can ever drain
+        report = soak(players=20, rate=6000, interval=60, frames=6,
+                      max_batch=10)
+        self.assertFalse(report['keeping_up'])
+        self.assertGreater(report['backlog']['growth_per_frame'], 0)
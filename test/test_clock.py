@@ -0,0 +1,78 @@
+from chromabot2.battle import Battle, Troop
+from chromabot2.utils import AcceleratedClock, Clock, FixedClock
+from test.common import ChromaTest
+
+
+class TestClocks(ChromaTest):
+
+    def test_frame_is_frozen(self):
+        clock = Clock()
+        start = clock.begin_frame()
+        self.assertEqual(clock.now(), start)
+        clock.end_frame()
+        self.assertIsNone(clock.frozen)
+
+    def test_fixed_clock(self):
+        clock = FixedClock(1000)
+        self.assertEqual(clock.now(), 1000)
+        clock.sleep(60)
+        self.assertEqual(clock.now(), 1060)
+
+    def test_accelerated_clock(self):
+        clock = AcceleratedClock(10000, start=0)
+        clock.sleep(1000)  # 0.1 real seconds
+        self.assertGreaterEqual(clock.now(), 1000)
+
+
+class TestGameTime(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FixedClock()
+        self.outside.clock = self.clock
+
+    def test_troops_move_on_game_time(self):
+        # The default troop_delay is an hour, but game time is ours to move
+        self.execute("attack #1 at C4 with infantry")
+        board = self.battle.realize_board()
+        troop = board[3][2]
+        self.assertEqual(troop.last_move, self.clock.now())
+
+        self.bot_loop()
+        self.assertEqual(troop.col, 2)
+
+        self.clock.advance(3600)
+        self.bot_loop()
+        self.assertEqual(troop.col, 3)
+
+    def test_one_instant_per_frame(self):
+        self.outside.provide_message("attack #1 at C4 with infantry",
+                                     self.alice)
+        self.outside.provide_message("attack #1 at J4 with infantry",
+                                     self.bob)
+        start = self.clock.now()
+
+        # Time passing mid-frame doesn't change what the frame sees
+        real_begin = self.clock.begin_frame
+
+        def begin_and_advance():
+            frozen = real_begin()
+            self.clock.advance(500)
+            return frozen
+        self.clock.begin_frame = begin_and_advance
+        self.bot_loop()
+
+        with self.db.session() as s:
+            placed = s.query(Troop).filter(Troop.battle_id != None).all()
+        self.assertEqual(len(placed), 2)
+        for troop in placed:
+            self.assertEqual(troop.last_move, start)
+
+    def test_fast_forward(self):
+        self.execute("attack #1 at C4 with infantry")
+        results = self.bot.fast_forward(self.battle, factor=10 ** 7,
+                                        max_frames=1000)
+        self.assertFalse(self.battle.relevant)
+        self.assertIn(Battle, [type(result.extra) for result in results])
+        # And time's back to normal afterwards
+        self.assertIs(self.outside.clock, self.clock)
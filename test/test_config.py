@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+from chromabot2.config import Config, MATCHUPS, Snapshot
+
+CONFIG_TEXT = """
+[bot]
+dbstring = sqlite://
+sleep = 3
+
+[battle]
+delay = 600
+time = 7200
+columns = 11
+rows = 5
+troop_delay = 5
+goal_score = 2
+kill_score = 1
+
+[icons_0]
+infantry = I
+unknown = ?
+
+[icons_1]
+infantry = i
+unknown = ?
+"""
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".ini")
+        with os.fdopen(handle, "w") as f:
+            f.write(CONFIG_TEXT)
+        self.config = Config(self.path)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def rewrite(self, text):
+        with open(self.path, "w") as f:
+            f.write(text)
+        # Make sure the mtime visibly moves even on coarse filesystems
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns,
+                                stat.st_mtime_ns + 1000000000))
+
+    def test_snapshot_is_typed(self):
+        snap = self.config.snapshot
+        self.assertEqual(snap.bot.sleep, 3)
+        self.assertEqual(snap.battle.troop_delay, 5)
+        self.assertEqual(snap.battle.columns, 11)
+        # end_var is optional
+        self.assertEqual(snap.battle.end_var, 0)
+        self.assertEqual(snap.icons[(0, 'infantry')], 'I')
+        self.assertEqual(snap.icons[(1, 'infantry')], 'i')
+
+    def test_snapshot_is_immutable(self):
+        snap = self.config.snapshot
+        with self.assertRaises(AttributeError):
+            snap.battle.troop_delay = 0
+        with self.assertRaises(TypeError):
+            snap.icons[(0, 'infantry')] = 'X'
+
+    def test_refresh_unchanged_is_noop(self):
+        before = self.config.snapshot
+        self.assertFalse(self.config.refresh())
+        self.assertIs(before, self.config.snapshot)
+
+    def test_refresh_reloads_on_change(self):
+        before = self.config.snapshot
+        self.rewrite(CONFIG_TEXT.replace("troop_delay = 5",
+                                         "troop_delay = 50"))
+        self.assertTrue(self.config.refresh())
+        self.assertIsNot(before, self.config.snapshot)
+        self.assertEqual(self.config.snapshot.battle.troop_delay, 50)
+        # The old snapshot is left alone for anyone still holding it
+        self.assertEqual(before.battle.troop_delay, 5)
+
+    def test_force_refresh(self):
+        before = self.config.snapshot
+        self.assertTrue(self.config.refresh(force=True))
+        self.assertIsNot(before, self.config.snapshot)
+
+    def test_matchups(self):
+        self.assertEqual(MATCHUPS[('cavalry', 'infantry')], 1)
+        self.assertEqual(MATCHUPS[('infantry', 'cavalry')], -1)
+        self.assertEqual(MATCHUPS[('ranged', 'ranged')], 0)
+        self.assertIs(Snapshot.from_parser(self.config.data).matchups,
+                      MATCHUPS)
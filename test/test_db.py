@@ -1,5 +1,7 @@
+import time
 
-from chromabot2.models import User
+from chromabot2.db import DB, QueryBudget, QueryBudgetExceeded
+from chromabot2.models import Roster, User
 from chromabot2.battle import (
     Battle,
     Troop,
@@ -9,6 +11,7 @@ from chromabot2.battle import (
     BattleNotStartedException,
 )
 from chromabot2.utils import now
+from test import common
 from test.common import ChromaTest
 
 # These tests are for the raw functionality of db.py - unit tests, mostly.
@@ -54,6 +57,96 @@ class TestUser(ChromaTest):
         self.assertIn(troop, self.alice.troops)
 
 
+class FakeTimer:
+
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class TestRoster(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.timer = FakeTimer()
+        self.roster = Roster(self.db, stranger_ttl=60, timer=self.timer)
+
+    def queries_for(self, name):
+        self.db.begin_frame()
+        found = self.roster.find(name)
+        return found, self.db.queries.statements
+
+    def test_finds_players(self):
+        self.roster.load()
+        found, queries = self.queries_for("Alice")
+        self.assertEqual(found, self.alice)
+        self.assertLessEqual(queries, 1)
+
+        found, queries = self.queries_for("alice")
+        self.assertEqual(found, self.alice)
+        self.assertLessEqual(queries, 1)
+
+    def test_no_users_kept(self):
+        with self.db.session() as s:
+            for i in range(20):
+                s.add(User(name="extra%d" % i, team=0))
+            s.flush()
+            s.expunge_all()
+            before = len(s.identity_map)
+        self.roster.load()
+        self.assertEqual(len(self.roster.ids), 22)
+        with self.db.session() as s:
+            self.assertEqual(len(s.identity_map), before)
+
+    def test_strangers(self):
+        found, queries = self.queries_for("mallory")
+        self.assertIsNone(found)
+        self.assertTrue(self.roster.is_stranger("mallory"))
+        found, queries = self.queries_for("mallory")
+        self.assertIsNone(found)
+        self.assertEqual(queries, 0)
+
+        self.timer.time = 60
+        self.assertFalse(self.roster.is_stranger("mallory"))
+
+    def test_recruited_elsewhere(self):
+        self.roster.shared = True
+        self.roster.find("mallory")
+        # Another bot signs them up; no events fire for us
+        with self.db.new_session() as s:
+            s.execute(User.__table__.insert().values(name="mallory",
+                                                     team=1))
+        found, queries = self.queries_for("mallory")
+        self.assertEqual(found.name, "mallory")
+        self.assertFalse(self.roster.is_stranger("mallory"))
+
+    def test_renamed(self):
+        self.roster.load()
+        self.alice.name = "alicia"
+        with self.db.session() as s:
+            s.add(self.alice)
+        self.assertNotIn("alice", self.roster.ids)
+        self.assertEqual(self.roster.find("Alicia"), self.alice)
+
+    def test_kept_up_to_date(self):
+        self.roster.find("mallory")
+        mallory = User.create(self.db, "mallory", team=1)
+        self.assertFalse(self.roster.is_stranger("mallory"))
+        self.assertEqual(self.roster.ids["mallory"], mallory.id)
+
+        with self.db.session() as s:
+            s.delete(mallory)
+        self.assertNotIn("mallory", self.roster.ids)
+
+        # Only ones for this DB
+        other = common.TestOutsider()
+        other.db.create_all()
+        User.create(other.db, "carol", team=0)
+        self.assertNotIn("carol", self.roster.ids)
+
+
 class TestTroop(ChromaTest):
 
     def test_owner(self):
@@ -251,3 +344,99 @@ class TestBattle(ChromaTest):
         self.assertFalse(battle2.active)
         with self.assertRaises(BattleNotStartedException):
             battle2.place_troop(troop, col=1, row=2, outside=self.outside)
+
+
+class TestQueryCounting(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        # Flush whatever setUp left pending so it isn't counted
+        with self.db.session():
+            pass
+
+    def test_counts_statements(self):
+        self.db.begin_frame()
+        with self.db.session() as s:
+            s.query(User).filter_by(name="alice").first()
+            s.query(User).filter_by(name="bob").first()
+        stats = self.db.end_frame()
+        self.assertEqual(stats.statements, 2)
+        self.assertGreaterEqual(stats.seconds, 0)
+        # Both queries came from right here
+        sites = stats.worst_sites()
+        self.assertEqual(len(sites), 2)
+        for site, (count, _) in sites:
+            self.assertIn("test_db.py", site)
+            self.assertIn("test_counts_statements", site)
+            self.assertEqual(count, 1)
+
+    def test_frame_counts_reset(self):
+        self.bot_loop()
+        self.db.begin_frame()
+        self.assertEqual(self.db.queries.statements, 0)
+
+    def test_strict_budget(self):
+        self.db.budget = QueryBudget(base=1, per_troop=0, strict=True)
+        self.db.begin_frame()
+        with self.db.session() as s:
+            s.query(User).count()
+            s.query(Troop).count()
+        with self.assertRaises(QueryBudgetExceeded):
+            self.db.end_frame()
+
+    def test_upgrade(self):
+        db = DB(common.MockConf())
+        # What battles looked like before leases
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE TABLE battles (id INTEGER PRIMARY KEY, begins "
+                "INTEGER, ends INTEGER, lockout INTEGER)")
+        added = db.upgrade()
+        self.assertIn("battles.lease_owner", added)
+        self.assertNotIn("battles.begins", added)
+        self.assertEqual(db.upgrade(), [])
+        with db.new_session() as s:
+            self.assertEqual(s.query(Battle).count(), 0)
+            self.assertEqual(s.query(User).count(), 0)
+
+    def test_budget_follows_config(self):
+        self.db.begin_frame()
+        with self.db.session() as s:
+            s.query(User).count()
+            s.query(Troop).count()
+        self.db.end_frame()
+
+        self.config.bot['query_budget'] = "1"
+        self.config.refresh()
+        with self.assertRaises(QueryBudgetExceeded):
+            self.db.end_frame()
+
+    def test_failed_statements_forgotten(self):
+        self.db.begin_frame()
+        with self.db.engine.connect() as conn:
+            with self.assertRaises(Exception):
+                conn.exec_driver_sql("SELECT * FROM no_such_table")
+            started = time.perf_counter()
+            conn.exec_driver_sql("SELECT 1")
+            elapsed = time.perf_counter() - started
+        stats = self.db.end_frame()
+        # Only the one that worked, timed on its own
+        self.assertEqual(stats.statements, 1)
+        self.assertLessEqual(stats.seconds, elapsed)
+
+    def test_budget_scales_with_troops(self):
+        self.db.budget = QueryBudget(base=1, per_troop=1, strict=True)
+        self.db.begin_frame()
+        with self.db.session() as s:
+            s.query(User).count()
+            s.query(Troop).count()
+        self.db.end_frame(troops=1)
+
+    def test_lenient_budget_warns(self):
+        self.db.budget = QueryBudget(base=1)
+        self.db.begin_frame()
+        with self.db.session() as s:
+            s.query(User).count()
+            s.query(Troop).count()
+        with self.assertLogs(level='WARNING'):
+            self.db.end_frame()
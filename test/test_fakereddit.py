@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import time
+import unittest
+
+from chromabot2.archive import ArchivedBattle, archive_battles
+from chromabot2.battle import Battle
+from chromabot2.bot import Chromabot
+from chromabot2.fakereddit import FakeRedditOutsider
+from chromabot2.models import KeyValue, User
+from chromabot2.parser import parse
+from chromabot2.reddit import REPLY_SEPARATOR, AsyncRedditOutsider
+from chromabot2.remote import Plan, RateLimited, RemoteError
+from chromabot2.utils import FixedClock
+from test.common import MockConf
+
+
+class AsyncFakeRedditOutsider(FakeRedditOutsider, AsyncRedditOutsider):
+    """The async reddit outsider, talking to a FakeReddit"""
+
+
+def fake_conf():
+    conf = MockConf()
+    conf['reddit'] = {
+        'useragent': 'test',
+        'client_id': 'id',
+        'client_secret': 'secret',
+        'redirect_uri': 'http://localhost/',
+        'refresh_token': 'token',
+        'username': 'chromabot',
+        'headquarters': 'chromanauts',
+        'disputed_zone': 'fieldofkarmicglory',
+        'pm_only': 'false',
+        'assignment': 'uid',
+        # Retry straight away
+        'retry_base': '0',
+    }
+    conf.bot['query_budget_strict'] = "false"
+    return conf
+
+
+class TestFakeReddit(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.WARN)
+        self.conf = fake_conf()
+        self.outside = FakeRedditOutsider(self.conf)
+        self.reddit = self.outside.reddit
+        self.db = self.outside.db
+        self.db.create_all()
+        self.alice = User.create(self.db, "alice", team=0)
+
+    def check_recruits(self, outside, handle_recruits):
+        reddit = outside.reddit
+        hq = reddit.post("chromanauts", "[Recruitment] Sign up here")
+        reddit.comment(hq, "Carol", "Me!")
+        reddit.add_user("mallory", banned=True)
+        reddit.comment(hq, "mallory", "Me too")
+        reddit.comment(hq, "chromabot", "Welcome, everybody")
+        reddit.comment(hq, None, "[deleted]")
+
+        handle_recruits()
+        with outside.db.session() as s:
+            names = {user.name for user in s.query(User)}
+        self.assertEqual(names, {"alice", "carol"})
+        self.assertEqual(len(reddit.sent), 1)
+        self.assertIn("Welcome to team", reddit.sent[0][2])
+
+        # Nobody gets recruited twice
+        handle_recruits()
+        self.assertEqual(len(reddit.sent), 1)
+
+    def test_recruits(self):
+        self.check_recruits(self.outside, self.outside.handle_recruits)
+
+    def test_async_recruits(self):
+        outside = AsyncFakeRedditOutsider(self.conf)
+        self.addCleanup(outside.executor.shutdown)
+        outside.db.create_all()
+        User.create(outside.db, "alice", team=0)
+        self.check_recruits(
+            outside, lambda: asyncio.run(outside.handle_recruits()))
+
+    def test_big_thread(self):
+        battle = Battle.create(self.outside)
+        post = self.reddit.posts[-1]
+        self.assertEqual(post.title, 'The Eternal Battle Continues')
+        for index in range(450):
+            self.reddit.comment(post, "alice", ">status")
+        self.reddit.comment(post, "nobody", ">status")
+
+        messages = self.outside.get_messages()
+        self.assertEqual(len(messages), 450)
+        self.assertTrue(all(msg.battle is battle for msg in messages))
+        # 200 come with the post, the rest in three lots of 100
+        self.assertEqual(self.reddit.calls["morechildren"], 3)
+        # Somebody who hasn't signed up gets told how
+        self.assertEqual(len(self.reddit.sent), 1)
+
+        self.assertEqual(self.outside.get_messages(), [])
+
+        # They're only told once
+        self.reddit.comment(post, "nobody", ">status")
+        self.outside.get_messages()
+        self.assertEqual(len(self.reddit.sent), 1)
+
+    def test_battle_from_thread(self):
+        for _ in range(2):
+            battle = Battle.create(self.outside)
+            battle.start()
+        post = self.reddit.posts[-1]
+        self.reddit.comment(post, "alice", ">attack at c4 with infantry")
+
+        # With two battles on, the thread says which one
+        message, = self.outside.get_messages()
+        result = parse(message.raw_text).execute(message)
+        self.assertTrue(result.success)
+        self.assertIn("#%d" % battle.id, result.text)
+
+    def test_archive(self):
+        battle = Battle.create(self.outside)
+        post = self.reddit.posts[-1]
+        for _ in range(3):
+            self.reddit.comment(post, "alice", ">status")
+        self.outside.get_messages()
+        battle.end()
+
+        archive_battles(self.outside, battle.ends, 0)
+        with self.db.session() as s:
+            archived, = s.query(ArchivedBattle)
+            self.assertEqual(archived.outside_data, {
+                'reddit': {'fullname': post.name, 'id36': post.id}})
+            self.assertEqual(archived.stats['comments'], 3)
+
+    def test_prune(self):
+        self.conf.reddit['keep_seen'] = '2'
+        for _ in range(3):
+            self.reddit.message("alice", "status")
+        self.outside.get_messages()
+        self.outside.prune()
+        with self.db.session() as s:
+            self.assertEqual(s.query(KeyValue).count(), 2)
+
+    def test_frame(self):
+        bot = Chromabot(self.outside)
+        self.reddit.message("alice", ">status\n>status")
+        results = bot.loop_once()
+        self.assertEqual(len(results), 2)
+
+        # Both answers in one reply
+        (kind, to, text), = [sent for sent in self.reddit.sent
+                             if sent[0] == "reply"]
+        self.assertEqual(to.split("_")[0], "t4")
+        self.assertEqual(text.count(REPLY_SEPARATOR), 1)
+        self.assertEqual(self.reddit.unread, {})
+        # The eternal battle got its post
+        self.assertEqual(len(self.reddit.posts), 1)
+
+    def test_prefetch_sees_new_comments(self):
+        self.conf.bot['prefetch'] = "true"
+        self.conf.bot['sleep'] = "60"
+        reddit = self.reddit
+        Battle.create(self.outside).start()
+
+        class CommentingClock(FixedClock):
+            commented = False
+
+            def sleep(self, seconds):
+                super().sleep(seconds)
+                # Somebody comments while the bot's asleep
+                if not self.commented:
+                    reddit.comment(reddit.posts[0], "alice", ">status")
+                    self.commented = True
+                elif bot.prefetcher.pending:
+                    # Like a real sleep, long enough for the fetch to
+                    # finish before the next frame starts
+                    while bot.prefetcher.batches.empty():
+                        time.sleep(0.001)
+
+        bot = Chromabot(self.outside, clock=CommentingClock())
+        self.addCleanup(bot.close)
+        self.assertEqual(bot.loop_once(), [])
+        # The first frame edited the post, but the comment's still seen
+        self.assertTrue([sent for sent in reddit.sent if sent[0] == "edit"])
+        self.assertEqual(len(bot.loop_once()), 1)
+
+    def test_deferred_replies_sent_next_frame(self):
+        User.create(self.db, "carol", team=1)
+        bot = Chromabot(self.outside)
+        bot.loop_once()
+        self.reddit.message("alice", "status")
+        self.reddit.message("carol", "status")
+        # Only enough budget left this frame for one reply
+        self.outside.usage = None
+        self.outside.remote.plan = Plan(1, {'reply': 1}, {'reply': 1}, 0)
+        self.assertEqual(len(bot.loop_once()), 2)
+        replies = [sent for sent in self.reddit.sent if sent[0] == "reply"]
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(len(self.outside.unsent), 1)
+
+        # Next frame there's budget again, and the held back one goes first
+        self.reddit.message("alice", "status")
+        bot.loop_once()
+        replies = [sent for sent in self.reddit.sent if sent[0] == "reply"]
+        self.assertEqual(len(replies), 3)
+        self.assertNotEqual(replies[1][1], replies[2][1])
+        self.assertEqual(self.outside.unsent, [])
+
+    def test_result_edit_retried(self):
+        battle = Battle.create(self.outside)
+        battle.start()
+        battle.end()
+        # No edits at all this frame
+        self.outside.remote.plan = Plan(0, {'edit': 0}, {'edit': 1}, 0)
+        self.outside.report_battle_end(battle)
+        self.assertEqual([sent for sent in self.reddit.sent
+                          if sent[0] == "edit"], [])
+        self.assertEqual(len(self.outside.unfinished), 1)
+
+        # Next frame it's no longer relevant, but the result still goes up
+        self.outside.remote.plan = None
+        self.outside.report_results([])
+        (_, name, text), = [sent for sent in self.reddit.sent
+                            if sent[0] == "edit"]
+        self.assertEqual(name, self.reddit.posts[-1].name)
+        self.assertIn("COMPLETE", text)
+        self.assertEqual(self.outside.unfinished, [])
+
+    def test_submit_fails(self):
+        working = self.reddit.submit
+
+        def down(*args, **kwargs):
+            raise ConnectionError("Reddit's down")
+        self.reddit.submit = down
+        with self.assertRaises(RemoteError):
+            Battle.create(self.outside)
+        # Nothing half-made left behind
+        with self.db.session() as s:
+            self.assertEqual(s.query(Battle).count(), 0)
+
+        # The bot carries on, and tries again every frame until it works
+        bot = Chromabot(self.outside)
+        self.assertEqual(bot.loop_once(), [])
+        self.reddit.submit = working
+        bot.loop_once()
+        battle, = self.outside.battles.relevant()
+        self.assertEqual(battle.outside_data['reddit']['fullname'],
+                         self.reddit.posts[-1].name)
+
+    def test_startup_fails(self):
+        working = self.reddit.get_me
+
+        def down():
+            raise ConnectionError("Reddit's down")
+        self.reddit.get_me = down
+        bot = Chromabot(self.outside)
+        self.assertEqual(bot.loop_once(), [])
+        self.assertFalse(bot.started)
+
+        self.reddit.get_me = working
+        self.reddit.message("alice", "status")
+        self.assertEqual(len(bot.loop_once()), 1)
+        self.assertTrue(bot.started)
+
+    def test_flaky(self):
+        self.conf['fakereddit'] = {'error_rate': '0.2', 'seed': '3'}
+        outside = FakeRedditOutsider(self.conf)
+        outside.db.create_all()
+        User.create(outside.db, "alice", team=0)
+        bot = Chromabot(outside)
+        for _ in range(3):
+            outside.reddit.message("alice", "status")
+            bot.loop_once()
+        self.assertEqual(outside.reddit.unread, {})
+        replies = [sent for sent in outside.reddit.sent
+                   if sent[0] == "reply"]
+        self.assertEqual(len(replies), 3)
+
+    def test_rate_limit(self):
+        self.reddit.rate_limit = 5
+        self.reddit.message("alice", "status")
+        self.outside.get_messages()
+        self.assertEqual(self.outside.remote.quota.used, 2)
+        self.assertEqual(self.outside.remote.quota.remaining, 3)
+        for _ in range(5):
+            self.outside.get_messages()
+        # Past the limit everything's refused, but the frame goes on
+        self.assertEqual(self.outside.remote.quota.remaining, 0)
+
+        # Being refused is being told to wait, not reddit being down: no
+        # retries, and nothing against the breaker
+        before = self.reddit.calls["get_unread"]
+        with self.assertRaises(RateLimited):
+            self.outside.fetch_unread()
+        self.assertEqual(self.reddit.calls["get_unread"], before + 1)
+        self.assertEqual(self.outside.remote.breaker("inbox").failures, 0)
+        self.assertGreater(self.outside.remote.usage.deferred["inbox"], 0)
@@ -0,0 +1,90 @@
+import copy
+import pickle
+import unittest
+
+from sqlalchemy import event
+
+from chromabot2 import jsoncolumn
+from chromabot2.battle import Battle
+from chromabot2.jsoncolumn import TrackedDict, TrackedList, track, use_codec
+from test.common import ChromaTest
+
+
+class TestTracked(unittest.TestCase):
+
+    def test_nested(self):
+        data = track({'a': [1, {'b': []}]})
+        self.assertIsInstance(data, TrackedDict)
+        self.assertIsInstance(data['a'], TrackedList)
+        self.assertIs(data['a'][1].root, data)
+        self.assertIs(data['a'][1]['b'].root, data)
+        # Anything put in later gets tracked too
+        data['a'][1]['b'].append({'c': 1})
+        self.assertIs(data['a'][1]['b'][0].root, data)
+        self.assertEqual(data, {'a': [1, {'b': [{'c': 1}]}]})
+
+    def test_copies_are_plain(self):
+        data = track({'board': [[0, 1], [2, 0]]})
+        for other in (copy.deepcopy(data), pickle.loads(pickle.dumps(data))):
+            self.assertEqual(other, data)
+            self.assertIs(type(other), dict)
+            self.assertIs(type(other['board'][0]), list)
+
+
+class TestTrackedJSON(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.statements = []
+        event.listen(self.db.engine, "before_cursor_execute", self.record)
+
+    def tearDown(self):
+        event.remove(self.db.engine, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, *args):
+        if statement.startswith("UPDATE battles"):
+            self.statements.append(statement)
+
+    def reloaded(self):
+        with self.db.new_session() as s:
+            battle = s.get(Battle, self.battle.id)
+            return battle.board, battle.scores, battle.outside_data
+
+    def test_deep_changes_saved(self):
+        with self.db.session():
+            self.battle.board[1][2] = 7
+            self.battle.scores[0] += 1
+            self.battle.outside_data['test'].setdefault('seen', []).extend(
+                ["x", "y"])
+        board, scores, data = self.reloaded()
+        self.assertEqual(board[1][2], 7)
+        self.assertEqual(scores, [1, 0])
+        self.assertEqual(data['test']['seen'], ["x", "y"])
+
+    def test_only_changes_written(self):
+        with self.db.session():
+            self.battle.begins = 5
+        self.assertIn("begins", self.statements[-1])
+        self.assertNotIn("state", self.statements[-1])
+        self.assertNotIn("scores", self.statements[-1])
+
+        with self.db.session():
+            self.battle.scores[1] = 2
+        self.assertIn("scores", self.statements[-1])
+        self.assertNotIn("state", self.statements[-1])
+
+        # Reading doesn't count as changing
+        count = len(self.statements)
+        with self.db.session():
+            self.assertEqual(self.battle.board[0][0], 0)
+        self.assertEqual(len(self.statements), count)
+
+    def test_codecs(self):
+        for name in jsoncolumn.CODECS:
+            old = use_codec(name)
+            try:
+                with self.db.session():
+                    self.battle.outside_data['codec'] = name
+                self.assertEqual(self.reloaded()[2]['codec'], name)
+            finally:
+                use_codec(old.name)
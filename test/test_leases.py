@@ -0,0 +1,146 @@
+import os
+import tempfile
+import unittest
+
+from chromabot2.battle import Battle
+from chromabot2.bot import Chromabot
+from chromabot2.models import User
+from chromabot2.leases import LeaseManager
+from test.common import ChromaTest, MockConf, TestOutsider
+
+
+class FakeTimer:
+
+    def __init__(self, when=1000):
+        self.when = when
+
+    def __call__(self):
+        return self.when
+
+
+class TestLeases(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.second = Battle.create(self.outside)
+        self.battles = [self.battle, self.second]
+        self.timer = FakeTimer()
+        self.first_bot = LeaseManager(self.db, "first", self.timer)
+        self.second_bot = LeaseManager(self.db, "second", self.timer)
+
+    def test_share(self):
+        mine = self.first_bot.claim(self.battles, 60, workers=2)
+        theirs = self.second_bot.claim(self.battles, 60, workers=2)
+        self.assertEqual(len(mine), 1)
+        self.assertEqual(len(theirs), 1)
+        self.assertNotEqual(mine, theirs)
+
+        # Renewing keeps the same ones
+        self.assertEqual(self.first_bot.claim(self.battles, 60, workers=2),
+                         mine)
+
+    def test_rebalance(self):
+        self.assertEqual(self.first_bot.heartbeat(60), 1)
+        self.assertEqual(self.first_bot.claim(self.battles, 60),
+                         self.battles)
+        self.assertEqual(self.second_bot.claim(self.battles, 60), [])
+
+        # A new worker shows up, so the first gives one back
+        self.assertEqual(self.second_bot.heartbeat(60), 2)
+        self.assertEqual(
+            len(self.first_bot.claim(self.battles, 60, workers=2)), 1)
+        self.assertEqual(
+            len(self.second_bot.claim(self.battles, 60, workers=2)), 1)
+
+    def test_orphans(self):
+        self.first_bot.claim(self.battles, 60)
+        self.timer.when += 30
+        self.assertEqual(self.second_bot.claim(self.battles, 60), [])
+
+        # The first bot died without renewing
+        self.timer.when += 31
+        self.assertEqual(self.second_bot.claim(self.battles, 60),
+                         self.battles)
+
+    def test_chore(self):
+        self.assertTrue(self.first_bot.chore("inbox", 60))
+        self.assertFalse(self.second_bot.chore("inbox", 60))
+        self.assertTrue(self.first_bot.chore("inbox", 60))
+
+        self.first_bot.release()
+        self.assertTrue(self.second_bot.chore("inbox", 60))
+
+    def test_bot_skips_leased_battle(self):
+        self.config.bot['lease_time'] = "60"
+        self.config.battle['troop_delay'] = "0"
+        self.execute("attack #1 at C4 with infantry")
+        troop = self.battle.realize_board()[3][3]
+        self.assertTrue(troop)
+
+        # Another bot takes the battle over
+        with self.db.session():
+            self.battle.lease_owner = "elsewhere"
+            self.battle.lockout = self.bot.leases.timer() + 600
+        self.assertEqual(self.bot_loop(), [])
+        self.assertEqual(troop.col, 3)
+
+
+class TestTwoWorkers(unittest.TestCase):
+    """Two bots in role "all" sharing a DB file"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.bots = []
+        for name in ("first", "second"):
+            conf = MockConf()
+            conf.bot['dbstring'] = "sqlite:///%s" % self.path
+            conf.bot['lease_time'] = "60"
+            conf.bot['worker_id'] = name
+            conf.refresh()
+            self.bots.append(Chromabot(TestOutsider(conf)))
+        self.first, self.second = self.bots
+
+        outside = self.first.outside
+        outside.db.create_all()
+        self.alice = User.create(outside.db, "alice", team=0)
+        for _ in range(2):
+            Battle.create(outside).start()
+
+        # The first bot takes everything, then gives a battle up to the
+        # second once it knows about it
+        for bot in (self.first, self.second, self.first, self.second):
+            bot.loop_once()
+        self.assertEqual(self.first.held, [1])
+        self.assertEqual(self.second.held, [2])
+        self.assertIn("inbox", self.first.chores)
+        self.assertNotIn("inbox", self.second.chores)
+
+    def tearDown(self):
+        for bot in self.bots:
+            bot.close()
+            bot.outside.db.engine.dispose()
+        os.remove(self.path)
+
+    def board(self, battle_id):
+        with self.second.outside.db.new_session() as s:
+            return s.get(Battle, battle_id).board
+
+    def test_foreign_commands_queued(self):
+        self.first.outside.provide_message("attack #2 at C4 with infantry",
+                                           self.alice)
+        # Not run by the bot that read it...
+        self.assertEqual(self.first.loop_once(), [])
+        self.assertFalse(any(self.board(2)[3]))
+
+        # ...but by the one that holds the battle
+        results = self.second.loop_once()
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0].success, results[0].text)
+        troop_id = self.board(2)[3][2]
+        self.assertTrue(troop_id)
+
+        # And nothing writes over it
+        for bot in (self.first, self.second, self.first):
+            bot.loop_once()
+        self.assertEqual(self.board(2)[3][2], troop_id)
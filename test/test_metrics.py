@@ -0,0 +1,130 @@
+import os
+import pstats
+import tempfile
+import time
+
+from chromabot2.metrics import (
+    FrameMetrics,
+    Metrics,
+    NullSink,
+    PrometheusTextfileSink,
+)
+from chromabot2.profiling import FrameProfiler
+from test.common import ChromaTest
+
+
+class RecordingSink(NullSink):
+
+    def __init__(self):
+        self.frames = []
+
+    def emit(self, frame):
+        self.frames.append(frame)
+
+
+class TestMetrics(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.sink = RecordingSink()
+        self.bot.metrics = Metrics([self.sink])
+
+    def test_phases_recorded(self):
+        self.execute("attack #1 at C4 with infantry")
+        self.assertEqual(len(self.sink.frames), 1)
+        frame = self.sink.frames[0]
+        for phase in ("config", "recruits", "messages", "parse", "execute",
+                      "update", "update_battle", "report_results"):
+            self.assertIn(phase, frame.timings)
+        self.assertEqual(frame.counters["messages"], 1)
+        self.assertEqual(frame.counters["battles"], 1)
+        self.assertGreater(frame.duration, 0)
+
+    def test_troops_moved(self):
+        self.config.battle['troop_delay'] = "0"
+        self.execute("attack #1 at C4 with infantry")
+        self.bot_loop()
+        frame = self.sink.frames[-1]
+        self.assertEqual(frame.counters["troops_moved"], 1)
+
+    def test_halts_arent_moves(self):
+        self.config.battle['troop_delay'] = "0"
+        self.execute("attack #1 at C4 with infantry")
+        # The infantry's already moved on to D4, so it has to halt while
+        # the cavalry moves on
+        self.execute("attack #1 at E4 with cavalry")
+        frame = self.sink.frames[-1]
+        self.assertEqual(frame.counters["troops_moved"], 1)
+
+    def test_battle_end_reported(self):
+        self.end_battle()
+        frame = self.sink.frames[-1]
+        self.assertIn("report_battle_end", frame.timings)
+        self.assertNotIn("update_battle", frame.timings)
+
+    def test_broken_sink(self):
+        class BrokenSink(NullSink):
+            def emit(self, frame):
+                raise ValueError("Nope")
+
+        self.bot.metrics.sinks.insert(0, BrokenSink())
+        with self.assertLogs(level='ERROR'):
+            self.bot_loop()
+        # Other sinks still get their frame
+        self.assertEqual(len(self.sink.frames), 1)
+
+
+class TestPrometheusSink(ChromaTest):
+
+    def test_textfile(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "chromabot.prom")
+        sink = PrometheusTextfileSink(path)
+
+        for _ in range(2):
+            frame = FrameMetrics(1)
+            with frame.phase("parse"):
+                pass
+            frame.count("messages", 3)
+            frame.finish()
+            sink.emit(frame)
+
+        with open(path) as f:
+            text = f.read()
+        self.assertIn('chromabot_phase_seconds{phase="parse"}', text)
+        self.assertIn('chromabot_events_total{kind="messages"} 6', text)
+        self.assertIn('chromabot_frames_total 2', text)
+        # No temp files left lying around
+        self.assertEqual(os.listdir(directory), ["chromabot.prom"])
+
+
+class TestProfiler(ChromaTest):
+
+    def test_profile_every(self):
+        directory = tempfile.mkdtemp()
+        profiler = FrameProfiler(directory, every=2)
+        for _ in range(4):
+            profiler.call(self.bot_loop)
+
+        self.assertEqual(sorted(os.listdir(directory)), [
+            "frame-000002.collapsed", "frame-000002.pstats",
+            "frame-000004.collapsed", "frame-000004.pstats",
+        ])
+        # The pstats file should be loadable
+        stats = pstats.Stats(os.path.join(directory, "frame-000002.pstats"))
+        self.assertTrue(stats.total_calls)
+
+    def test_sample_mode(self):
+        directory = tempfile.mkdtemp()
+        profiler = FrameProfiler(directory, mode="sample", interval=0.001)
+
+        def slow():
+            time.sleep(0.05)
+            return "done"
+
+        self.assertEqual(profiler.call(slow), "done")
+        self.assertEqual(os.listdir(directory), ["frame-000001.collapsed"])
+        with open(os.path.join(directory, "frame-000001.collapsed")) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any("slow (" in line for line in lines))
@@ -1,9 +1,26 @@
+import os
+import subprocess
+import sys
 import unittest
 
 from pyparsing import ParseException
 
 from chromabot2.battle import SkirmishCommand
-from chromabot2.parser import parse
+from chromabot2.parser import fast_parse, grammar, parse, parse_recipe
+
+# Seconds a fresh interpreter may spend importing the bot.  Generous, since
+# it has to cover slow CI boxes; the point is to catch a regression back to
+# doing real work at import time.
+IMPORT_BUDGET = float(os.environ.get("CHROMABOT_IMPORT_BUDGET", "2.0"))
+
+IMPORT_PROBE = """
+import time
+start = time.perf_counter()
+import chromabot2.bot
+import chromabot2.parser
+elapsed = time.perf_counter() - start
+print(elapsed, chromabot2.parser._root is None)
+"""
 
 
 class TestSkirmish(unittest.TestCase):
@@ -96,3 +113,87 @@ class TestSkirmish(unittest.TestCase):
         src = "attack at ☃3 with infantry"
         with self.assertRaises(ParseException):
             parse(src)
+
+    def test_unicode_troop_type(self):
+        src = "attack at A1 with ☃ snowmen"
+        parsed = parse(src)
+        self.assertEqual(parsed.troop_type, "☃ snowmen")
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import_budget(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_PROBE],
+                                         cwd=root, universal_newlines=True)
+        elapsed, lazy = output.split()
+        self.assertEqual(lazy, "True",
+                         "The grammar should not be built at import time")
+        self.assertLess(float(elapsed), IMPORT_BUDGET)
+
+
+class TestParseCache(unittest.TestCase):
+
+    VARIANTS = [
+        "attack at a1 with infantry",
+        "oppose at b,2 with cavalry",
+        "support #3 at c4 with ranged",
+        "attack # 12 at d 5 with a rubber chicken",
+        "  attack   at   e ,  6   with   infantry  ",
+        "attack at f7 with ☃",
+        "status",
+        "defect  ",
+    ]
+
+    def test_fast_path_matches_grammar(self):
+        for src in self.VARIANTS:
+            with self.subTest(src=src):
+                recipe = fast_parse(src)
+                self.assertTrue(recipe, "%s should take the fast path" % src)
+                fast = recipe[0](recipe[1])
+                slow = grammar().parseString(src)[0]
+                self.assertIs(type(fast), type(slow))
+                if isinstance(slow, SkirmishCommand):
+                    for attr in ('raw_col', 'col', 'raw_row', 'row',
+                                 'troop_type', 'battle_id'):
+                        self.assertEqual(getattr(fast, attr),
+                                         getattr(slow, attr))
+
+    def test_unusual_falls_back(self):
+        for src in ["attack#7 at a1 with infantry",
+                    "attack at a1with infantry",
+                    "attack at a1 with infantry\nand more",
+                    "status please"]:
+            with self.subTest(src=src):
+                self.assertIsNone(fast_parse(src))
+                self.assertTrue(parse(src))
+
+    def test_fresh_commands(self):
+        first = parse("attack at A1 with infantry")
+        first.message = "mine"
+        second = parse("ATTACK AT A1 WITH INFANTRY")
+        self.assertIsNot(first, second)
+        self.assertIsNone(second.message)
+        self.assertEqual(second.troop_type, "infantry")
+
+    def test_tokens_not_shared(self):
+        for src in ["attack at a1 with infantry", "status",
+                    "attack#7 at a1 with infantry", "status please"]:
+            with self.subTest(src=src):
+                first = parse(src)
+                second = parse(src)
+                self.assertIsNot(first.tokens, second.tokens)
+                self.assertIsNot(first.tokens, parse_recipe(src)[1])
+
+    def test_cache_hit(self):
+        parse_recipe.cache_clear()
+        parse("status")
+        parse("Status")
+        info = parse_recipe.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1)
+
+    def test_errors_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(ParseException):
+                parse("hurbledurblewerble 4")
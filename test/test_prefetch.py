@@ -0,0 +1,114 @@
+import threading
+
+from chromabot2.bot import Chromabot
+from chromabot2.models import User
+from chromabot2.outsiders import Message
+from chromabot2.utils import FixedClock
+from test import common
+from test.common import ChromaTest
+
+
+class PrefetchOutsider(common.TestOutsider):
+    """An inbox that only goes away once its messages are marked read"""
+
+    can_prefetch = True
+
+    def __init__(self):
+        super().__init__()
+        self.remote = []
+        self.lock = threading.Lock()
+        self.fetched_on = set()
+        self.marked = set()
+
+    def deliver(self, raw_text, as_who):
+        with self.lock:
+            self.remote.append((len(self.remote), raw_text, as_who))
+
+    def fetch_inbox(self, targets):
+        self.fetched_on.add(threading.current_thread().name)
+        with self.lock:
+            return [item for item in self.remote
+                    if item[0] not in self.marked]
+
+    def convert_inbox(self, batch):
+        # No checking for what's been seen here; marking read has to be
+        # enough
+        messages = [Message(raw_text, who, self)
+                    for _, raw_text, who in batch]
+        return messages, [item[0] for item in batch]
+
+    def mark_inbox_read(self, read):
+        self.marked.update(read)
+
+
+class MailmanClock(FixedClock):
+    """Delivers whatever's waiting the first time the bot sleeps"""
+
+    def __init__(self, outside):
+        super().__init__()
+        self.outside = outside
+        self.waiting = []
+
+    def sleep(self, seconds):
+        super().sleep(seconds)
+        for raw_text, who in self.waiting:
+            self.outside.deliver(raw_text, who)
+        self.waiting = []
+
+
+class TestPrefetch(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.outside = PrefetchOutsider()
+        self.config = self.outside.config
+        self.db = self.outside.db
+        self.db.create_all()
+        self.config.bot['prefetch'] = "true"
+        self.bot = Chromabot(self.outside)
+        self.alice = User.create(self.db, "alice", team=0)
+        self.addCleanup(self.bot.close)
+
+    def test_fetched_in_background(self):
+        self.outside.deliver("status", self.alice)
+        results = self.bot_loop()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(self.outside.fetched_on, {"prefetch"})
+        self.assertIsNotNone(self.bot.prefetcher)
+
+    def test_nothing_twice(self):
+        self.outside.deliver("status", self.alice)
+        handled = []
+        for frame in range(4):
+            if frame == 1:
+                self.outside.deliver("status", self.alice)
+            handled.extend(self.bot_loop())
+        self.assertEqual(len(handled), 2)
+
+    def test_turned_off(self):
+        self.bot_loop()
+        self.config.bot['prefetch'] = "false"
+        self.bot_loop()
+        self.assertIsNone(self.bot.prefetcher)
+
+    def test_sees_what_came_in_while_asleep(self):
+        self.config.bot['sleep'] = "60"
+        self.config.refresh()
+        clock = MailmanClock(self.outside)
+        self.bot.outside.clock = clock
+        clock.waiting.append(("status", self.alice))
+        self.assertEqual(self.bot_loop(), [])
+        # It arrived while the first frame slept, so the second has it
+        self.assertEqual(len(self.bot_loop()), 1)
+
+    def test_no_sleep_fetches_straight_away(self):
+        self.config.refresh()
+        self.outside.deliver("status", self.alice)
+        # Nothing to hide the next fetch behind, so it overlaps the frame
+        self.assertEqual(len(self.bot.inbox()), 1)
+        self.assertTrue(self.bot.prefetcher.pending)
+
+        self.config.bot['sleep'] = "60"
+        self.config.refresh()
+        self.bot.inbox()
+        self.assertFalse(self.bot.prefetcher.pending)
@@ -0,0 +1,58 @@
+from chromabot2.bot import Chromabot
+from chromabot2.models import QueuedCommand
+from test.common import ChromaTest
+
+
+class TestCommandQueue(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        # Both share the outsider, and so the DB
+        self.ingest = Chromabot(self.outside, role="ingest")
+        self.simulate = Chromabot(self.outside, role="simulate")
+
+    def queued(self):
+        with self.db.session() as s:
+            return s.query(QueuedCommand).all()
+
+    def test_round_trip(self):
+        self.outside.provide_message("attack #1 at C4 with infantry",
+                                     self.alice)
+        self.assertEqual(self.ingest.loop_once(), [])
+        entries = self.queued()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].issuer, self.alice)
+        self.assertEqual(entries[0].raw_text,
+                         "attack #1 at C4 with infantry")
+        self.assertFalse(self.battle.realize_board()[3][2])
+
+        results = self.simulate.loop_once()
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0].success)
+        self.assertEqual(results[0].message.issuer, self.alice)
+        self.assertTrue(self.battle.realize_board()[3][2])
+        self.assertEqual(self.queued(), [])
+
+    def test_parse_errors_answered_at_once(self):
+        self.outside.provide_message("attack with everything", self.alice)
+        results = self.ingest.loop_once()
+        self.assertEqual(len(results), 1)
+        self.assertFalse(results[0].success)
+        self.assertEqual(self.queued(), [])
+
+    def test_battle_hint(self):
+        self.outside.provide_message("status", self.alice)
+        self.outside.provided_messages[0].battle = self.battle
+        self.ingest.loop_once()
+        self.assertEqual(self.queued()[0].battle, self.battle)
+
+    def test_batches(self):
+        self.config.bot['queue_batch'] = "2"
+        for _ in range(3):
+            self.outside.provide_message("status", self.alice)
+        self.ingest.loop_once()
+
+        self.assertEqual(len(self.simulate.loop_once()), 2)
+        self.assertEqual(len(self.queued()), 1)
+        self.assertEqual(len(self.simulate.loop_once()), 1)
+        self.assertEqual(self.queued(), [])
@@ -0,0 +1,161 @@
+import unittest
+
+import praw
+from requests import Response
+
+from chromabot2.commands import Result
+from chromabot2.reddit import (
+    REPLY_SEPARATOR,
+    RedditOutsider,
+    coalesce_replies,
+    is_permanent,
+    is_throttled,
+    is_transient,
+)
+from test.common import ChromaTest, MockConf
+
+
+class FakeMessage:
+
+    def __init__(self, issuer_name, source):
+        self.issuer_name = issuer_name
+        self.source = source
+
+
+class TestCoalesceReplies(ChromaTest):
+
+    def test_one_reply_per_comment(self):
+        comment = FakeMessage("alice", "t1_a")
+        same_comment = FakeMessage("alice", "t1_a")
+        pm = FakeMessage("alice", "t4_b")
+        other = FakeMessage("bob", "t1_c")
+        results = [
+            Result("one", comment),
+            Result("two", other),
+            Result("internal"),
+            Result("three", same_comment),
+            Result("four", pm),
+        ]
+        replies = coalesce_replies(results)
+        self.assertEqual(replies, [
+            (comment, ["one" + REPLY_SEPARATOR + "three"]),
+            (other, ["two"]),
+            (pm, ["four"]),
+        ])
+
+    def test_no_source(self):
+        first = FakeMessage("alice", None)
+        second = FakeMessage("alice", None)
+        replies = coalesce_replies([Result("one", first),
+                                    Result("two", second)])
+        self.assertEqual(replies, [(first, ["one"]), (second, ["two"])])
+
+    def test_split_when_too_long(self):
+        message = FakeMessage("alice", "t1_a")
+        texts = ["a" * 40, "b" * 40, "c" * 10, "d" * 250]
+        replies = coalesce_replies([Result(text, message) for text in texts],
+                                   limit=100)
+        (_, sent), = replies
+        self.assertTrue(all(len(reply) <= 100 for reply in sent))
+        self.assertEqual(sent[0], "a" * 40 + REPLY_SEPARATOR + "b" * 40)
+        self.assertEqual(sent[1], "c" * 10)
+        # Only a single result that's too long gets cut up
+        self.assertEqual(sent[2:], ["d" * 100, "d" * 100, "d" * 50])
+
+
+class TestErrors(unittest.TestCase):
+
+    def test_classified(self):
+        deleted = praw.errors.APIException("DELETED_COMMENT", "gone")
+        blocked = praw.errors.APIException("USER_BLOCKED", "nope")
+        slow = praw.errors.RateLimitExceeded(
+            "RATELIMIT", "you are doing that too much", "ratelimit",
+            {'ratelimit': 60})
+        missing = praw.errors.NotFound(None, "404 Not Found")
+        busy = praw.errors.HTTPException(None, "503 Service Unavailable")
+        too_many = Response()
+        too_many.status_code = 429
+        limited = praw.errors.HTTPException(too_many)
+        for error in (deleted, blocked, missing):
+            self.assertTrue(is_permanent(error))
+            self.assertFalse(is_transient(error))
+        for error in (slow, limited):
+            self.assertTrue(is_throttled(error))
+            self.assertFalse(is_permanent(error))
+            self.assertFalse(is_transient(error))
+        self.assertTrue(is_transient(busy))
+        self.assertFalse(is_permanent(busy) or is_throttled(busy))
+
+
+class FakeBattle:
+
+    def __init__(self, id36):
+        self.id = 1
+        self.outside_data = {
+            'reddit': {'id36': id36, 'fullname': 't3_' + id36}}
+
+
+class FakePost:
+
+    def __init__(self):
+        self.comments = []
+        self.edits = []
+
+    def replace_more_comments(self, **kwargs):
+        return []
+
+    def edit(self, text):
+        self.edits.append(text)
+
+
+class FakeReddit:
+
+    def __init__(self):
+        self.fetched = []
+
+    def get_submission(self, submission_id):
+        self.fetched.append(submission_id)
+        return FakePost()
+
+
+class TestPostCache(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        conf = MockConf()
+        conf['reddit'] = {
+            'useragent': 'test',
+            'client_id': 'id',
+            'client_secret': 'secret',
+            'username': 'chromabot',
+        }
+        self.reddit_outside = RedditOutsider(conf)
+        self.fake = self.reddit_outside.reddit = FakeReddit()
+
+    def test_once_per_frame(self):
+        outside = self.reddit_outside
+        outside.begin_frame()
+        outside.fetch_comments("abc")
+        outside.edit_post("abc", "Board goes here")
+        outside.get_post_for_battle(FakeBattle("abc"))
+        self.assertEqual(self.fake.fetched, ["abc"])
+
+        outside.begin_frame()
+        outside.edit_post("abc", "New board")
+        self.assertEqual(self.fake.fetched, ["abc", "abc"])
+
+    def test_invalidate(self):
+        outside = self.reddit_outside
+        battle = FakeBattle("abc")
+        self.assertEqual(outside.info_for(battle).id36, "abc")
+
+        # Changing the battle's data is noticed...
+        battle.outside_data = {
+            'reddit': {'id36': 'def', 'fullname': 't3_def'}}
+        self.assertEqual(outside.info_for(battle).fullname, "t3_def")
+
+        # ...and its post can be forgotten on purpose
+        outside.fetch_post("def")
+        outside.invalidate(battle)
+        outside.fetch_post("def")
+        self.assertEqual(self.fake.fetched, ["def", "def"])
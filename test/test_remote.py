@@ -0,0 +1,263 @@
+import random
+
+from chromabot2.remote import (
+    BudgetPlanner,
+    CircuitBreaker,
+    CircuitOpen,
+    Deferred,
+    RateLimited,
+    Rejected,
+    Remote,
+    RemoteError,
+    RetryPolicy,
+)
+from test.common import ChromaTest
+
+
+class Flaky:
+    """Fails the first `failures` calls, then works"""
+
+    def __init__(self, failures, error=IOError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, value="ok"):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("Try again")
+        return value
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class TestRetryPolicy(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.slept = []
+        self.policy = RetryPolicy(attempts=4, base=1, cap=5,
+                                  sleep=self.slept.append,
+                                  rng=random.Random(1))
+
+    def test_retries_until_it_works(self):
+        flaky = Flaky(2)
+        self.assertEqual(self.policy.call(flaky, "done"), "done")
+        self.assertEqual(flaky.calls, 3)
+        self.assertEqual(len(self.slept), 2)
+
+    def test_gives_up(self):
+        flaky = Flaky(10)
+        with self.assertRaises(IOError):
+            self.policy.call(flaky)
+        self.assertEqual(flaky.calls, 4)
+
+    def test_permanent_errors_not_retried(self):
+        self.policy.transient = lambda e: not isinstance(e, KeyError)
+        flaky = Flaky(10, error=KeyError)
+        with self.assertRaises(KeyError):
+            self.policy.call(flaky)
+        self.assertEqual(flaky.calls, 1)
+        self.assertFalse(self.slept)
+
+    def test_jitter(self):
+        for attempt in range(10):
+            delays = [self.policy.delay(attempt) for _ in range(50)]
+            ceiling = min(5, 2 ** attempt)
+            self.assertTrue(all(0 <= d <= ceiling for d in delays))
+            # Not everybody waits the same amount
+            self.assertGreater(len(set(delays)), 1)
+
+
+class TestCircuitBreaker(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.timer = FakeTimer()
+        self.breaker = CircuitBreaker("edit", threshold=3, cooldown=60,
+                                      timer=self.timer)
+
+    def test_opens(self):
+        for _ in range(2):
+            self.breaker.failed()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failed()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets(self):
+        self.breaker.failed()
+        self.breaker.failed()
+        self.breaker.succeeded()
+        self.breaker.failed()
+        self.assertTrue(self.breaker.allow())
+
+    def test_half_open(self):
+        for _ in range(3):
+            self.breaker.failed()
+        self.timer.time = 60
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # Just the one trial
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        # Trial failed, so wait again
+        self.breaker.failed()
+        self.assertFalse(self.breaker.allow())
+        self.timer.time = 120
+        self.assertTrue(self.breaker.allow())
+        self.breaker.succeeded()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+
+class TestRemote(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.timer = FakeTimer()
+        policy = RetryPolicy(attempts=2, sleep=lambda s: None,
+                             transient=lambda e: isinstance(e, IOError))
+        self.remote = Remote(policy, threshold=2, cooldown=30,
+                             timer=self.timer)
+
+    def test_wraps_failures(self):
+        with self.assertRaises(RemoteError) as raised:
+            self.remote.call("inbox", Flaky(10))
+        self.assertEqual(raised.exception.endpoint, "inbox")
+        self.assertIsInstance(raised.exception.cause, IOError)
+
+    def test_fails_fast(self):
+        flaky = Flaky(4)
+        for _ in range(2):
+            with self.assertRaises(RemoteError):
+                self.remote.call("inbox", flaky)
+        self.assertEqual(flaky.calls, 4)
+
+        with self.assertRaises(CircuitOpen):
+            self.remote.call("inbox", flaky)
+        self.assertEqual(flaky.calls, 4)
+
+        # Other endpoints carry on regardless
+        self.assertEqual(self.remote.call("edit", Flaky(0), "x"), "x")
+
+        self.timer.time = 30
+        self.assertEqual(self.remote.call("inbox", flaky), "ok")
+
+    def test_permanent_errors_pass_through(self):
+        for _ in range(3):
+            with self.assertRaises(KeyError):
+                self.remote.call("user", Flaky(10, error=KeyError))
+        self.assertTrue(self.remote.breaker("user").allow())
+
+    def test_rejected_and_throttled(self):
+        self.remote.policy.permanent = lambda e: isinstance(e, LookupError)
+        self.remote.policy.throttled = lambda e: isinstance(e, OverflowError)
+        for error, raised in ((LookupError, Rejected),
+                              (OverflowError, RateLimited)):
+            flaky = Flaky(10, error=error)
+            for _ in range(3):
+                with self.assertRaises(raised):
+                    self.remote.call("reply", flaky)
+            # Not retried, and no mark against everybody else's replies
+            self.assertEqual(flaky.calls, 3)
+            self.assertTrue(self.remote.breaker("reply").allow())
+        # Being told to slow down is a deferral, as far as planning goes
+        self.assertTrue(issubclass(RateLimited, Deferred))
+        self.assertEqual(self.remote.usage.deferred["reply"], 3)
+
+
+class TestBudget(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.timer = FakeTimer()
+        self.remote = Remote(RetryPolicy(attempts=1), timer=self.timer)
+        self.planner = BudgetPlanner(["reply", "inbox", "edit"], reserve=0,
+                                     timer=self.timer)
+
+    def request(self, remaining, reset=600):
+        """Pretend to hit the service once"""
+        self.remote.observe({
+            "x-ratelimit-remaining": str(remaining),
+            "x-ratelimit-used": "0",
+            "x-ratelimit-reset": str(reset),
+        })
+
+    def frame(self, calls):
+        """Runs a frame's worth of {endpoint: calls}; returns what got
+        deferred"""
+        deferred = []
+        for endpoint, count in calls.items():
+            for _ in range(count):
+                try:
+                    self.remote.call(endpoint, self.request,
+                                     self.remote.quota.remaining or 1000)
+                except Deferred:
+                    deferred.append(endpoint)
+        return deferred
+
+    def test_counts_requests(self):
+        def two_requests():
+            self.request(100)
+            self.request(99)
+        self.remote.call("inbox", two_requests)
+        self.request(98)  # Outside any call
+        usage = self.remote.take_usage()
+        self.assertEqual(usage.calls["inbox"], 1)
+        self.assertEqual(usage.requests["inbox"], 2)
+        self.assertEqual(usage.requests["other"], 1)
+        self.assertEqual(usage.cost("inbox"), 2)
+        self.assertEqual(self.remote.quota.left(), (98, 600))
+        self.assertEqual(self.remote.take_usage().requests, {})
+
+    def test_quota_expires(self):
+        self.request(5, reset=60)
+        self.timer.time = 60
+        self.assertIsNone(self.remote.quota.left())
+
+    def test_unknown_means_unlimited(self):
+        usage = self.remote.take_usage()
+        self.assertIsNone(self.planner.plan(self.remote.quota, usage))
+        self.timer.time = 60
+        # Still haven't heard anything about the rate limit
+        self.assertIsNone(self.planner.plan(self.remote.quota, usage))
+
+    def test_plenty(self):
+        self.planner.plan(self.remote.quota, self.remote.usage)
+        self.frame({"reply": 5, "inbox": 5, "edit": 5})
+        self.timer.time = 60
+        self.remote.plan = self.planner.plan(self.remote.quota,
+                                             self.remote.take_usage())
+        self.assertEqual(self.frame({"reply": 5, "inbox": 5, "edit": 5}),
+                         [])
+
+    def test_defers_lowest_priority(self):
+        self.planner.plan(self.remote.quota, self.remote.usage)
+        self.frame({"reply": 4, "inbox": 4, "edit": 4})
+        # 100 left for the next 10 frames
+        self.timer.time = 60
+        self.remote.quota.observe({"x-ratelimit-remaining": "100",
+                                   "x-ratelimit-reset": "600"})
+        plan = self.remote.plan = self.planner.plan(
+            self.remote.quota, self.remote.take_usage())
+        self.assertEqual(plan.budget, 10)
+        deferred = self.frame({"edit": 4, "inbox": 4, "reply": 4})
+        # Even though the edits went first, they're the ones that waited
+        self.assertEqual(deferred, ["edit"] * 2)
+        self.assertEqual(self.remote.usage.deferred["edit"], 2)
+
+    def test_unlisted_never_deferred(self):
+        self.planner.plan(self.remote.quota, self.remote.usage)
+        self.request(0)
+        self.timer.time = 60
+        self.remote.plan = self.planner.plan(self.remote.quota,
+                                             self.remote.take_usage())
+        self.assertEqual(self.frame({"auth": 3, "inbox": 1}), ["inbox"])
@@ -0,0 +1,96 @@
+import pickle
+
+from chromabot2.battle import Battle
+from chromabot2.models import User
+from chromabot2.simulation import BoardState, TroopState, tick
+from chromabot2.utils import FixedClock
+from test.common import ChromaTest
+
+
+class TestSimulation(ChromaTest):
+
+    def setUp(self):
+        super().setUp()
+        self.config.battle['troop_delay'] = "0"
+
+    def test_tick_is_pure(self):
+        self.execute("attack #1 at E4 with infantry")
+        self.execute("attack #1 at G4 with cavalry", as_who=self.bob)
+        snapshot = self.battle.snapshot()
+        before = pickle.dumps(snapshot)
+        settings = self.config.snapshot
+
+        first = tick(snapshot, 1, settings.battle, dict(settings.matchups))
+        second = tick(pickle.loads(before), 1, settings.battle,
+                      dict(settings.matchups))
+        self.assertEqual(first, second)
+        self.assertEqual(pickle.dumps(snapshot), before)
+        # Nothing's been written back
+        self.assertEqual(self.battle.board, snapshot.board)
+
+    def test_snapshot_in_one_query(self):
+        self.execute("attack #1 at E4 with infantry")
+        self.execute("attack #1 at G4 with cavalry", as_who=self.bob)
+        battle_id = self.battle.id
+        self.battle.board  # Refreshes the battle itself
+        before = self.db.queries.statements
+        snapshot = self.battle.snapshot()
+        self.assertEqual(self.db.queries.statements, before + 1)
+
+        self.assertIsInstance(snapshot, BoardState)
+        self.assertEqual(snapshot.id, battle_id)
+        infantry, cavalry = snapshot.troops
+        self.assertIsInstance(infantry, TroopState)
+        self.assertEqual((infantry.team, infantry.type), (0, "infantry"))
+        self.assertEqual((cavalry.team, cavalry.type), (1, "cavalry"))
+        self.assertFalse(hasattr(infantry, "__dict__"))
+        self.assertEqual(pickle.loads(pickle.dumps(infantry)), infantry)
+
+    def test_only_changes_applied(self):
+        clock = FixedClock()
+        self.outside.clock = clock
+        self.execute("attack #1 at E4 with infantry")
+        self.execute("attack #1 at G4 with cavalry", as_who=self.bob)
+        settings = self.config.snapshot
+        outcome = tick(self.battle.snapshot(), clock.now(),
+                       settings.battle, dict(settings.matchups))
+        cavalry = [troop for troop in self.bob.troops
+                   if troop.type == "cavalry"][0]
+        # The same clock, so it's only moved, and last_move's the same
+        self.assertEqual(outcome.troops, [{'id': cavalry.id, 'col': 4}])
+
+        with self.db.session():
+            self.battle.apply(outcome)
+        self.assertEqual(cavalry.col, 4)
+        self.assertEqual(self.battle.board[3][4], cavalry.id)
+        self.assertEqual(cavalry.last_move, clock.now())
+
+    def play(self, workers):
+        """Fights the same two battles with the given number of workers and
+        returns what happened"""
+        self.setUp()
+        self.config.bot['workers'] = workers
+        second = Battle.create(self.outside)
+        second.start()
+        carol = User.create(self.db, "carol", team=0)
+        dave = User.create(self.db, "dave", team=1)
+
+        results = []
+        results += self.execute("attack #1 at E4 with infantry")
+        results += self.execute("attack #1 at G4 with ranged",
+                                as_who=self.bob)
+        results += self.execute("attack #%d at E2 with cavalry" % second.id,
+                                as_who=carol)
+        results += self.execute("attack #%d at G2 with cavalry" % second.id,
+                                as_who=dave)
+        results += self.bot_loop()
+        self.bot.close()
+        return ([(result.code, result.text) for result in results],
+                self.battle.board, second.board,
+                self.battle.scores, second.scores)
+
+    def test_parallel_matches_serial(self):
+        serial = self.play("0")
+        parallel = self.play("2")
+        self.assertTrue(serial[0])
+        self.assertEqual(serial, parallel)
@@ -0,0 +1,68 @@
+from chromabot2.battle import Battle, Troop
+from chromabot2.models import User
+from chromabot2.worldgen import generate_world
+from test.common import ChromaTest, TestOutsider
+
+
+class TestWorldgen(ChromaTest):
+
+    def generate(self, db=None, **kw):
+        kw.setdefault('users', 60)
+        kw.setdefault('battles', 2)
+        kw.setdefault('fill', 0.5)
+        return generate_world(db or self.db, self.config.snapshot.battle,
+                              **kw)
+
+    def test_counts(self):
+        with self.db.session() as s:
+            users = s.query(User).count()
+            troops = s.query(Troop).count()
+            battles = s.query(Battle).count()
+
+        summary = self.generate()
+        self.assertEqual(summary.troops, 180)
+
+        with self.db.session() as s:
+            self.assertEqual(s.query(User).count(), users + 60)
+            self.assertEqual(s.query(Troop).count(), troops + 180)
+            self.assertEqual(s.query(Battle).count(), battles + 2)
+            deployed = s.query(Troop).filter(Troop.battle_id != None).count()
+            self.assertEqual(deployed, summary.deployed)
+
+    def test_boards_match_troops(self):
+        self.generate()
+        with self.db.session() as s:
+            battles = s.query(Battle).filter(Battle.id != self.battle.id)
+            for battle in battles:
+                board = battle.realize_board()
+                seen = 0
+                for row_number, row in enumerate(board):
+                    for col_number, troop in enumerate(row):
+                        if not troop:
+                            continue
+                        seen += 1
+                        self.assertEqual(troop.battle, battle)
+                        self.assertEqual(troop.row, row_number)
+                        self.assertEqual(troop.col, col_number)
+                        # Only ever on their own side
+                        if troop.team == 0:
+                            self.assertLess(col_number, len(row) // 2)
+                        else:
+                            self.assertGreater(col_number, len(row) // 2)
+                self.assertEqual(seen, len(battle.troops))
+
+    def test_reproducible(self):
+        boards = []
+        for _ in range(2):
+            outside = TestOutsider()
+            outside.db.create_all()
+            self.generate(db=outside.db, seed=42)
+            with outside.db.session() as s:
+                boards.append([battle.state for battle in s.query(Battle)])
+        self.assertEqual(boards[0], boards[1])
+
+    def test_frame_runs(self):
+        self.generate()
+        results = self.bot_loop()
+        # Some of those troops are due to move
+        self.assertTrue(results)